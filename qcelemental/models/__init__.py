@@ -5,6 +5,9 @@ except ImportError:
                       "`conda install pydantic -c conda-forge` or `pip install pydantic`")
 
 from .molecule import Molecule
+from .geometry_template import GeometryTemplate
+from .molecule_batch import MoleculeBatch
+from .molecule_index import FingerprintIndex, MoleculeIndex
 from .results import Result, ResultInput
 from .procedures import OptimizationInput, Optimization
 from .common_models import Provenance, ComputeError, FailedOperation
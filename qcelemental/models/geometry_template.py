@@ -0,0 +1,179 @@
+"""
+Geometry templates parsed once and evaluated for many variable assignments
+"""
+
+import itertools
+
+import numpy as np
+
+from ..molparse import ZMatrix, from_string, to_schema
+from ..molparse.zmat import _non_dummy_atoms, _nucleus_labels, _settled_fields
+from ..physical_constants import constants
+from .molecule import GEOMETRY_NOISE, Molecule, float_prep
+
+# Number of assignments converted together before their molecules are yielded
+TEMPLATE_CHUNK = 1024
+
+
+class GeometryTemplate:
+    """Molecule specification with variables, such as a scan coordinate, compiled once.
+
+    The ``psi4+`` string is parsed, and its nuclei, charges and multiplicities reconciled,
+    a single time. Each variable assignment then only costs its share of a vectorized
+    Z-matrix evaluation and a copy of the template Molecule with the new geometry.
+
+    Parameters
+    ----------
+    molstr : str
+        Molecule in the ``psi4+`` format, Z-matrix and/or Cartesian lines with variables.
+    name : str, optional
+        Name of the molecules, overriding any in `molstr`.
+    fix_com : bool, optional
+        Whether the molecules may be translated.
+    fix_orientation : bool, optional
+        Whether the molecules may be rotated.
+    fix_symmetry : str, optional
+        Maximal point group symmetry.
+
+    Examples
+    --------
+
+    >>> template = GeometryTemplate('''
+    ... He
+    ... He 1 R
+    ... R = 3.0
+    ... ''')
+    >>> scan = list(template.molecules({'R': R} for R in np.linspace(2.5, 5.0, 26)))
+
+    """
+
+    def __init__(self, molstr, name=None, fix_com=None, fix_orientation=None, fix_symmetry=None):
+        molrec = from_string(
+            molstr, dtype='psi4+', name=name, fix_com=fix_com, fix_orientation=fix_orientation,
+            fix_symmetry=fix_symmetry)['qm']
+
+        self.defaults = dict((str(k), v) for k, v in molrec['variables'])
+        self._zmat = ZMatrix(molrec['geom_unsettled'], labels=_nucleus_labels(molrec))
+        self._keep = _non_dummy_atoms(molrec)
+        self._molrec = _settled_fields(molrec, self._keep)
+
+        # Same conversion as to_schema, so that molecules match those built through it
+        if molrec['units'] == 'Angstrom' and 'input_units_to_au' in molrec:
+            self._to_bohr = molrec['input_units_to_au']
+        else:
+            self._to_bohr = constants.conversion_factor(molrec['units'], 'Bohr')
+        self._molecule = None
+
+    @property
+    def variables(self):
+        """Names of the variables of the template."""
+        return list(self._zmat.variables)
+
+    def __repr__(self):
+        return "GeometryTemplate(nat={}, variables={})".format(int(self._keep.sum()), self.variables)
+
+    def _table(self, assignments):
+        """
+        Returns a dictionary of 1-D value arrays of each variable for a list of assignments.
+        """
+        assignments = [a if isinstance(a, dict) else dict((str(k), v) for k, v in a) for a in assignments]
+
+        table = {}
+        for name in self._zmat.variables:
+            values = [a.get(name, self.defaults.get(name)) for a in assignments]
+            if None not in values:  # otherwise left for ZMatrix to report as missing
+                table[name] = np.array(values, dtype=np.double)
+        return table
+
+    def geometries(self, assignments):
+        """
+        Evaluates the geometries of many variable assignments at once.
+
+        Parameters
+        ----------
+        assignments : Union[dict, Iterable[dict]]
+            Either a dictionary of 1-D arrays of values per variable, or an iterable of
+            per-point dictionaries. Variables not assigned take their values from the template.
+
+        Returns
+        -------
+        np.ndarray
+            (nset, nat, 3) Geometries in the units of the template, without dummy atoms.
+        """
+        if isinstance(assignments, dict):
+            table = dict(self.defaults)
+            table.update(assignments)
+            nset = max([np.size(v) for v in assignments.values()] + [1])
+            table = {k: np.broadcast_to(np.asarray(v, dtype=np.double), (nset, )) for k, v in table.items()}
+        else:
+            assignments = list(assignments)
+            nset = len(assignments)
+            table = self._table(assignments)
+
+        geometries = self._zmat.cartesian(table)
+        if geometries.ndim == 2:  # no variables
+            geometries = np.repeat(geometries[None], nset, axis=0)
+        return geometries[:, self._keep]
+
+    def _chunks(self, assignments, chunksize):
+        if isinstance(assignments, dict):
+            yield self.geometries(assignments)
+            return
+
+        assignments = iter(assignments)
+        while True:
+            chunk = list(itertools.islice(assignments, chunksize))
+            if not chunk:
+                return
+            yield self.geometries(chunk)
+
+    def molrecs(self, assignments, chunksize=TEMPLATE_CHUNK):
+        """
+        Lazily yields a molrec for each variable assignment, see `geometries`.
+        """
+        for geometries in self._chunks(assignments, chunksize):
+            for geom in geometries:
+                molrec = dict(self._molrec)
+                molrec['geom'] = geom.ravel()
+                yield molrec
+
+    def molecules(self, assignments, orient=False, chunksize=TEMPLATE_CHUNK):
+        """
+        Lazily yields a Molecule for each variable assignment, see `geometries`.
+
+        Parameters
+        ----------
+        assignments : Union[dict, Iterable[dict]]
+            The variable assignments.
+        orient : bool, optional
+            Orientates each molecule to a standard frame or not.
+        chunksize : int, optional
+            Number of assignments evaluated together.
+
+        Yields
+        ------
+        Molecule
+            The molecule of each assignment, equal to building it from the settled molrec.
+        """
+        if self._molecule is None:
+            molrec = dict(self._molrec)
+            molrec['geom'] = np.zeros(3 * int(self._keep.sum()))
+            self._molecule = Molecule(orient=False, **to_schema(molrec, dtype=1)['molecule'])
+        masses = self._molecule.__values__['masses']
+
+        for geometries in self._chunks(assignments, chunksize):
+            nset, nat = geometries.shape[:2]
+            geometries = (geometries * self._to_bohr).reshape(-1, 3)
+            transforms = None
+            if orient:
+                geometries, transforms = Molecule._orient_geometries(
+                    geometries, np.tile(masses, nset), np.arange(nset) * nat, return_transform=True)
+            geometries = float_prep(geometries, GEOMETRY_NOISE, inplace=True).reshape(nset, nat, 3)
+
+            for index, geom in enumerate(geometries):
+                geom = geom.copy()
+                geom.flags.writeable = False
+                mol = self._molecule.copy(update={'geometry': geom})
+                if transforms is not None:
+                    mol.__dict__['_frame_transform'] = transforms[index]
+                yield mol
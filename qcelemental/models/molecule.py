@@ -3,18 +3,22 @@ Molecule Object Model
 """
 
 import collections
+import copy
 import hashlib
+import itertools
 import json
 import os
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List
 
 import numpy as np
 from pydantic import BaseModel, Extra, validator
 
 from ..molparse import from_arrays, from_string, to_schema
+from ..covalent_radii import covalentradii
 from ..periodic_table import periodictable
 from ..physical_constants import constants
-from ..util import measure_coordinates, provenance_stamp
+from ..util import (FrameTransform, InternalCoordinates, detect_point_group, distance_matrix, measure_coordinates,
+                    provenance_stamp)
 from .common_models import Provenance, ndarray_encoder
 
 # Rounding quantities for hashing
@@ -22,14 +26,25 @@ GEOMETRY_NOISE = 8
 MASS_NOISE = 6
 CHARGE_NOISE = 4
 
+# Canonical hashes compare geometries after a rotation, so they are rounded more coarsely
+CANONICAL_GEOMETRY_NOISE = 4
+CANONICAL_TOLERANCE = 10**(-CANONICAL_GEOMETRY_NOISE)
 
-def float_prep(array, around):
+# Maximum number of atom pairs held in memory at once by blocked pairwise kernels
+PAIR_BLOCK_ELEMENTS = 2**20
+
+
+def float_prep(array, around, inplace=False):
     """
     Rounds floats to a common value and build positive zero's to prevent hash conflicts.
+    If `inplace`, an ndarray is rounded in place rather than copied.
     """
     if isinstance(array, (list, np.ndarray)):
         # Round array
-        array = np.around(array, around)
+        if inplace and isinstance(array, np.ndarray):
+            np.around(array, around, out=array)
+        else:
+            array = np.around(array, around)
         # Flip zeros
         array[np.abs(array) < 5**(-(around + 1))] = 0
 
@@ -43,6 +58,31 @@ def float_prep(array, around):
     return array
 
 
+def _mix64(x):
+    """
+    SplitMix64 finalizer applied elementwise to a uint64 array, used to scramble graph labels.
+    """
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def _is_frozen(array):
+    """
+    Returns whether no array in the `base` chain of `array` is writeable, so its data cannot change.
+    """
+    while True:
+        if array.flags.writeable:
+            return False
+        if array.flags.owndata:
+            return True
+        if not isinstance(array.base, np.ndarray):  # Foreign buffers may be writeable elsewhere
+            return False
+        array = array.base
+
+
 class NPArray(np.ndarray):
     @classmethod
     def __get_validators__(cls):
@@ -50,6 +90,10 @@ class NPArray(np.ndarray):
 
     @classmethod
     def validate(cls, v):
+        # Frozen float64 arrays cannot change underneath us, so they are adopted without a copy
+        if isinstance(v, np.ndarray) and v.dtype == np.double and v.flags.c_contiguous and _is_frozen(v):
+            return v
+
         try:
             v = np.array(v, dtype=np.double)
         except:
@@ -57,6 +101,183 @@ class NPArray(np.ndarray):
         return v
 
 
+class InternedStrings:
+    """
+    Compact storage of a list of strings as integer codes into a table of the unique strings.
+    """
+
+    __slots__ = ("codes", "table")
+
+    def __init__(self, codes, table):
+        self.codes = codes
+        self.table = table
+
+    @classmethod
+    def from_list(cls, strings, transform=None):
+        lookup = {}
+        codes = np.fromiter((lookup.setdefault(x, len(lookup)) for x in strings), dtype=np.int64, count=len(strings))
+        table = list(lookup)
+
+        # Transforming may merge entries of the table, so re-intern the transformed table
+        if transform is not None:
+            merged = {}
+            remap = np.array([merged.setdefault(transform(x), len(merged)) for x in table], dtype=np.int64)
+            codes = remap[codes] if codes.shape[0] else codes
+            table = list(merged)
+
+        return cls(codes.astype(np.min_scalar_type(max(len(table) - 1, 0))), tuple(table))
+
+    def take(self, indices):
+        return InternedStrings(self.codes[indices], self.table)
+
+    def tolist(self):
+        return np.array(self.table, dtype=object)[self.codes].tolist()
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+class RaggedIndices:
+    """
+    Compact storage of a list of lists of integers as offsets into a flat index array (CSR layout).
+    """
+
+    __slots__ = ("ptr", "indices")
+
+    def __init__(self, ptr, indices):
+        self.ptr = ptr
+        self.indices = indices
+
+    @classmethod
+    def from_list(cls, lists):
+        ptr = np.cumsum([0] + [len(x) for x in lists], dtype=np.int64)
+        indices = np.fromiter((x for row in lists for x in row), dtype=np.int64, count=int(ptr[-1]))
+        return cls(ptr, indices.astype(np.int32))
+
+    def tolist(self):
+        return [self.indices[self.ptr[i]:self.ptr[i + 1]].tolist() for i in range(len(self))]
+
+    def __getitem__(self, index):
+        return self.indices[self.ptr[index]:self.ptr[index + 1]]
+
+    def __len__(self):
+        return self.ptr.shape[0] - 1
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+class BondArray:
+    """
+    Compact storage of a connectivity list as (nbond, 2) atom index pairs and their bond orders.
+    """
+
+    __slots__ = ("atoms", "orders")
+
+    def __init__(self, atoms, orders):
+        self.atoms = atoms
+        self.orders = orders
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, v):
+        if isinstance(v, cls):
+            return v
+        return cls.from_array(v)
+
+    @classmethod
+    def from_array(cls, bonds):
+        """
+        Builds from any (nbond, 3) array_like of ``(at1, at2, bond_order)`` rows, checked all at once.
+        """
+        try:
+            bonds = np.asarray(bonds, dtype=np.double)
+        except (TypeError, ValueError):
+            raise ValueError("Connectivity must be castable to shape (nbond, 3).")
+        if bonds.size == 0:
+            bonds = bonds.reshape(0, 3)
+        if bonds.ndim != 2 or bonds.shape[1] != 3:
+            raise ValueError("Connectivity must be castable to shape (nbond, 3), found {}.".format(bonds.shape))
+
+        atoms = bonds[:, :2]
+        if np.any(atoms < 0) or np.any(atoms != np.floor(atoms)):
+            raise ValueError("Connectivity atom indices must be non-negative integers.")
+        orders = bonds[:, 2]
+        if np.any((orders < 0) | (orders > 5)):
+            raise ValueError("Connectivity bond orders must be within [0, 5].")
+
+        return cls(atoms.astype(np.int32), orders.copy())
+
+    def tolist(self):
+        return list(zip(self.atoms[:, 0].tolist(), self.atoms[:, 1].tolist(), self.orders.tolist()))
+
+    def __len__(self):
+        return self.orders.shape[0]
+
+    def __repr__(self):
+        return repr(self.tolist())
+
+
+# Fields validated as lists but held as compact arrays, with the list form built on access
+COMPACT_FIELDS = {"symbols", "masses", "real", "atomic_numbers", "mass_numbers", "fragments", "connectivity"}
+
+# Conversion of unvalidated values, such as those given to copy(update=...), to the compact storage
+_COMPACT_PACKERS = {
+    "symbols": lambda v: v if isinstance(v, InternedStrings) else InternedStrings.from_list(list(v)),
+    "masses": lambda v: np.array(v, dtype=np.double),
+    "real": lambda v: np.array(v, dtype=bool),
+    "atomic_numbers": lambda v: np.array(v, dtype=np.int16),
+    "mass_numbers": lambda v: np.array(v, dtype=np.int16),
+    "fragments": lambda v: v if isinstance(v, RaggedIndices) else RaggedIndices.from_list(v),
+    "connectivity": lambda v: v if isinstance(v, BondArray) else BondArray.from_array(v),
+}
+
+
+def _tolerance_ranks(values, tolerance):
+    """
+    Ranks values so that runs separated by gaps no larger than `tolerance` share a rank.
+    """
+    order = np.argsort(values, kind="stable")
+    ranks = np.empty(values.shape[0], dtype=np.intp)
+    ranks[order] = np.cumsum(np.diff(values[order], prepend=values[order][:1]) > tolerance)
+    return ranks
+
+
+def _first_class(classes, radius, height=None):
+    """
+    Returns the atoms of the lowest class at the smallest bucketed `radius` (then `height`),
+    ignoring atoms within the canonical tolerance of the origin or axis.
+    """
+    candidates = np.flatnonzero(radius > CANONICAL_TOLERANCE)
+    keys = [classes, _tolerance_ranks(radius, CANONICAL_TOLERANCE)]
+    if height is not None:
+        keys.append(_tolerance_ranks(height, CANONICAL_TOLERANCE))
+    keys = np.column_stack(keys)[candidates]
+    if not candidates.size:
+        return candidates
+
+    # lexsort uses the last key as the primary one
+    lowest = keys[np.lexsort(keys.T[::-1])[0]]
+    return candidates[(keys == lowest).all(axis=1)]
+
+
+def _unpack_compact(value):
+    """
+    Returns the list form of a compact field, tolerating values that were never packed.
+    """
+    if value is None:
+        return None
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return list(value)
+
+
 class Identifiers(BaseModel):
     """Canonical chemical identifiers"""
 
@@ -101,7 +322,7 @@ class Molecule(BaseModel):
     mass_numbers: List[int] = None
 
     # Fragment and connection data
-    connectivity: List[Tuple[int, int, float]] = []
+    connectivity: BondArray = []
     fragments: List[List[int]] = None
     fragment_charges: List[float] = None
     fragment_multiplicities: List[int] = None
@@ -127,38 +348,88 @@ class Molecule(BaseModel):
         # All attributes set bellow are equivalent to the default set.
         values = self.__values__
 
-        values["symbols"] = [s.title() for s in self.symbols]  # Title case
+        values["symbols"] = InternedStrings.from_list(values["symbols"], str.title)  # Title case
+
+        if not isinstance(values["connectivity"], BondArray):  # Unvalidated default
+            values["connectivity"] = BondArray.from_array(values["connectivity"])
 
         if values["masses"] is None:  # Setup masses before fixing the orientation
-            values["masses"] = [periodictable.to_mass(x) for x in values["symbols"]]
+            table_masses = np.array([periodictable.to_mass(x) for x in values["symbols"].table], dtype=np.double)
+            values["masses"] = table_masses[values["symbols"].codes]
+        else:
+            values["masses"] = np.array(values["masses"], dtype=np.double)
 
         if values["real"] is None:
-            values["real"] = [True for _ in values["symbols"]]
+            values["real"] = np.ones(len(values["symbols"]), dtype=bool)
+        else:
+            values["real"] = np.array(values["real"], dtype=bool)
+
+        for field in ["atomic_numbers", "mass_numbers"]:
+            if values[field] is not None:
+                values[field] = np.array(values[field], dtype=np.int16)
 
         if orient:
-            values["geometry"] = float_prep(self._orient_molecule_internal(), GEOMETRY_NOISE)
+            geometry, transform = self._orient_molecule_internal(return_transform=True)
+            values["geometry"] = float_prep(geometry, GEOMETRY_NOISE, inplace=True)
+            self.__dict__["_frame_transform"] = transform
+        elif values["geometry"].flags.writeable:
+            # Validation made a private copy, so round it in place
+            values["geometry"] = float_prep(values["geometry"], GEOMETRY_NOISE, inplace=True)
         else:
-            values["geometry"] = float_prep(values["geometry"], GEOMETRY_NOISE)
+            # Adopted input, keep it unless rounding changes any bits (including signed zeros)
+            prepped = float_prep(values["geometry"], GEOMETRY_NOISE)
+            if not np.array_equal(prepped.view(np.int64), values["geometry"].view(np.int64)):
+                values["geometry"] = prepped
+        values["geometry"].flags.writeable = False
 
         # Cleanup un-initialized variables  (more complex than Pydantic Validators allow)
         if not values["fragments"]:
             natoms = values["geometry"].shape[0]
-            values["fragments"] = [list(range(natoms))]
+            values["fragments"] = RaggedIndices(np.array([0, natoms]), np.arange(natoms, dtype=np.int32))
             values["fragment_charges"] = [values["molecular_charge"]]
             values["fragment_multiplicities"] = [values["molecular_multiplicity"]]
         else:
+            values["fragments"] = RaggedIndices.from_list(values["fragments"])
             if not values["fragment_charges"]:
                 if np.isclose(values["molecular_charge"], 0.0):
-                    values["fragment_charges"] = [0 for _ in values["fragments"]]
+                    values["fragment_charges"] = [0 for _ in range(len(values["fragments"]))]
                 else:
                     raise KeyError("Fragments passed in, but not fragment charges for a charged molecule.")
 
             if not values["fragment_multiplicities"]:
                 if values["molecular_multiplicity"] == 1:
-                    values["fragment_multiplicities"] = [1 for _ in values["fragments"]]
+                    values["fragment_multiplicities"] = [1 for _ in range(len(values["fragments"]))]
                 else:
                     raise KeyError("Fragments passed in, but not fragment multiplicities for a non-singlet molecule.")
 
+    def __getattr__(self, name):
+        # Compact fields are unpacked into a fresh list on every access, so edits to it cannot
+        # leave the molecule inconsistent and no per-atom lists are kept alive
+        if name in COMPACT_FIELDS:
+            return _unpack_compact(self.__values__[name])
+        return super().__getattr__(name)
+
+    def _iter(self, by_alias=False, skip_defaults=False):
+        for k, v in super()._iter(by_alias=by_alias, skip_defaults=skip_defaults):
+            if k in COMPACT_FIELDS:
+                v = _unpack_compact(v)
+            yield k, v
+
+    def copy(self, **kwargs):
+        """
+        Duplicates the molecule as `BaseModel.copy`, packing any updated compact fields and
+        keeping the frame transform.
+        """
+        if kwargs.get("update"):
+            kwargs["update"] = {
+                k: _COMPACT_PACKERS[k](v) if k in _COMPACT_PACKERS and v is not None else v
+                for k, v in kwargs["update"].items()
+            }
+        ret = super().copy(**kwargs)
+        if "_frame_transform" in self.__dict__:
+            ret.__dict__["_frame_transform"] = self.__dict__["_frame_transform"]
+        return ret
+
     @validator('geometry')
     def must_be_3n(cls, v, values, **kwargs):
         n = len(values['symbols'])
@@ -195,9 +466,20 @@ class Molecule(BaseModel):
         return v
 
     @validator('connectivity')
-    def min_zero(cls, v):
-        if v < 0:
-            raise ValueError("Connectivity entries must be greater than 0")
+    def valid_bonds(cls, v, values, **kwargs):
+        if len(v) == 0:
+            return v
+
+        nat = len(values['symbols'])
+        if v.atoms.max() >= nat:
+            raise ValueError("Connectivity atom indices must be less than the number of atoms ({}).".format(nat))
+
+        lo = v.atoms.min(axis=1).astype(np.int64)
+        hi = v.atoms.max(axis=1).astype(np.int64)
+        if np.any(lo == hi):
+            raise ValueError("Connectivity may not bond an atom to itself.")
+        if np.unique(lo * nat + hi).shape[0] != lo.shape[0]:
+            raise ValueError("Connectivity may not list a bond more than once.")
         return v
 
     @property
@@ -222,11 +504,229 @@ class Molecule(BaseModel):
 
         return measure_coordinates(self.geometry, measurements, degrees=degrees)
 
+    def nuclear_repulsion_energy(self, ifr=None):
+        """Nuclear repulsion energy.
+
+        Parameters
+        ----------
+        ifr : int, optional
+            If not `None`, only compute for the `ifr`-th (0-indexed) fragment.
+
+        Returns
+        -------
+        nre : float
+            Nuclear repulsion energy in entire molecule or in fragment [E_h].
+
+        Notes
+        -----
+        Ghost atoms carry no nuclear charge and do not contribute.
+        """
+        atoms = self._fragment_atoms(ifr)
+        Zeff = self._effective_nuclear_charges()[atoms]
+        geom = self.geometry[atoms]
+
+        keep = Zeff != 0
+        return self._nuclear_repulsion_energy(geom[keep], Zeff[keep])
+
+    def nuclear_repulsion_gradient(self, ifr=None):
+        """Nuclear repulsion gradient.
+
+        Parameters
+        ----------
+        ifr : int, optional
+            If not `None`, only compute for the `ifr`-th (0-indexed) fragment.
+
+        Returns
+        -------
+        nrg : np.ndarray
+            (nat, 3) Nuclear repulsion gradient [E_h/a0]. Atoms outside fragment `ifr`
+            and ghost atoms have zero rows.
+        """
+        atoms = self._fragment_atoms(ifr)
+        Zeff = self._effective_nuclear_charges()[atoms]
+        keep = atoms[Zeff != 0]
+
+        nrg = np.zeros_like(self.geometry)
+        nrg[keep] = self._nuclear_repulsion_gradient(self.geometry[keep], Zeff[Zeff != 0])
+        return nrg
+
     def orient_molecule(self):
         """
         Centers the molecule and orients via inertia tensor before returning a new Molecule
         """
-        return Molecule(orient=True, **self.dict())
+        geometry, transform = self._orient_molecule_internal(return_transform=True)
+        geometry = float_prep(geometry, GEOMETRY_NOISE, inplace=True)
+        geometry.flags.writeable = False
+
+        ret = self.copy(update={"geometry": geometry})
+        ret.__dict__["_frame_transform"] = self.get_frame_transform().compose(transform)
+        return ret
+
+    def get_frame_transform(self):
+        """
+        Returns the transform from the frame of the input geometry into the frame of this molecule.
+
+        The transform is recorded when the molecule is oriented at construction, by `orient_molecule`,
+        `orient_many`, or when fragments or concatenations are built with ``orient=True``, and is the
+        identity otherwise. Fragments carry the transform of their parent, so it maps the parent's
+        input geometry of their atoms, and concatenations map the concatenated input geometries.
+        It is not serialized, so a molecule rebuilt from its dictionary reports the identity with
+        respect to its stored geometry.
+
+        Returns
+        -------
+        FrameTransform
+            The center of mass shift and rotation, use it to move gradients and Hessians
+            computed on the input geometry into the frame of this molecule.
+        """
+        transform = self.__dict__.get("_frame_transform")
+        return FrameTransform.identity() if transform is None else transform
+
+    @classmethod
+    def orient_many(cls, molecules):
+        """
+        Centers and orients many molecules via their inertia tensors at once.
+
+        Parameters
+        ----------
+        molecules : list of Molecule
+            The molecules to orient, which need not have the same number of atoms.
+
+        Returns
+        -------
+        list of Molecule
+            The oriented molecules, in the same order as `molecules`.
+        """
+        molecules = list(molecules)
+        if len(molecules) == 0:
+            return []
+
+        natoms = np.array([mol.geometry.shape[0] for mol in molecules])
+        if np.any(natoms == 0):
+            raise ValueError("Cannot orient a Molecule without atoms.")
+        offsets = np.concatenate(([0], np.cumsum(natoms)[:-1]))
+
+        geometry = np.concatenate([mol.geometry for mol in molecules])
+        masses = np.concatenate([np.asarray(mol.masses, dtype=np.double) for mol in molecules])
+
+        oriented, transforms = cls._orient_geometries(geometry, masses, offsets, return_transform=True)
+        oriented = float_prep(oriented, GEOMETRY_NOISE, inplace=True)
+        oriented.flags.writeable = False
+
+        ret = []
+        for index, (mol, geom) in enumerate(zip(molecules, np.split(oriented, offsets[1:]))):
+            new = mol.copy(update={"geometry": geom})
+            new.__dict__["_frame_transform"] = mol.get_frame_transform().compose(transforms[index])
+            ret.append(new)
+        return ret
+
+    @classmethod
+    def concatenate(cls, molecules, fragment_per_input=True, name=None, orient=False):
+        """
+        Joins molecules into a single supersystem by stitching their validated arrays.
+
+        Atoms are not re-resolved and charges and multiplicities are not re-validated, so
+        merging many small molecules costs a few array concatenations.
+
+        Parameters
+        ----------
+        molecules : list of Molecule
+            The molecules to join, in order.
+        fragment_per_input : bool, optional
+            Make each input molecule a single fragment carrying its molecular charge and
+            multiplicity, otherwise keep the fragments of the inputs.
+        name : str, optional
+            Name of the new molecule.
+        orient : bool, optional
+            Orientates the new molecule to a standard frame or not, see `get_frame_transform`.
+
+        Returns
+        -------
+        Molecule
+            The combined molecule, with the total charge and the high-spin multiplicity of the inputs.
+        """
+        molecules = list(molecules)
+        if len(molecules) == 0:
+            raise ValueError("Cannot concatenate an empty list of Molecules.")
+        values = [mol.__values__ for mol in molecules]
+
+        natoms = np.array([len(v["symbols"]) for v in values], dtype=np.int64)
+        atom_offsets = np.cumsum(natoms) - natoms
+        nat = int(natoms.sum())
+
+        # Merge the symbol tables, remapping the codes of each input
+        lookup = {}
+        codes = []
+        for v in values:
+            remap = np.array([lookup.setdefault(x, len(lookup)) for x in v["symbols"].table], dtype=np.int64)
+            codes.append(remap[v["symbols"].codes] if len(v["symbols"]) else v["symbols"].codes.astype(np.int64))
+        table = tuple(lookup)
+        symbols = InternedStrings(np.concatenate(codes).astype(np.min_scalar_type(max(len(table) - 1, 0))), table)
+
+        if fragment_per_input:
+            fragments = RaggedIndices(np.append(0, np.cumsum(natoms)), np.arange(nat, dtype=np.int32))
+            fragment_charges = [v["molecular_charge"] for v in values]
+            fragment_multiplicities = [v["molecular_multiplicity"] for v in values]
+        else:
+            sizes = [np.diff(v["fragments"].ptr) for v in values]
+            fragments = RaggedIndices(
+                np.cumsum(np.concatenate([[0]] + sizes)),
+                np.concatenate([v["fragments"].indices + offset for v, offset in zip(values, atom_offsets)]))
+            fragment_charges = [x for v in values for x in v["fragment_charges"]]
+            fragment_multiplicities = [x for v in values for x in v["fragment_multiplicities"]]
+
+        bonds = [v["connectivity"] for v in values]
+        connectivity = BondArray(
+            np.concatenate([b.atoms + offset for b, offset in zip(bonds, atom_offsets)]).astype(np.int32),
+            np.concatenate([b.orders for b in bonds]))
+
+        new = {k: copy.deepcopy(v.default) for k, v in cls.__fields__.items()}
+        new["name"] = "" if name is None else name
+        new["molecular_charge"] = float(sum(v["molecular_charge"] for v in values))
+        new["molecular_multiplicity"] = sum(v["molecular_multiplicity"] - 1 for v in values) + 1
+        new["symbols"] = symbols
+        new["masses"] = np.concatenate([v["masses"] for v in values])
+        new["real"] = np.concatenate([v["real"] for v in values])
+        new["fragments"] = fragments
+        new["fragment_multiplicities"] = fragment_multiplicities
+        new["connectivity"] = connectivity
+        fields_set = {"name", "molecular_charge", "molecular_multiplicity", "symbols", "geometry", "masses", "real",
+                      "fragments"}
+        if len(connectivity):
+            fields_set.add("connectivity")
+
+        # Neutral fragments keep the defaults the constructor would fill in
+        if any(fragment_charges):
+            new["fragment_charges"] = [float(x) for x in fragment_charges]
+            fields_set.add("fragment_charges")
+        else:
+            new["fragment_charges"] = [0 for _ in fragment_charges]
+        if any(x != 1 for x in fragment_multiplicities):
+            fields_set.add("fragment_multiplicities")
+
+        if any(v["atomic_numbers"] is not None for v in values):
+            new["atomic_numbers"] = np.concatenate([mol._atomic_numbers() for mol in molecules])
+            fields_set.add("atomic_numbers")
+        if all(v["mass_numbers"] is not None for v in values):
+            new["mass_numbers"] = np.concatenate([v["mass_numbers"] for v in values])
+            fields_set.add("mass_numbers")
+        if any(v["atom_labels"] is not None for v in values):
+            labels = [v["atom_labels"] if v["atom_labels"] is not None else [""] * n for v, n in zip(values, natoms)]
+            new["atom_labels"] = [x for row in labels for x in row]
+            fields_set.add("atom_labels")
+
+        geometry = np.concatenate([mol.geometry for mol in molecules])
+        transform = None
+        if orient:
+            geometry, transform = cls._orient_geometries(geometry, new["masses"], np.array([0]), return_transform=True)
+            geometry = float_prep(geometry, GEOMETRY_NOISE, inplace=True)
+        geometry.flags.writeable = False
+        new["geometry"] = geometry
+
+        ret = cls.construct(new, fields_set)
+        if transform is not None:
+            ret.__dict__["_frame_transform"] = transform[0]
+        return ret
 
     def compare(self, other, bench=None):
         """
@@ -270,8 +770,9 @@ class Molecule(BaseModel):
         text += """       Center              X                  Y                   Z       \n"""
         text += """    ------------   -----------------  -----------------  -----------------\n"""
 
+        symbols, real = self.symbols, self.real
         for i in range(len(self.geometry)):
-            text += """    {0:8s}{1:4s} """.format(self.symbols[i], "" if self.real[i] else "(Gh)")
+            text += """    {0:8s}{1:4s} """.format(symbols[i], "" if real[i] else "(Gh)")
             for j in range(3):
                 text += """  {0:17.12f}""".format(
                     self.geometry[i][j] * constants.conversion_factor("bohr", "angstroms"))
@@ -293,68 +794,169 @@ class Molecule(BaseModel):
         elif ghost is None:
             ghost = []
 
-        constructor_dict = {}
-
-        ret_name = self.name + " (" + str(real) + "," + str(ghost) + ")"
-        constructor_dict["name"] = ret_name
-        # ret = Molecule(None, name=ret_name)
-
         if len(set(real) & set(ghost)):
             raise TypeError("Molecule:get_fragment: real and ghost sets are overlapping! ({0}, {1}).".format(
                 str(real), str(ghost)))
 
-        geom_blocks = []
-        symbols = []
-        masses = []
-        real_atoms = []
-        fragments = []
-        fragment_charges = []
-        fragment_multiplicities = []
-
-        # Loop through the real blocks
-        frag_start = 0
-        for frag in real:
-            frag_size = len(self.fragments[frag])
-            geom_blocks.append(self.geometry[self.fragments[frag]])
+        return self._gather_fragments(list(real), list(ghost), orient, self._atom_arrays())
 
-            for idx in self.fragments[frag]:
-                symbols.append(self.symbols[idx])
-                real_atoms.append(True)
-                masses.append(self.masses[idx])
-
-            fragments.append(list(range(frag_start, frag_start + frag_size)))
-            frag_start += frag_size
+    def iter_nbody(self, n, ghost=True, orient=False):
+        """
+        Lazily iterates over all subsets of `n` fragments of the molecule.
 
-            fragment_charges.append(float(self.fragment_charges[frag]))
-            fragment_multiplicities.append(self.fragment_multiplicities[frag])
+        Parameters
+        ----------
+        n : int
+            The number of real fragments in each subset.
+        ghost : bool, optional
+            If True, all remaining fragments are included as ghosts in each subset.
+        orient : bool, optional
+            Orientates each subset to a standard frame or not.
+
+        Yields
+        ------
+        real : tuple of int
+            The real fragment indices of the subset.
+        ghost : tuple of int
+            The ghost fragment indices of the subset, empty if `ghost` is False.
+        molecule : Molecule
+            The subset molecule, equivalent to ``get_fragment(real, ghost, orient=orient)``.
+        """
+        nfrag = len(self.fragments)
+        if n < 1 or n > nfrag:
+            raise ValueError("Molecule:iter_nbody: n must be within [1, {}], found {}.".format(nfrag, n))
+
+        arrays = self._atom_arrays()
+        for real in itertools.combinations(range(nfrag), n):
+            if ghost:
+                ghosts = tuple(sorted(set(range(nfrag)) - set(real)))
+            else:
+                ghosts = ()
+            yield real, ghosts, self._gather_fragments(list(real), list(ghosts), orient, arrays)
 
-        # Set charge and multiplicity
-        constructor_dict["molecular_charge"] = sum(fragment_charges)
-        constructor_dict["molecular_multiplicity"] = sum(x - 1 for x in fragment_multiplicities) + 1
+    def extract_environment(self, center_atoms, radius, whole_fragments=True, ghost_shell=None, orient=False):
+        """
+        Carves out the surroundings of a set of atoms, such as a solute in a solvent box.
 
-        # Loop through the ghost blocks
-        for frag in ghost:
-            frag_size = len(self.fragments[frag])
-            geom_blocks.append(self.geometry[self.fragments[frag]])
+        Atoms near the centers are found through a cell list over the geometry, which is
+        built once per cutoff and cached, so that each carve only visits the cells around the centers.
 
-            for idx in self.fragments[frag]:
-                symbols.append(self.symbols[idx])
-                real_atoms.append(False)
-                masses.append(self.masses[idx])
+        Parameters
+        ----------
+        center_atoms : Union[int, List[int]]
+            Atom indices of the center.
+        radius : float
+            Atoms within this distance [a0] of any center atom are selected as real.
+        whole_fragments : bool, optional
+            Select every fragment with any atom within `radius`, otherwise only the atoms within
+            it. Truncated fragments are made neutral with the lowest multiplicity their electrons allow.
+        ghost_shell : float, optional
+            Include as ghosts what lies within a further `ghost_shell` [a0] beyond `radius`.
+        orient : bool, optional
+            Orientates the new molecule to a standard frame or not.
 
-            fragments.append(list(range(frag_start, frag_start + frag_size)))
-            frag_start += frag_size
+        Returns
+        -------
+        Molecule
+            The real selection followed by the ghost shell, each in fragment order.
 
-            fragment_charges.append(self.fragment_charges[frag])
-            fragment_multiplicities.append(self.fragment_multiplicities[frag])
+        Examples
+        --------
 
-        constructor_dict["fragments"] = fragments
-        constructor_dict["symbols"] = symbols
-        constructor_dict["geometry"] = np.vstack(geom_blocks)
-        constructor_dict["real"] = real_atoms
-        constructor_dict["masses"] = masses
+        >>> cluster = box.extract_environment(solute_atoms, 10.0, ghost_shell=5.0)
 
-        return Molecule(orient=orient, **constructor_dict)
+        """
+        nat = self.geometry.shape[0]
+        centers = np.unique(np.atleast_1d(np.asarray(center_atoms, dtype=np.intp)))
+        if centers.shape[0] == 0 or centers[0] < 0 or centers[-1] >= nat:
+            raise ValueError("Center atoms must be a non-empty set of atom indices in [0, {}).".format(nat))
+        if radius < 0 or (ghost_shell is not None and ghost_shell < 0):
+            raise ValueError("Radius and ghost shell must not be negative.")
+
+        cutoff = radius + (ghost_shell or 0.0)
+        atoms, distances = self._atoms_near(centers, cutoff)
+
+        arrays = self._atom_arrays()
+        ptr = arrays["fragment_ptr"]
+        owner = np.empty(nat, dtype=np.intp)
+        owner[arrays["fragment_atoms"]] = np.repeat(np.arange(ptr.shape[0] - 1), np.diff(ptr))
+
+        if whole_fragments:
+            # Distance of each touched fragment is that of its closest atom
+            order = np.argsort(distances, kind="stable")
+            frags, first = np.unique(owner[atoms[order]], return_index=True)
+            inside = distances[order][first] <= radius
+            return self._gather_fragments(frags[inside].tolist(), frags[~inside].tolist(), orient, arrays)
+
+        # Regroup the selected atoms by fragment, keeping the atom order within each fragment
+        position = np.empty(nat, dtype=np.intp)
+        position[arrays["fragment_atoms"]] = np.arange(nat)
+        inside = distances <= radius
+        Z = self._atomic_numbers().astype(np.int64)
+
+        pieces_ptr, pieces_atoms, charges, multiplicities = [0], [], [], []
+        for shell in (atoms[inside], atoms[~inside]):
+            shell = shell[np.argsort(position[shell])]
+            frags, starts, counts = np.unique(owner[shell], return_index=True, return_counts=True)
+            electrons = np.add.reduceat(Z[shell], starts) if shell.shape[0] else np.zeros(0, dtype=np.int64)
+            for frag, count, nelectron in zip(frags.tolist(), counts.tolist(), electrons.tolist()):
+                if count == ptr[frag + 1] - ptr[frag]:
+                    charges.append(arrays["fragment_charges"][frag])
+                    multiplicities.append(arrays["fragment_multiplicities"][frag])
+                else:
+                    charges.append(0)
+                    multiplicities.append(1 + int(nelectron) % 2)
+            pieces_ptr.extend((pieces_ptr[-1] + np.cumsum(counts)).tolist())
+            pieces_atoms.append(shell)
+
+        nreal = int(np.unique(owner[atoms[inside]]).shape[0])
+        arrays.update({
+            "fragment_ptr": np.array(pieces_ptr, dtype=np.int64),
+            "fragment_atoms": np.concatenate(pieces_atoms),
+            "fragment_charges": charges,
+            "fragment_multiplicities": multiplicities,
+        })
+        return self._gather_fragments(list(range(nreal)), list(range(nreal, len(charges))), orient, arrays)
+
+    def _atoms_near(self, centers, cutoff):
+        """
+        Returns the atoms within `cutoff` of any of the `centers` and their distance to the closest center.
+        """
+        geom = self.geometry
+        cell_size = max(cutoff, 1.e-8)
+
+        # Cell list of all atoms, sorted by cell key, cached for repeated queries at the same cutoff
+        cache = self.__dict__.get("_cell_cache")
+        if cache is None or cache[0] != cell_size:
+            origin = geom.min(axis=0)
+            cells = np.floor((geom - origin) / cell_size).astype(np.int64)
+            dims = cells.max(axis=0) + 1
+            keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+            order = np.argsort(keys, kind="stable")
+            cache = (cell_size, origin, dims, order, keys[order])
+            self.__dict__["_cell_cache"] = cache
+        _, origin, dims, order, sorted_keys = cache
+
+        # The 27 cells around each center hold every atom within one cell size
+        cells = np.floor((geom[centers] - origin) / cell_size).astype(np.int64)
+        neighbor = (cells[:, None, :] + np.array(list(itertools.product([-1, 0, 1], repeat=3)))).reshape(-1, 3)
+        inside = np.all((neighbor >= 0) & (neighbor < dims), axis=1)
+        nkeys = (neighbor[:, 0] * dims[1] + neighbor[:, 1]) * dims[2] + neighbor[:, 2]
+        start = np.searchsorted(sorted_keys, nkeys, side="left")
+        counts = np.where(inside, np.searchsorted(sorted_keys, nkeys, side="right") - start, 0)
+
+        source = np.repeat(np.repeat(centers, 27), counts)
+        local = np.arange(source.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+        target = order[np.repeat(start, counts) + local]
+
+        distance = np.linalg.norm(geom[target] - geom[source], axis=1)
+        keep = distance <= cutoff
+        target, distance = target[keep], distance[keep]
+
+        # Closest center of each atom
+        by_distance = np.argsort(distance, kind="stable")
+        atoms, first = np.unique(target[by_distance], return_index=True)
+        return atoms, distance[by_distance][first]
 
     def to_string(self, dtype="psi4"):
         """Returns a string that can be used by a variety of programs.
@@ -366,21 +968,51 @@ class Molecule(BaseModel):
         else:
             raise KeyError("Molecule:to_string: dtype of '{}' not recognized.".format(dtype))
 
-    def get_hash(self):
+    def get_hash(self, canonical=False, canonical_fragments=False):
         """
         Returns the hash of the molecule.
+
+        Parameters
+        ----------
+        canonical : bool, optional
+            If True, the geometry is placed in a canonical frame and atoms in a canonical
+            order before hashing so that any permutation of the atom listing, and any
+            rotation or translation of the molecule, yields the same hash.
+        canonical_fragments : bool, optional
+            If True (requires ``canonical``), fragments are also placed in a canonical
+            order so that the hash does not depend on the order fragments were listed in.
+
+        Notes
+        -----
+        The canonical hash is distinct from the default hash of the same molecule; the
+        two modes should not be compared against one another. Canonical geometries are
+        rounded to 1.e-4 bohr rather than 1.e-8, as a rotated geometry is only reproduced to
+        the precision it was stored at; mirror images still hash differently.
         """
+        if canonical_fragments and not canonical:
+            raise ValueError("canonical_fragments requires canonical=True.")
 
+        # Molecules are immutable, so the digest is cached per mode
+        cache = self.__dict__.setdefault("_hash_cache", {})
+        key = (canonical, canonical_fragments)
+        if key not in cache:
+            cache[key] = self._compute_hash(canonical, canonical_fragments)
+        return cache[key]
+
+    def _compute_hash(self, canonical, canonical_fragments):
         m = hashlib.sha1()
         concat = ""
 
         tmp_dict = super().dict()
+        if canonical:
+            tmp_dict = self._canonical_hash_dict(tmp_dict, canonical_fragments)
 
         np.set_printoptions(precision=16)
         for field in self.hash_fields:
             data = tmp_dict[field]
             if field == "geometry":
-                tmp_dict[field] = float_prep(data, GEOMETRY_NOISE).ravel().tolist()
+                noise = CANONICAL_GEOMETRY_NOISE if canonical else GEOMETRY_NOISE
+                tmp_dict[field] = float_prep(data, noise).ravel().tolist()
             elif field == "fragment_charges":
                 tmp_dict[field] = float_prep(data, CHARGE_NOISE).tolist()
             elif field == "molecular_charge":
@@ -393,6 +1025,447 @@ class Molecule(BaseModel):
         m.update(concat.encode("utf-8"))
         return m.hexdigest()
 
+    def _canonical_frame(self):
+        """
+        Returns the canonical atom permutation and geometry used by ``get_hash(canonical=True)``.
+
+        The geometry is centered on the center of mass and rotated onto its principal axes. The
+        sign of each axis is chosen so that the mass-weighted third moment along it is positive,
+        which unlike the phase convention of ``orient_molecule`` does not depend on the atom order.
+        Only two signs are free for a proper rotation, and axes whose third moment vanishes
+        (mirror planes) fix none, so ties are resolved by the smallest ordered geometry.
+
+        For symmetric tops the two axes of the degenerate pair are only defined up to a rotation
+        about the unique axis, so each atom of the first off-axis class is tried on the first of
+        them. Spherical tops have no preferred axes at all and their frame is instead spanned by
+        pairs of atoms from the first classes.
+
+        Atoms are then ordered by element symbol, real before ghost, mass, and finally by their
+        x, y and z coordinates. Coordinates are compared in tolerance buckets so that noise near a
+        rounding boundary cannot swap two atoms.
+        """
+        values = self.__values__
+        masses = np.array(values["masses"], dtype=np.double)
+        geometry = np.array(self.geometry, dtype=np.double)
+        geometry -= masses @ geometry / masses.sum()
+
+        moments = np.einsum("i,ij,ik->jk", masses, geometry, geometry)
+        evals, evecs = np.linalg.eigh(np.trace(moments) * np.eye(3) - moments)
+
+        # Mirror images must not share a hash, so only proper rotations are allowed
+        if np.linalg.det(evecs) < 0:
+            evecs[:, 2] *= -1.0
+
+        classes = self._canonical_classes()
+        frames = [evecs * flip for flip in ([1, 1, 1], [1, -1, -1], [-1, 1, -1], [-1, -1, 1])]
+        fixed = np.ones(3, dtype=bool)
+
+        degenerate = np.diff(evals) <= CANONICAL_TOLERANCE * max(evals[-1], 1.0)
+        if degenerate.sum() == 1:
+            unique = 2 if degenerate[0] else 0
+            a, b = [i for i in range(3) if i != unique]
+            fixed = np.arange(3) == unique
+
+            plane = geometry @ evecs[:, [a, b]]
+            radius = np.hypot(plane[:, 0], plane[:, 1])
+
+            rotated = []
+            for atom in _first_class(classes, radius):
+                cos, sin = plane[atom] / radius[atom]
+                frame = evecs.copy()
+                frame[:, a] = cos * evecs[:, a] + sin * evecs[:, b]
+                frame[:, b] = cos * evecs[:, b] - sin * evecs[:, a]
+                rotated.append(frame)
+
+                # A half turn about the reference axis flips the unique axis
+                frame = frame.copy()
+                frame[:, [unique, b]] *= -1.0
+                rotated.append(frame)
+
+            # Linear molecules have no off-axis atoms and keep the sign flips
+            if rotated:
+                frames = rotated
+
+        elif degenerate.all():
+            fixed = np.zeros(3, dtype=bool)
+
+            # Any frame is principal, so it is spanned by a pair of atoms from the first classes
+            radius = np.linalg.norm(geometry, axis=1)
+            spanned = []
+            for atom in _first_class(classes, radius):
+                axis = geometry[atom] / radius[atom]
+                height = geometry @ axis
+                perpendicular = geometry - height[:, None] * axis
+                distance = np.linalg.norm(perpendicular, axis=1)
+                for second in _first_class(classes, distance, height):
+                    other = perpendicular[second] / distance[second]
+                    spanned.append(np.column_stack((axis, other, np.cross(axis, other))))
+
+            # Single atoms keep the sign flips
+            if spanned:
+                frames = spanned
+
+        best = None
+        for frame in frames:
+            candidate = geometry @ frame
+            third = np.einsum("i,ij->j", masses, candidate**3)
+            scale = np.einsum("i,ij->j", masses, np.abs(candidate)**3)
+            wrong_phase = fixed & (third < 0) & (np.abs(third) > CANONICAL_TOLERANCE * scale)
+
+            order = np.lexsort([_tolerance_ranks(candidate[:, i], CANONICAL_TOLERANCE) for i in (2, 1, 0)] + [classes])
+            key = (wrong_phase.tolist(), np.round(candidate[order] / CANONICAL_TOLERANCE).ravel().tolist())
+            if best is None or key < best[0]:
+                best = (key, order, candidate)
+
+        return best[1], best[2]
+
+    def _canonical_classes(self):
+        """
+        Ranks the atoms by element symbol, then real before ghost, then mass.
+        """
+        values = self.__values__
+        symbols = values["symbols"]
+        rank = np.empty(len(symbols.table), dtype=np.intp)
+        rank[np.argsort(np.array(symbols.table))] = np.arange(len(symbols.table))
+
+        masses = float_prep(np.array(values["masses"], dtype=np.double), MASS_NOISE, inplace=True)
+        keys = np.column_stack((rank[symbols.codes], ~values["real"], masses))
+        return np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+
+    def _canonical_hash_dict(self, tmp_dict, canonical_fragments):
+        """
+        Permutes the per-atom and per-fragment fields of a hash dictionary into canonical order.
+        """
+        order, geometry = self._canonical_frame()
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(order.shape[0])
+
+        tmp_dict = tmp_dict.copy()
+        for field in ["symbols", "masses", "real"]:
+            tmp_dict[field] = [tmp_dict[field][i] for i in order]
+        tmp_dict["geometry"] = geometry[order]
+
+        fragments = [np.sort(inverse[np.asarray(frag, dtype=np.intp)]).tolist() for frag in tmp_dict["fragments"]]
+        frag_order = range(len(fragments))
+        if canonical_fragments:
+            # Fragments are disjoint, so their lowest canonical atom gives a total order
+            frag_order = sorted(frag_order, key=lambda ifr: fragments[ifr][0] if fragments[ifr] else -1)
+        tmp_dict["fragments"] = [fragments[ifr] for ifr in frag_order]
+        for field in ["fragment_charges", "fragment_multiplicities"]:
+            tmp_dict[field] = [tmp_dict[field][ifr] for ifr in frag_order]
+
+        if tmp_dict.get("connectivity") is not None:
+            connectivity = []
+            for at1, at2, bo in tmp_dict["connectivity"]:
+                at1, at2 = sorted((int(inverse[at1]), int(inverse[at2])))
+                connectivity.append((at1, at2, bo))
+            tmp_dict["connectivity"] = sorted(connectivity)
+
+        return tmp_dict
+
+    def get_topology_hash(self, iterations=3):
+        """
+        Returns a geometry- and atom-order-independent hash of the bonding graph.
+
+        Atoms are labeled by atomic number and refined by ``iterations`` rounds of
+        Weisfeiler-Lehman relabeling over the ``connectivity`` graph, where each atom
+        absorbs the multiset of its neighbors' labels and bond orders. The digest is
+        taken over the sorted labels of every round.
+
+        Parameters
+        ----------
+        iterations : int, optional
+            Number of refinement rounds; larger values distinguish larger neighborhoods.
+
+        Returns
+        -------
+        str
+            Hex digest of the topology.
+
+        Notes
+        -----
+        Ghost atoms are treated like real atoms, and molecules with no connectivity
+        reduce to their element composition.
+        """
+        if iterations < 0:
+            raise ValueError("iterations must be non-negative, found {}.".format(iterations))
+
+        nat = self.geometry.shape[0]
+        ptr, neighbors, bond_orders = self._connectivity_csr(nat, self.__values__["connectivity"])
+
+        # Half-integer bond orders are exact at two decimal places
+        edge_codes = _mix64(np.around(bond_orders * 100).astype(np.uint64))
+        degree = np.diff(ptr)
+        bonded = degree > 0
+
+        labels = _mix64(self._atomic_numbers().astype(np.uint64))
+        m = hashlib.sha1()
+        m.update(np.sort(labels).tobytes())
+
+        with np.errstate(over="ignore"):
+            for _ in range(iterations):
+                # Summing mixed neighbor codes is order independent
+                messages = _mix64(labels[neighbors] ^ edge_codes)
+                aggregate = np.zeros(nat, dtype=np.uint64)
+                if neighbors.shape[0]:
+                    aggregate[bonded] = np.add.reduceat(messages, ptr[:-1][bonded])
+
+                labels = _mix64(labels * np.uint64(0x100000001B3) + aggregate)
+                m.update(np.sort(labels).tobytes())
+
+        return m.hexdigest()
+
+    @staticmethod
+    def _connectivity_csr(nat, bonds):
+        """
+        Builds the symmetric CSR adjacency of a BondArray.
+
+        Returns
+        -------
+        ptr : np.ndarray
+            (nat + 1) offsets into `neighbors` for each atom.
+        neighbors : np.ndarray
+            Bonded atom indices grouped by atom.
+        bond_orders : np.ndarray
+            Bond order of each entry of `neighbors`.
+        """
+        at1 = bonds.atoms[:, 0].astype(np.intp)
+        at2 = bonds.atoms[:, 1].astype(np.intp)
+
+        src = np.concatenate((at1, at2))
+        dst = np.concatenate((at2, at1))
+        order = np.argsort(src, kind="stable")
+
+        ptr = np.zeros(nat + 1, dtype=np.intp)
+        np.cumsum(np.bincount(src, minlength=nat), out=ptr[1:])
+        return ptr, dst[order], np.concatenate((bonds.orders, bonds.orders))[order]
+
+    def get_fingerprint(self, nbins=32, rmax=12.0, npair_slots=16):
+        """
+        Returns a fixed-length, rotation- and permutation-invariant geometric fingerprint.
+
+        Every interatomic distance is binned into a histogram belonging to its pair of
+        elements. Each distance is split linearly between its two nearest bins, so the
+        fingerprint changes continuously with the geometry and near-identical conformers
+        have near-identical fingerprints.
+
+        Parameters
+        ----------
+        nbins : int, optional
+            Number of distance bins per element pair.
+        rmax : float, optional
+            Distance [a0] of the last bin, longer distances are counted in the last bin.
+        npair_slots : int, optional
+            Number of histograms, element pairs are folded into these by their pair index.
+
+        Returns
+        -------
+        np.ndarray
+            (npair_slots * nbins, ) Fingerprint of the molecule.
+        """
+        if nbins < 2:
+            raise ValueError("nbins must be at least 2, found {}.".format(nbins))
+
+        codes, distances = self._distance_signature()
+        width = rmax / (nbins - 1)
+
+        x = np.minimum(distances, rmax) / width
+        lower = np.minimum(np.floor(x).astype(np.intp), nbins - 2)
+        frac = x - lower
+
+        slots = (codes % npair_slots) * nbins + lower
+        fingerprint = np.bincount(slots, weights=1.0 - frac, minlength=npair_slots * nbins)
+        fingerprint += np.bincount(slots + 1, weights=frac, minlength=npair_slots * nbins)
+        return fingerprint
+
+    def _distance_signature(self):
+        """
+        Returns the interatomic distances sorted by element pair and then by value.
+
+        Returns
+        -------
+        codes : np.ndarray
+            Element pair index ``Z_i * (Z_i + 1) / 2 + Z_j`` with ``Z_i >= Z_j`` of each distance.
+        distances : np.ndarray
+            All unique interatomic distances [a0].
+        """
+        Z = self._atomic_numbers().astype(np.intp)
+        iu, ju = np.triu_indices(Z.shape[0], 1)
+        distances = distance_matrix(self.geometry, self.geometry)[iu, ju]
+
+        zi = np.maximum(Z[iu], Z[ju])
+        codes = zi * (zi + 1) // 2 + np.minimum(Z[iu], Z[ju])
+
+        order = np.lexsort((distances, codes))
+        return codes[order], distances[order]
+
+    def get_symmetry(self, tolerance=0.05):
+        """
+        Detects the largest Abelian point group of the molecule.
+
+        Atoms are only considered equivalent if they share symbol, mass, and ghostedness.
+        See `qcelemental.util.detect_point_group` for details.
+
+        Parameters
+        ----------
+        tolerance : float, optional
+            Largest distance [a0] between an atom and the image of its symmetry partner.
+
+        Returns
+        -------
+        dict
+            ``point_group`` (such as ``"c2v"``), ``operations``, ``unique_atoms``, and the
+            ``geometry`` in the frame of the operations.
+
+        Examples
+        --------
+
+        >>> water.get_symmetry()["point_group"]
+        'c2v'
+
+        """
+        values = self.__values__
+        atoms = np.stack(
+            [values["symbols"].codes, values["real"], float_prep(values["masses"], MASS_NOISE) * 10**MASS_NOISE],
+            axis=1)
+        labels = np.unique(atoms, axis=0, return_inverse=True)[1].ravel()
+
+        return detect_point_group(self._orient_molecule_internal(), labels, values["masses"], tolerance=tolerance)
+
+    def guess_connectivity(self, scale=1.2, return_fragments=False):
+        """
+        Perceives single bonds from covalent radii.
+
+        Atoms i and j are bonded if their distance is within ``scale * (r_i + r_j)``. Candidate
+        pairs are drawn from a cell list with cells spanning the longest possible bond, so the
+        cost grows linearly with the number of atoms.
+
+        Parameters
+        ----------
+        scale : float, optional
+            Multiple of the sum of covalent radii up to which atoms are bonded.
+        return_fragments : bool, optional
+            Also return the connected components of the bond graph as fragments.
+
+        Returns
+        -------
+        connectivity : List[Tuple[int, int, float]]
+            Bonds ``(i, j, 1.0)`` with ``i < j``, sorted.
+        fragments : List[List[int]]
+            Atom indices of each connected component ordered by their lowest atom, if `return_fragments`.
+
+        Examples
+        --------
+
+        >>> mol = Molecule(symbols=mol.symbols, geometry=mol.geometry, connectivity=mol.guess_connectivity())
+
+        """
+        values = self.__values__
+        table_radii = np.array([covalentradii.get(x, units="bohr") for x in values["symbols"].table])
+        radii = table_radii[values["symbols"].codes]
+
+        at1, at2 = self._bonded_pairs(self.geometry, radii * scale)
+        connectivity = [(i, j, 1.0) for i, j in zip(at1.tolist(), at2.tolist())]
+        if not return_fragments:
+            return connectivity
+
+        return connectivity, self._connected_components(self.geometry.shape[0], at1, at2)
+
+    def internal_coordinates(self, torsions=True):
+        """
+        Generates the redundant internal coordinates of the molecule.
+
+        Stretches, bends and torsions follow the ``connectivity`` of the molecule, or the
+        bonds perceived by `guess_connectivity` if it has none. Near-linear bends are dropped.
+
+        Parameters
+        ----------
+        torsions : bool, optional
+            Generate torsions or not.
+
+        Returns
+        -------
+        InternalCoordinates
+            The coordinates, evaluate them and their B-matrix on ``self.geometry`` [a0].
+        """
+        connectivity = self.__values__["connectivity"]
+        if not len(connectivity):
+            connectivity = self.guess_connectivity()
+        return InternalCoordinates.from_connectivity(connectivity, self.geometry, torsions=torsions)
+
+    @staticmethod
+    def _bonded_pairs(geom, radii):
+        """
+        Returns the sorted atom pairs (i < j) closer than the sum of their radii using a cell list.
+        """
+        nat = geom.shape[0]
+        if nat < 2:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+
+        cell_size = max(2.0 * radii.max(), 1.e-8)
+        cells = np.floor((geom - geom.min(axis=0)) / cell_size).astype(np.int64)
+        dims = cells.max(axis=0) + 1
+        keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+
+        # The own cell and the 13 neighbors in the forward half visit every pair once
+        offsets = [off for off in itertools.product([-1, 0, 1], repeat=3) if off >= (0, 0, 0)]
+
+        pairs1, pairs2 = [], []
+        for offset in offsets:
+            neighbor = cells + offset
+            inside = np.all((neighbor >= 0) & (neighbor < dims), axis=1)
+            nkeys = (neighbor[:, 0] * dims[1] + neighbor[:, 1]) * dims[2] + neighbor[:, 2]
+            start = np.searchsorted(sorted_keys, nkeys, side="left")
+            counts = np.where(inside, np.searchsorted(sorted_keys, nkeys, side="right") - start, 0)
+
+            # Expand (atom, neighbor cell) into all candidate pairs
+            at1 = np.repeat(np.arange(nat), counts)
+            local = np.arange(at1.shape[0]) - np.repeat(np.cumsum(counts) - counts, counts)
+            at2 = order[np.repeat(start, counts) + local]
+            if offset == (0, 0, 0):
+                keep = at2 > at1
+                at1, at2 = at1[keep], at2[keep]
+
+            diff = geom[at1] - geom[at2]
+            bonded = np.einsum("ij,ij->i", diff, diff) <= (radii[at1] + radii[at2])**2
+            pairs1.append(at1[bonded])
+            pairs2.append(at2[bonded])
+
+        at1 = np.concatenate(pairs1)
+        at2 = np.concatenate(pairs2)
+        lo, hi = np.minimum(at1, at2), np.maximum(at1, at2)
+        order = np.lexsort((hi, lo))
+        return lo[order], hi[order]
+
+    @staticmethod
+    def _connected_components(nat, at1, at2):
+        """
+        Returns the connected components of a graph as sorted atom lists ordered by their lowest atom.
+
+        Union-find with vectorized hooking of every edge onto the smaller root followed by
+        pointer jumping, repeated until no edge joins two different components.
+        """
+        parent = np.arange(nat)
+        while True:
+            root1, root2 = parent[at1], parent[at2]
+            differ = root1 != root2
+            if not differ.any():
+                break
+            np.minimum.at(parent, np.maximum(root1, root2)[differ], np.minimum(root1, root2)[differ])
+
+            while True:
+                grandparent = parent[parent]
+                if np.array_equal(grandparent, parent):
+                    break
+                parent = grandparent
+
+        # Roots are the lowest atom of each component, so sorting by root orders the fragments
+        order = np.argsort(parent, kind="stable")
+        bounds = np.flatnonzero(np.diff(parent[order])) + 1
+        return [frag.tolist() for frag in np.split(order, bounds)]
+
     def get_molecular_formula(self):
         """
         Returns the molecular formula for a molecule. Atom symbols are sorted from
@@ -537,74 +1610,263 @@ class Molecule(BaseModel):
 
     ### Non-Pydantic internal functions
 
-    def _orient_molecule_internal(self):
+    def _orient_molecule_internal(self, return_transform=False):
         """
         Centers the molecule and orients via inertia tensor before returning a new set of the
-        molecule geometry
+        molecule geometry, and optionally the FrameTransform that produced it
         """
 
-        new_geometry = self.geometry.copy()  # Ensure we get a copy
-        # Get the mass as an array
         # Masses are needed for orientation
-        np_mass = np.array(self.masses)
+        ret = self._orient_geometries(self.geometry, self.__values__["masses"], np.array([0]), return_transform)
+        if return_transform:
+            return ret[0], ret[1][0]
+        return ret
+
+    def __str__(self):
+        return self.pretty_print()
+
+    @staticmethod
+    def _inertial_tensor(geom, weight):
+        """
+        Compute the moment inertia tensor for a given geometry.
+        """
+        # I = sum_i w_i (r_i . r_i) 1 - sum_i w_i r_i r_i^T
+        tensor = -np.einsum("i,ij,ik->jk", weight, geom, geom)
+        tensor[np.diag_indices(3)] -= np.trace(tensor)
+        return tensor
+
+    @staticmethod
+    def _orient_geometries(geometry, masses, offsets, return_transform=False):
+        """
+        Centers and orients via inertia tensor a set of concatenated geometries.
+
+        Parameters
+        ----------
+        geometry : np.ndarray
+            (nat, 3) Concatenated geometries of all molecules.
+        masses : np.ndarray
+            (nat, ) Concatenated masses of all molecules.
+        offsets : np.ndarray
+            (nmol, ) Index of the first atom of each molecule within `geometry`.
+        return_transform : bool, optional
+            Also return the transform of each molecule.
+
+        Returns
+        -------
+        np.ndarray
+            (nat, 3) The concatenated oriented geometries.
+        FrameTransform
+            (nmol, ) Stacked center of mass shifts and rotations, if `return_transform`.
+        """
+        nat = geometry.shape[0]
+        natoms = np.diff(np.append(offsets, nat))
+        owner = np.repeat(np.arange(len(offsets)), natoms)
 
         # Center on Mass
-        new_geometry -= np.average(new_geometry, axis=0, weights=np_mass)
+        com = np.add.reduceat(geometry * masses[:, None], offsets) / np.add.reduceat(masses, offsets)[:, None]
+        new_geometry = geometry - com[owner]
 
-        # Rotate into inertial frame
-        tensor = self._inertial_tensor(new_geometry, np_mass)
-        evals, evecs = np.linalg.eigh(tensor)
+        # Rotate into inertial frame, a single eigh call over all (nmol, 3, 3) tensors
+        moments = np.add.reduceat(masses[:, None, None] * new_geometry[:, :, None] * new_geometry[:, None, :],
+                                  offsets)
+        tensors = -moments
+        tensors[:, [0, 1, 2], [0, 1, 2]] += np.trace(moments, axis1=1, axis2=2)[:, None]
+        evals, evecs = np.linalg.eigh(tensors)
 
-        new_geometry = np.dot(new_geometry, evecs)
+        new_geometry = np.einsum("ij,ijk->ik", new_geometry, evecs[owner])
 
         # Phases? Lets do the simplest thing and ensure the first atom in each column
         # that is not on a plane is positve
+        off_plane = np.abs(new_geometry) >= 10**(-GEOMETRY_NOISE)
+        first = np.where(off_plane, np.arange(nat)[:, None], nat)
+        first = np.minimum.reduceat(first, offsets)
 
-        phase_check = [False, False, False]
+        lead = new_geometry[np.minimum(first, nat - 1), np.arange(3)]
+        phase = np.where((first < nat) & (lead < 0), -1.0, 1.0)
+        new_geometry *= phase[owner]
 
-        geom_noise = 10**(-GEOMETRY_NOISE)
-        for num in range(new_geometry.shape[0]):
+        if return_transform:
+            return new_geometry, FrameTransform(com, evecs * phase[:, None, :])
+        return new_geometry
 
-            for x in range(3):
-                if phase_check[x]:
-                    continue
+    def _atom_arrays(self):
+        """
+        Returns the validated per-atom data as arrays so subsets can be gathered by index.
+        """
+        values = self.__values__
+        arrays = {
+            "geometry": self.geometry,
+            "symbols": values["symbols"],
+            "masses": values["masses"],
+            "fragment_ptr": values["fragments"].ptr,
+            "fragment_atoms": values["fragments"].indices,
+            "fragment_charges": values["fragment_charges"],
+            "fragment_multiplicities": values["fragment_multiplicities"],
+        }
+        for field in ["atomic_numbers", "mass_numbers"]:
+            if values[field] is not None:
+                arrays[field] = values[field]
+        if values["atom_labels"] is not None:
+            arrays["atom_labels"] = np.array(values["atom_labels"], dtype=object)
+
+        return arrays
+
+    def _gather_fragments(self, real, ghost, orient, arrays):
+        """
+        Builds a Molecule from the `real` and `ghost` fragments of this molecule by gathering
+        the already validated per-atom arrays, skipping the full constructor.
+        """
+        frags = real + ghost
+        ptr = arrays["fragment_ptr"]
+        sizes = ptr[1:][frags] - ptr[:-1][frags]
+        nreal = int(np.sum(sizes[:len(real)]))
+
+        # Atom indices of the selected fragments, in fragment order
+        local = np.arange(np.sum(sizes)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        atoms = arrays["fragment_atoms"][np.repeat(ptr[:-1][frags], sizes) + local]
+
+        # Ghost fragments carry no electrons, they are neutral singlets as the constructor would fill in
+        fragment_charges = [float(arrays["fragment_charges"][frag]) for frag in real] + [0.0 for _ in ghost]
+        fragment_multiplicities = [int(arrays["fragment_multiplicities"][frag]) for frag in real] + [1 for _ in ghost]
+
+        values = {k: copy.deepcopy(v.default) for k, v in self.__fields__.items()}
+        values["name"] = self.name + " (" + str(real) + "," + str(ghost) + ")"
+        values["molecular_charge"] = sum(fragment_charges[:len(real)])
+        values["molecular_multiplicity"] = sum(x - 1 for x in fragment_multiplicities[:len(real)]) + 1
+        values["symbols"] = arrays["symbols"].take(atoms)
+        values["masses"] = arrays["masses"][atoms]
+        values["real"] = np.arange(atoms.shape[0]) < nreal
+        values["fragments"] = RaggedIndices(np.cumsum(np.append(0, sizes)), np.arange(atoms.shape[0], dtype=np.int32))
+        values["fragment_multiplicities"] = fragment_multiplicities
+        values["connectivity"] = BondArray.from_array([])
+        fields_set = {"name", "molecular_charge", "molecular_multiplicity", "symbols", "geometry", "masses", "real",
+                      "fragments"}
+
+        # Neutral fragments keep the defaults the constructor would fill in
+        if any(fragment_charges):
+            values["fragment_charges"] = fragment_charges
+            fields_set.add("fragment_charges")
+        else:
+            values["fragment_charges"] = [0 for _ in frags]
+        if any(x != 1 for x in fragment_multiplicities):
+            fields_set.add("fragment_multiplicities")
+
+        for field in ["atomic_numbers", "mass_numbers"]:
+            if field in arrays:
+                values[field] = arrays[field][atoms]
+                fields_set.add(field)
+        if "atom_labels" in arrays:
+            values["atom_labels"] = arrays["atom_labels"][atoms].tolist()
+            fields_set.add("atom_labels")
+
+        # The fragments share the frame of this molecule until reoriented
+        transform = self.__dict__.get("_frame_transform")
+        geometry = arrays["geometry"][atoms]
+        if orient:
+            geometry, oriented = self._orient_geometries(geometry,
+                                                         arrays["masses"][atoms],
+                                                         np.array([0]),
+                                                         return_transform=True)
+            geometry = float_prep(geometry, GEOMETRY_NOISE, inplace=True)
+            transform = self.get_frame_transform().compose(oriented[0])
+        geometry.flags.writeable = False
+        values["geometry"] = geometry
+
+        ret = self.__class__.construct(values, fields_set)
+        if transform is not None:
+            ret.__dict__["_frame_transform"] = transform
+        return ret
+
+    def _fragment_atoms(self, ifr=None):
+        """
+        Returns the atom indices of fragment `ifr` or of the whole molecule if `None`.
+        """
+        if ifr is None:
+            return np.arange(self.geometry.shape[0])
+        return self.__values__["fragments"][ifr].astype(int)
 
-                val = new_geometry[num, x]
+    def _effective_nuclear_charges(self):
+        """
+        Returns the nuclear charges with ghost atoms zeroed.
+        """
+        return self._atomic_numbers() * self.__values__["real"].astype(np.double)
 
-                if abs(val) < geom_noise:
-                    continue
+    def _atomic_numbers(self):
+        """
+        Returns the atomic numbers as an array, resolved from the symbols if not provided.
+        """
+        values = self.__values__
+        if values["atomic_numbers"] is None:
+            table_Z = np.array([periodictable.to_Z(x) for x in values["symbols"].table], dtype=np.int16)
+            return table_Z[values["symbols"].codes]
+        return values["atomic_numbers"]
 
-                phase_check[x] = True
+    @staticmethod
+    def _pair_block_size(nat):
+        """
+        Returns the number of rows per block so that an (nrow, nat, 3) intermediate stays bounded.
+        """
+        return max(1, PAIR_BLOCK_ELEMENTS // max(1, nat))
 
-                if val < 0:
-                    new_geometry[:, x] *= -1
+    @staticmethod
+    def _squared_distances(rows, cols):
+        """
+        Compute the (nrow, ncol) matrix of squared distances coordinate by coordinate.
+        """
+        d2 = np.subtract.outer(rows[:, 0], cols[:, 0])
+        d2 *= d2
+        for x in (1, 2):
+            dx = np.subtract.outer(rows[:, x], cols[:, x])
+            dx *= dx
+            d2 += dx
+        return d2
 
-            if sum(phase_check) == 3:
-                break
-        return new_geometry
+    @staticmethod
+    def _nuclear_repulsion_energy(geom, Z):
+        """
+        Compute sum_{i<j} Z_i Z_j / r_ij evaluated over row blocks.
+        """
+        nat = geom.shape[0]
+        block = Molecule._pair_block_size(nat)
 
-    def __str__(self):
-        return self.pretty_print()
+        nre = 0.0
+        for start in range(0, nat, block):
+            stop = min(start + block, nat)
+
+            # Only pairs (i, j) with j > i, so columns begin at the first row of the block
+            d2 = Molecule._squared_distances(geom[start:stop], geom[start:])
+            d2[np.tril_indices(stop - start)] = np.inf
+
+            nre += np.einsum("i,ij,j->", Z[start:stop], 1.0 / np.sqrt(d2), Z[start:])
+
+        return float(nre)
 
     @staticmethod
-    def _inertial_tensor(geom, weight):
+    def _nuclear_repulsion_gradient(geom, Z):
         """
-        Compute the moment inertia tensor for a given geometry.
+        Compute -sum_{j!=i} Z_i Z_j (R_i - R_j) / r_ij^3 evaluated over row blocks.
         """
-        # Build inertia tensor
-        tensor = np.zeros((3, 3))
+        nat = geom.shape[0]
+        block = Molecule._pair_block_size(nat)
 
-        # Diagonal
-        tensor[0][0] = np.sum(weight * (geom[:, 1]**2.0 + geom[:, 2]**2.0))
-        tensor[1][1] = np.sum(weight * (geom[:, 0]**2.0 + geom[:, 2]**2.0))
-        tensor[2][2] = np.sum(weight * (geom[:, 0]**2.0 + geom[:, 1]**2.0))
+        grad = np.zeros((nat, 3))
+        for start in range(0, nat, block):
+            stop = min(start + block, nat)
 
-        # I(alpha, beta)
-        # Off diagonal
-        tensor[1][0] = tensor[0][1] = -1.0 * np.sum(weight * geom[:, 0] * geom[:, 1])
-        tensor[2][0] = tensor[0][2] = -1.0 * np.sum(weight * geom[:, 0] * geom[:, 2])
-        tensor[2][1] = tensor[1][2] = -1.0 * np.sum(weight * geom[:, 1] * geom[:, 2])
-        return tensor
+            d2 = Molecule._squared_distances(geom[start:stop], geom)
+
+            # Remove self-interaction
+            rows = np.arange(stop - start)
+            d2[rows, rows + start] = np.inf
+
+            # w_ij = Z_i Z_j / r_ij^3, contracted as sum_j w_ij (R_i - R_j)
+            w = d2 * np.sqrt(d2)
+            np.reciprocal(w, out=w)
+            w *= Z[start:stop, None]
+            w *= Z[None, :]
+            grad[start:stop] = w @ geom - w.sum(axis=1)[:, None] * geom[start:stop]
+
+        return grad
 
     def _to_psi4_string(self):
         """Regenerates a input file molecule specification string from the
@@ -615,21 +1877,22 @@ class Molecule(BaseModel):
         text = "\n"
 
         # append atoms and coordinates and fragment separators with charge and multiplicity
+        symbols, real = self.symbols, self.real
         for num, frag in enumerate(self.fragments):
             divider = "    --"
             if num == 0:
                 divider = ""
 
-            if any(self.real[at] for at in frag):
+            if any(real[at] for at in frag):
                 text += "{0:s}    \n    {1:d} {2:d}\n".format(divider,
                                                               int(self.fragment_charges[num]),
                                                               self.fragment_multiplicities[num])
 
             for at in frag:
-                if self.real[at]:
-                    text += "    {0:<8s}".format(str(self.symbols[at]))
+                if real[at]:
+                    text += "    {0:<8s}".format(str(symbols[at]))
                 else:
-                    text += "    {0:<8s}".format("Gh(" + self.symbols[at] + ")")
+                    text += "    {0:<8s}".format("Gh(" + symbols[at] + ")")
                 text += "    {0: 14.10f} {1: 14.10f} {2: 14.10f}\n".format(*tuple(self.geometry[at]))
         text += "\n"
 
@@ -0,0 +1,480 @@
+"""
+Columnar storage for large collections of molecules
+"""
+
+import hashlib
+import json
+
+import numpy as np
+
+from ..periodic_table import periodictable
+from ..physical_constants import constants
+from .molecule import CHARGE_NOISE, GEOMETRY_NOISE, MASS_NOISE, Molecule, float_prep
+
+
+class MoleculeBatch:
+    """Struct-of-arrays container for many molecules.
+
+    All per-atom data of the molecules is concatenated into single arrays and each
+    molecule is addressed through offsets, so that holding many small molecules
+    does not require a Python object per atom or per molecule.
+
+    Parameters
+    ----------
+    geometry : array_like
+        (nat, 3) Concatenated Cartesian coordinates [a0].
+    atomic_numbers : array_like
+        (nat, ) Concatenated atomic numbers.
+    masses : array_like
+        (nat, ) Concatenated atomic masses [u].
+    real : array_like
+        (nat, ) Concatenated real/ghostedness of atoms.
+    atom_offsets : array_like
+        (nmol + 1, ) Index of the first atom of each molecule, followed by `nat`.
+    fragment_atoms : array_like, optional
+        (nat, ) Molecule-local atom indices ordered by fragment. Defaults to one
+        fragment per molecule.
+    fragment_offsets : array_like, optional
+        (nfrag + 1, ) Index into `fragment_atoms` of the first atom of each fragment, followed by `nat`.
+    molecule_fragment_offsets : array_like, optional
+        (nmol + 1, ) Index of the first fragment of each molecule, followed by `nfrag`.
+    fragment_charges : array_like, optional
+        (nfrag, ) Charge of each fragment. Defaults to neutral.
+    fragment_multiplicities : array_like, optional
+        (nfrag, ) Multiplicity of each fragment. Defaults to singlets.
+    molecular_charges : array_like, optional
+        (nmol, ) Charge of each molecule. Defaults to the sum of its fragment charges.
+    molecular_multiplicities : array_like, optional
+        (nmol, ) Multiplicity of each molecule. Defaults to high-spin coupling of its fragments.
+    names : list of str, optional
+        (nmol, ) Name of each molecule.
+    geometry_dtype : {np.double, np.float32}, optional
+        Storage precision of the geometry. Single precision halves the geometry footprint
+        of archival collections, but coordinates then only hold about seven significant
+        digits, so hashes of materialized molecules will generally differ from the originals.
+
+    Notes
+    -----
+    Connectivity, identifiers, and other per-molecule metadata are not stored.
+    """
+
+    def __init__(self,
+                 geometry,
+                 atomic_numbers,
+                 masses,
+                 real,
+                 atom_offsets,
+                 fragment_atoms=None,
+                 fragment_offsets=None,
+                 molecule_fragment_offsets=None,
+                 fragment_charges=None,
+                 fragment_multiplicities=None,
+                 molecular_charges=None,
+                 molecular_multiplicities=None,
+                 names=None,
+                 geometry_dtype=np.double):
+
+        self.atom_offsets = np.asarray(atom_offsets, dtype=np.int64)
+        nmol = self.atom_offsets.shape[0] - 1
+        nat = int(self.atom_offsets[-1])
+
+        if np.dtype(geometry_dtype) not in (np.dtype(np.double), np.dtype(np.float32)):
+            raise ValueError("Geometry dtype must be float64 or float32, found {}.".format(np.dtype(geometry_dtype)))
+        self.geometry = np.asarray(geometry, dtype=geometry_dtype).reshape(-1, 3)
+        self.atomic_numbers = np.asarray(atomic_numbers, dtype=np.int16)
+        self.masses = np.asarray(masses, dtype=np.double)
+        self.real = np.asarray(real, dtype=bool)
+
+        if not (self.geometry.shape[0] == self.atomic_numbers.shape[0] == self.masses.shape[0] ==
+                self.real.shape[0] == nat):
+            raise ValueError("Per-atom arrays must all have length atom_offsets[-1] ({}).".format(nat))
+        if np.any(np.diff(self.atom_offsets) < 1) or self.atom_offsets[0] != 0:
+            raise ValueError("Atom offsets must start at 0 and every molecule must contain atoms.")
+
+        if fragment_offsets is None:
+            self.fragment_atoms = np.arange(nat) - np.repeat(self.atom_offsets[:-1], self.natoms)
+            self.fragment_offsets = self.atom_offsets.copy()
+            self.molecule_fragment_offsets = np.arange(nmol + 1)
+        else:
+            self.fragment_atoms = np.asarray(fragment_atoms, dtype=np.int64)
+            self.fragment_offsets = np.asarray(fragment_offsets, dtype=np.int64)
+            self.molecule_fragment_offsets = np.asarray(molecule_fragment_offsets, dtype=np.int64)
+        nfrag = self.fragment_offsets.shape[0] - 1
+
+        if fragment_charges is None:
+            fragment_charges = np.zeros(nfrag)
+        self.fragment_charges = np.asarray(fragment_charges, dtype=np.double)
+
+        if fragment_multiplicities is None:
+            fragment_multiplicities = np.ones(nfrag)
+        self.fragment_multiplicities = np.asarray(fragment_multiplicities, dtype=np.int64)
+
+        frag_starts = self.molecule_fragment_offsets[:-1]
+        if molecular_charges is None:
+            molecular_charges = np.add.reduceat(self.fragment_charges, frag_starts)
+        self.molecular_charges = np.asarray(molecular_charges, dtype=np.double)
+
+        if molecular_multiplicities is None:
+            molecular_multiplicities = np.add.reduceat(self.fragment_multiplicities - 1, frag_starts) + 1
+        self.molecular_multiplicities = np.asarray(molecular_multiplicities, dtype=np.int64)
+
+        self.names = names
+
+    @classmethod
+    def from_molecules(cls, molecules, geometry_dtype=np.double):
+        """
+        Constructs a batch from a list of Molecule objects.
+
+        Parameters
+        ----------
+        molecules : list of Molecule
+            The molecules to store.
+        geometry_dtype : {np.double, np.float32}, optional
+            Storage precision of the geometry, see :py:class:`MoleculeBatch`.
+
+        Returns
+        -------
+        MoleculeBatch
+            A batch holding the atom, fragment, charge, and multiplicity data of `molecules`.
+        """
+        molecules = list(molecules)
+        values = [mol.__values__ for mol in molecules]
+
+        return cls(
+            geometry=np.concatenate([mol.geometry for mol in molecules]) if molecules else np.zeros((0, 3)),
+            atomic_numbers=np.concatenate([mol._atomic_numbers() for mol in molecules] + [np.zeros(0)]),
+            masses=np.concatenate([v["masses"] for v in values] + [np.zeros(0)]),
+            real=np.concatenate([v["real"] for v in values] + [np.zeros(0, dtype=bool)]),
+            atom_offsets=np.cumsum([0] + [mol.geometry.shape[0] for mol in molecules]),
+            fragment_atoms=np.concatenate([v["fragments"].indices for v in values] + [np.zeros(0)]),
+            fragment_offsets=np.cumsum(np.concatenate([[0]] + [np.diff(v["fragments"].ptr) for v in values])),
+            molecule_fragment_offsets=np.cumsum([0] + [len(v["fragments"]) for v in values]),
+            fragment_charges=[x for mol in molecules for x in mol.fragment_charges],
+            fragment_multiplicities=[x for mol in molecules for x in mol.fragment_multiplicities],
+            molecular_charges=[mol.molecular_charge for mol in molecules],
+            molecular_multiplicities=[mol.molecular_multiplicity for mol in molecules],
+            names=[mol.name for mol in molecules],
+            geometry_dtype=geometry_dtype)
+
+    @classmethod
+    def from_arrays(cls, geometry, atomic_numbers, atom_offsets, masses=None, real=None, **kwargs):
+        """
+        Constructs a batch directly from concatenated per-atom arrays.
+
+        Parameters
+        ----------
+        geometry : array_like
+            (nat, 3) Concatenated Cartesian coordinates [a0].
+        atomic_numbers : array_like
+            (nat, ) Concatenated atomic numbers.
+        atom_offsets : array_like
+            (nmol + 1, ) Index of the first atom of each molecule, followed by `nat`.
+        masses : array_like, optional
+            (nat, ) Concatenated atomic masses [u]. Defaults to the most abundant isotope of each element.
+        real : array_like, optional
+            (nat, ) Concatenated real/ghostedness of atoms. Defaults to all real.
+        **kwargs
+            Further keywords of :py:class:`MoleculeBatch`.
+
+        Returns
+        -------
+        MoleculeBatch
+            The batch, with one fragment per molecule unless fragments are given.
+        """
+        atomic_numbers = np.asarray(atomic_numbers, dtype=np.int16)
+        if masses is None:
+            # One lookup per distinct element rather than per atom
+            elements, inverse = np.unique(atomic_numbers, return_inverse=True)
+            masses = np.array([periodictable.to_mass(int(z)) for z in elements], dtype=np.double)[inverse.ravel()]
+        if real is None:
+            real = np.ones(atomic_numbers.shape[0], dtype=bool)
+
+        return cls(geometry, atomic_numbers, masses, real, atom_offsets, **kwargs)
+
+    def __len__(self):
+        return self.atom_offsets.shape[0] - 1
+
+    def __getitem__(self, index):
+        return self.to_molecule(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.to_molecule(index)
+
+    @property
+    def natoms(self):
+        """(nmol, ) Number of atoms in each molecule."""
+        return np.diff(self.atom_offsets)
+
+    @property
+    def symbols(self):
+        """(nat, ) Concatenated element symbols."""
+        return np.array(periodictable.E, dtype=object)[self.atomic_numbers]
+
+    def view(self, index):
+        """
+        Returns zero-copy views of the per-atom arrays of a single molecule.
+
+        Parameters
+        ----------
+        index : int
+            The molecule to view.
+
+        Returns
+        -------
+        dict
+            Views of "geometry", "atomic_numbers", "masses", and "real" for molecule `index`.
+        """
+        atoms = slice(self.atom_offsets[index], self.atom_offsets[index + 1])
+        return {
+            "geometry": self.geometry[atoms],
+            "atomic_numbers": self.atomic_numbers[atoms],
+            "masses": self.masses[atoms],
+            "real": self.real[atoms],
+        }
+
+    def to_molecule(self, index, orient=False):
+        """
+        Materializes a single molecule of the batch.
+
+        Parameters
+        ----------
+        index : int
+            The molecule to build.
+        orient : bool, optional
+            Orientates the molecule to a standard frame or not.
+
+        Returns
+        -------
+        Molecule
+            The constructed molecule.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("MoleculeBatch index {} out of range.".format(index))
+
+        arrays = self.view(index)
+        frags = slice(self.molecule_fragment_offsets[index], self.molecule_fragment_offsets[index + 1])
+
+        data = {
+            "symbols": np.array(periodictable.E)[arrays["atomic_numbers"]].tolist(),
+            "geometry": arrays["geometry"],
+            "atomic_numbers": arrays["atomic_numbers"].tolist(),
+            "masses": arrays["masses"].tolist(),
+            "real": arrays["real"].tolist(),
+            "fragments": self._fragments(index),
+            "fragment_charges": self.fragment_charges[frags].tolist(),
+            "fragment_multiplicities": self.fragment_multiplicities[frags].tolist(),
+            "molecular_charge": float(self.molecular_charges[index]),
+            "molecular_multiplicity": int(self.molecular_multiplicities[index]),
+        }
+        if self.names is not None:
+            data["name"] = self.names[index]
+
+        return Molecule(orient=orient, **data)
+
+    def get_hash(self):
+        """
+        Returns the hash of each molecule, identical to ``Molecule.get_hash`` of the materialized molecules.
+        """
+        geometry = float_prep(self.geometry.astype(np.double), GEOMETRY_NOISE, inplace=True)
+        masses = float_prep(self.masses, MASS_NOISE)
+        fragment_charges = float_prep(self.fragment_charges, CHARGE_NOISE)
+        symbols = self.symbols
+
+        hashes = []
+        for index in range(len(self)):
+            atoms = slice(self.atom_offsets[index], self.atom_offsets[index + 1])
+            frags = slice(self.molecule_fragment_offsets[index], self.molecule_fragment_offsets[index + 1])
+
+            fields = [
+                symbols[atoms].tolist(),
+                masses[atoms].tolist(),
+                float_prep(float(self.molecular_charges[index]), CHARGE_NOISE),
+                int(self.molecular_multiplicities[index]),
+                self.real[atoms].tolist(),
+                geometry[atoms].ravel().tolist(),
+                self._fragments(index),
+                fragment_charges[frags].tolist(),
+                self.fragment_multiplicities[frags].tolist(),
+                [],
+            ]  # yapf: disable
+
+            m = hashlib.sha1()
+            m.update("".join(json.dumps(field) for field in fields).encode("utf-8"))
+            hashes.append(m.hexdigest())
+
+        return hashes
+
+    def get_molecular_formula(self):
+        """
+        Returns the molecular formula of each molecule. Atom symbols are sorted from A-Z.
+        """
+        owner = np.repeat(np.arange(len(self)), self.natoms)
+        nelem = len(periodictable.E)
+        counts = np.bincount(owner * nelem + self.atomic_numbers, minlength=len(self) * nelem).reshape(-1, nelem)
+
+        # Columns in alphabetical order of element symbol
+        order = np.argsort(periodictable.E)
+        counts = counts[:, order]
+        elements = np.array(periodictable.E)[order]
+
+        formulas = []
+        for row in counts:
+            present = np.nonzero(row)[0]
+            formulas.append("".join(elements[x] + (str(row[x]) if row[x] > 1 else "") for x in present))
+        return formulas
+
+    def center_of_mass(self):
+        """
+        Returns the (nmol, 3) center of mass of each molecule.
+        """
+        starts = self.atom_offsets[:-1]
+        weighted = np.add.reduceat(self.geometry * self.masses[:, None], starts)
+        return weighted / np.add.reduceat(self.masses, starts)[:, None]
+
+    def _inertial_tensors(self, com):
+        """
+        Returns the (nmol, 3, 3) inertia tensors [u a0^2] about the centers of mass `com`.
+        """
+        starts = self.atom_offsets[:-1]
+        centered = self.geometry - np.repeat(com, self.natoms, axis=0)
+
+        # I = sum_i m_i (r_i . r_i) 1 - sum_i m_i r_i r_i^T, summed per molecule
+        moments = np.add.reduceat(self.masses[:, None, None] * centered[:, :, None] * centered[:, None, :], starts)
+        tensors = -moments
+        tensors[:, [0, 1, 2], [0, 1, 2]] += np.trace(moments, axis1=1, axis2=2)[:, None]
+        return tensors
+
+    def principal_moments(self):
+        """
+        Returns the (nmol, 3) principal moments of inertia [u a0^2] of each molecule in ascending order.
+        """
+        return np.linalg.eigvalsh(self._inertial_tensors(self.center_of_mass()))
+
+    @staticmethod
+    def _rotational_factor(units):
+        """
+        Returns the factor converting 1 / I [u a0^2] into a rotational constant in `units`.
+        """
+        # B = h / (8 pi^2 I) in Hz, with I in SI units
+        factor = constants.h / (8 * np.pi**2 * constants.conversion_factor("amu * bohr ** 2", "kg * m ** 2"))
+        if units == "cm^-1":
+            return factor / (100 * constants.c)
+        return factor * constants.conversion_factor("hertz", units)
+
+    def rotational_constants(self, units="cm^-1"):
+        """
+        Returns the (nmol, 3) rotational constants A >= B >= C of each molecule.
+
+        Parameters
+        ----------
+        units : str, optional
+            Either "cm^-1" or a frequency unit such as "MHz".
+
+        Returns
+        -------
+        np.ndarray
+            The rotational constants, infinite for vanishing moments of inertia as in linear molecules.
+        """
+        factor = self._rotational_factor(units)
+        with np.errstate(divide="ignore"):
+            return factor / self._nonzero_moments(self.principal_moments())
+
+    @staticmethod
+    def _nonzero_moments(moments):
+        """
+        Zeroes moments that vanish up to round-off so that they give infinite rotational constants.
+        """
+        return np.where(moments > 1.e-8 * np.maximum(moments[:, -1:], 1.e-8), moments, 0.0)
+
+    def radius_of_gyration(self):
+        """
+        Returns the (nmol, ) mass-weighted radius of gyration [a0] of each molecule.
+        """
+        starts = self.atom_offsets[:-1]
+        centered = self.geometry - np.repeat(self.center_of_mass(), self.natoms, axis=0)
+        spread = np.add.reduceat(self.masses * np.einsum("ij,ij->i", centered, centered), starts)
+        return np.sqrt(spread / np.add.reduceat(self.masses, starts))
+
+    def nelectrons(self):
+        """
+        Returns the (nmol, ) number of electrons of each molecule, ghost atoms contribute none.
+        """
+        nuclear = np.add.reduceat(np.where(self.real, self.atomic_numbers, 0).astype(np.int64), self.atom_offsets[:-1])
+        return nuclear - np.rint(self.molecular_charges).astype(np.int64)
+
+    def descriptors(self, units="cm^-1"):
+        """
+        Computes all geometric and compositional descriptors of every molecule at once.
+
+        Parameters
+        ----------
+        units : str, optional
+            Units of the rotational constants, see `rotational_constants`.
+
+        Returns
+        -------
+        dict
+            "formula", "nelectrons", "center_of_mass" [a0], "principal_moments" [u a0^2],
+            "rotational_constants", and "radius_of_gyration" [a0] of each molecule.
+        """
+        starts = self.atom_offsets[:-1]
+        total_mass = np.add.reduceat(self.masses, starts)
+        com = np.add.reduceat(self.geometry * self.masses[:, None], starts) / total_mass[:, None]
+
+        tensors = self._inertial_tensors(com)
+        moments = np.linalg.eigvalsh(tensors)
+        with np.errstate(divide="ignore"):
+            rotational = self._rotational_factor(units) / self._nonzero_moments(moments)
+
+        # Tr(I) = 2 sum_i m_i |r_i|^2
+        gyration = np.sqrt(0.5 * np.trace(tensors, axis1=1, axis2=2) / total_mass)
+
+        return {
+            "formula": self.get_molecular_formula(),
+            "nelectrons": self.nelectrons(),
+            "center_of_mass": com,
+            "principal_moments": moments,
+            "rotational_constants": rotational,
+            "radius_of_gyration": gyration,
+        }
+
+    def orient(self, return_transform=False):
+        """
+        Centers and orients every molecule via its inertia tensor, returning a new batch.
+
+        Parameters
+        ----------
+        return_transform : bool, optional
+            Also return the stacked FrameTransform of all molecules, indexing it gives the
+            transform of a single molecule.
+
+        Returns
+        -------
+        MoleculeBatch
+            The oriented batch.
+        FrameTransform
+            (nmol, ) Transforms from the frames of this batch to the oriented one, if `return_transform`.
+        """
+        geometry, transform = Molecule._orient_geometries(self.geometry,
+                                                          self.masses,
+                                                          self.atom_offsets[:-1],
+                                                          return_transform=True)
+        geometry = float_prep(geometry, GEOMETRY_NOISE, inplace=True)
+
+        ret = self.__class__.__new__(self.__class__)
+        ret.__dict__.update(self.__dict__)
+        ret.geometry = geometry.astype(self.geometry.dtype, copy=False)
+        if return_transform:
+            return ret, transform
+        return ret
+
+    def _fragments(self, index):
+        """
+        Returns the fragments of molecule `index` as lists of molecule-local atom indices.
+        """
+        frag_start, frag_stop = self.molecule_fragment_offsets[index:index + 2]
+        ptr = self.fragment_offsets[frag_start:frag_stop + 1]
+        return [self.fragment_atoms[ptr[x]:ptr[x + 1]].tolist() for x in range(ptr.shape[0] - 1)]
@@ -0,0 +1,386 @@
+"""
+Indices for finding duplicate and near-duplicate molecules in large collections
+"""
+
+import itertools
+import json
+
+import numpy as np
+
+from ..molparse import to_schema
+from .molecule import Molecule
+
+
+class MoleculeIndex:
+    """Collection of molecules grouped into sets of duplicates.
+
+    Molecules are bucketed by molecular formula and hash, so finding the duplicates
+    of a new molecule costs a dictionary lookup rather than a comparison against every
+    stored molecule. Molecules that share a bucket are confirmed with the tolerance-aware
+    `Molecule.compare`; a true hash collision therefore starts a new group in the same bucket.
+
+    Parameters
+    ----------
+    molecules : Iterable[Union[Molecule, dict]], optional
+        Initial molecules to ingest, see `extend`.
+
+    Examples
+    --------
+
+    >>> index = MoleculeIndex([water, water_copy, ammonia])
+    >>> index.duplicate_groups()
+    [[0, 1]]
+
+    """
+
+    def __init__(self, molecules=None):
+        self._molecules = []  # index -> Molecule
+        self._hashes = []  # index -> hash
+        self._group_of = []  # index -> group
+        self._groups = []  # group -> list of indices, the first is the representative
+        self._buckets = {}  # (formula, hash) -> list of groups
+
+        if molecules is not None:
+            self.extend(molecules)
+
+    def __len__(self):
+        return len(self._molecules)
+
+    def __getitem__(self, index):
+        return self._molecules[index]
+
+    def __iter__(self):
+        return iter(self._molecules)
+
+    def __contains__(self, molecule):
+        return self.find(molecule) is not None
+
+    def __repr__(self):
+        return "MoleculeIndex(nmol={}, ngroups={})".format(len(self), len(self._groups))
+
+    @staticmethod
+    def _as_molecule(data):
+        """
+        Coerces a Molecule, a Molecule dictionary, or a molparse molrec into a Molecule.
+        """
+        if isinstance(data, Molecule):
+            return data
+        elif isinstance(data, dict):
+            if "geom" in data:
+                data = to_schema(data, dtype=1)["molecule"]
+            return Molecule(orient=False, **data)
+        else:
+            raise TypeError("MoleculeIndex input not understood of type '{}'.".format(type(data)))
+
+    def _match(self, molecule, key):
+        """
+        Returns the group within bucket `key` that `molecule` belongs to, or None.
+        """
+        for group in self._buckets.get(key, []):
+            if self._molecules[self._groups[group][0]].compare(molecule):
+                return group
+        return None
+
+    def _insert(self, molecule, molecule_hash, key):
+        index = len(self._molecules)
+        group = self._match(molecule, key)
+        if group is None:
+            group = len(self._groups)
+            self._groups.append([])
+            self._buckets.setdefault(key, []).append(group)
+
+        self._groups[group].append(index)
+        self._molecules.append(molecule)
+        self._hashes.append(molecule_hash)
+        self._group_of.append(group)
+        return index
+
+    def add(self, molecule):
+        """
+        Inserts a molecule into the index.
+
+        Parameters
+        ----------
+        molecule : Union[Molecule, dict]
+            A Molecule, a Molecule dictionary, or a molparse molrec.
+
+        Returns
+        -------
+        int
+            The index of the inserted molecule.
+        """
+        molecule = self._as_molecule(molecule)
+        molecule_hash = molecule.get_hash()
+        return self._insert(molecule, molecule_hash, (molecule.get_molecular_formula(), molecule_hash))
+
+    def extend(self, molecules):
+        """
+        Inserts many molecules into the index.
+
+        Parameters
+        ----------
+        molecules : Iterable[Union[Molecule, dict]]
+            Molecules, Molecule dictionaries, or molparse molrecs.
+
+        Returns
+        -------
+        List[int]
+            The indices of the inserted molecules.
+        """
+        return [self.add(molecule) for molecule in molecules]
+
+    def find(self, molecule):
+        """
+        Returns the indices of the stored duplicates of `molecule`, or None if it is new.
+        """
+        molecule = self._as_molecule(molecule)
+        group = self._match(molecule, (molecule.get_molecular_formula(), molecule.get_hash()))
+        if group is None:
+            return None
+        return list(self._groups[group])
+
+    def group_of(self, index):
+        """
+        Returns the indices of all molecules that are duplicates of molecule `index`, including itself.
+        """
+        return list(self._groups[self._group_of[index]])
+
+    @property
+    def groups(self):
+        """
+        All groups of duplicate molecules as lists of indices in insertion order.
+        """
+        return [list(group) for group in self._groups]
+
+    def duplicate_groups(self):
+        """
+        Returns the groups which contain more than one molecule.
+        """
+        return [list(group) for group in self._groups if len(group) > 1]
+
+    def unique(self):
+        """
+        Returns the first inserted molecule of every group.
+        """
+        return [self._molecules[group[0]] for group in self._groups]
+
+    def to_file(self, filename):
+        """
+        Writes the index to a single JSON file.
+
+        Parameters
+        ----------
+        filename : str
+            The file to write.
+        """
+        data = {
+            "schema_name": "qcelemental_molecule_index",
+            "schema_version": 1,
+            "molecules": [molecule.json_dict() for molecule in self._molecules],
+            "hashes": self._hashes,
+            "groups": self._groups,
+        }
+        with open(filename, "w") as outfile:
+            json.dump(data, outfile)
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        Reads an index written by `to_file` without rehashing the stored molecules.
+
+        Parameters
+        ----------
+        filename : str
+            The file to read.
+
+        Returns
+        -------
+        MoleculeIndex
+            The restored index.
+        """
+        with open(filename, "r") as infile:
+            data = json.load(infile)
+
+        if data.get("schema_name") != "qcelemental_molecule_index":
+            raise TypeError("File '{}' is not a MoleculeIndex file.".format(filename))
+
+        index = cls()
+        index._molecules = [Molecule(orient=False, **molecule) for molecule in data["molecules"]]
+        index._hashes = data["hashes"]
+        index._groups = data["groups"]
+        index._group_of = [None] * len(index._molecules)
+        for group, members in enumerate(index._groups):
+            for member in members:
+                index._group_of[member] = group
+
+            representative = index._molecules[members[0]]
+            key = (representative.get_molecular_formula(), index._hashes[members[0]])
+            index._buckets.setdefault(key, []).append(group)
+
+        return index
+
+
+class FingerprintIndex:
+    """Locality-sensitive hashing index for finding near-duplicate conformers.
+
+    Each molecule is reduced to its `Molecule.get_fingerprint` and hashed by
+    ``ntables`` independent tables of ``nhashes`` random projections quantized into
+    buckets of ``width``. Molecules sharing a bucket in any table are candidates, which are
+    confirmed if they have the same formula and their element-pair sorted interatomic
+    distances all agree within ``tolerance``. Only candidates are compared, so queries
+    do not scale with the size of the index.
+
+    More tables raise the recall, while more hashes per table and a smaller width
+    shrink the candidate lists; the confirmation step keeps the precision exact.
+
+    Parameters
+    ----------
+    tolerance : float, optional
+        Largest difference [a0] of any sorted interatomic distance between near-duplicates.
+    ntables : int, optional
+        Number of hash tables.
+    nhashes : int, optional
+        Number of projections combined into the key of each table.
+    width : float, optional
+        Bucket width of the projected fingerprints.
+    seed : int, optional
+        Seed of the random projections, indices must share it to be comparable.
+    fingerprint_kwargs : dict, optional
+        Keywords passed to `Molecule.get_fingerprint`.
+
+    Notes
+    -----
+    Molecules are not stored, only their fingerprint keys and distance signatures; the
+    index of a molecule is its insertion order.
+    """
+
+    def __init__(self, tolerance=1.e-4, *, ntables=8, nhashes=4, width=1.0, seed=0, fingerprint_kwargs=None):
+        self.tolerance = tolerance
+        self.ntables = ntables
+        self.nhashes = nhashes
+        self.width = width
+        self.fingerprint_kwargs = {} if fingerprint_kwargs is None else dict(fingerprint_kwargs)
+
+        self._seed = seed
+        self._projection = None  # (nfeature, ntables * nhashes), built from the first fingerprint
+        self._offset = None
+
+        self._formulas = []
+        self._signatures = []
+        self._tables = [{} for _ in range(ntables)]
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def __repr__(self):
+        return "FingerprintIndex(nmol={}, tolerance={})".format(len(self), self.tolerance)
+
+    def _keys(self, fingerprints):
+        """
+        Returns the (n, ntables) bucket keys of a stack of fingerprints.
+        """
+        if self._projection is None:
+            rng = np.random.RandomState(self._seed)
+            self._projection = rng.standard_normal((fingerprints.shape[1], self.ntables * self.nhashes))
+            self._offset = rng.uniform(0.0, self.width, self.ntables * self.nhashes)
+
+        hashed = np.floor((fingerprints @ self._projection + self._offset) / self.width).astype(np.int64)
+        hashed = hashed.reshape(fingerprints.shape[0], self.ntables, self.nhashes)
+        return [[row.tobytes() for row in molecule] for molecule in hashed]
+
+    def _prepare(self, molecules):
+        molecules = [MoleculeIndex._as_molecule(molecule) for molecule in molecules]
+        if len(molecules) == 0:
+            return [], [], []
+
+        fingerprints = np.array([molecule.get_fingerprint(**self.fingerprint_kwargs) for molecule in molecules])
+        formulas = [molecule.get_molecular_formula() for molecule in molecules]
+        signatures = [molecule._distance_signature()[1] for molecule in molecules]
+        return formulas, signatures, self._keys(fingerprints)
+
+    def _confirm(self, formula, signature, index):
+        return (formula == self._formulas[index]
+                and np.max(np.abs(signature - self._signatures[index]), initial=0.0) <= self.tolerance)
+
+    def _candidates(self, formula, keys):
+        candidates = set()
+        for table, key in zip(self._tables, keys):
+            candidates.update(table.get((formula, key), ()))
+        return sorted(candidates)
+
+    def extend(self, molecules):
+        """
+        Inserts many molecules, projecting all of their fingerprints at once.
+
+        Parameters
+        ----------
+        molecules : Iterable[Union[Molecule, dict]]
+            Molecules, Molecule dictionaries, or molparse molrecs.
+
+        Returns
+        -------
+        List[int]
+            The indices of the inserted molecules.
+        """
+        indices = []
+        for formula, signature, keys in zip(*self._prepare(molecules)):
+            index = len(self._signatures)
+            self._formulas.append(formula)
+            self._signatures.append(signature)
+            for table, key in zip(self._tables, keys):
+                table.setdefault((formula, key), []).append(index)
+            indices.append(index)
+
+        return indices
+
+    def add(self, molecule):
+        """
+        Inserts a molecule and returns its index.
+        """
+        return self.extend([molecule])[0]
+
+    def query(self, molecule):
+        """
+        Returns the indices of the stored near-duplicates of `molecule`.
+        """
+        (formula, ), (signature, ), (keys, ) = self._prepare([molecule])
+        return [i for i in self._candidates(formula, keys) if self._confirm(formula, signature, i)]
+
+    def near_duplicate_pairs(self):
+        """
+        Returns all confirmed pairs ``(i, j)`` with ``i < j`` of near-duplicate molecules.
+        """
+        checked = set()
+        pairs = []
+        for table in self._tables:
+            for members in table.values():
+                for i, j in itertools.combinations(members, 2):
+                    if (i, j) in checked:
+                        continue
+                    checked.add((i, j))
+                    if self._confirm(self._formulas[i], self._signatures[i], j):
+                        pairs.append((i, j))
+
+        return sorted(pairs)
+
+    def groups(self):
+        """
+        Returns the groups of molecules connected by near-duplicate pairs, including singletons.
+        """
+        parent = list(range(len(self)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in self.near_duplicate_pairs():
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+        groups = {}
+        for i in range(len(self)):
+            groups.setdefault(find(i), []).append(i)
+        return list(groups.values())
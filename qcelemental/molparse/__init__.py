@@ -5,3 +5,4 @@ from .chgmult import validate_and_fill_chgmult
 from .to_string import to_string
 from .to_schema import to_schema
 from .from_schema import from_schema, contiguize_from_fragment_pattern
+from .zmat import ZMatrix, settle_geometry, zmat_to_cartesian
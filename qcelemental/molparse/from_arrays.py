@@ -445,22 +445,35 @@ def validate_and_fill_units(name=None,
             molinit['provenance'] = copy.deepcopy(provenance)
 
     if connectivity is not None:
-        conn = []
         try:
-            for (at1, at2, bondorder) in connectivity:
-                if not (float(at1)).is_integer() or at1 < 0:  # or at1 >= nat:
-                    raise ValidationError("""Connectivity first atom should be int [0, nat): {}""".format(at1))
-                if not (float(at2)).is_integer() or at2 < 0:  # or at2 >= nat:
-                    raise ValidationError("""Connectivity second atom should be int [0, nat): {}""".format(at2))
-                if bondorder < 0 or bondorder > 5:
-                    raise ValidationError("""Connectivity bond order should be float [0, 5]: {}""".format(bondorder))
-                conn.append((int(min(at1, at2)), int(max(at1, at2)), float(bondorder)))
-            conn.sort(key=lambda tup: tup[0])
-            molinit['connectivity'] = conn
-        except ValueError:
+            bonds = np.asarray(connectivity, dtype=np.double)
+            if bonds.size == 0:
+                bonds = bonds.reshape(0, 3)
+            if bonds.ndim != 2 or bonds.shape[1] != 3:
+                raise ValueError
+        except (TypeError, ValueError):
             raise ValidationError(
                 "Connectivity entry is not of form [(at1, at2, bondorder), ...]: {}".format(connectivity))
 
+        # check all entries at once, then report the first failure in entry order
+        bad_atom = (bonds[:, :2] < 0) | (bonds[:, :2] != np.floor(bonds[:, :2]))
+        bad_order = (bonds[:, 2] < 0) | (bonds[:, 2] > 5)
+        bad = np.column_stack((bad_atom, bad_order))
+        if bad.any():
+            row, col = divmod(int(np.argmax(bad.ravel())), 3)
+            value = bonds[row, col]
+            if col == 0:
+                raise ValidationError("""Connectivity first atom should be int [0, nat): {}""".format(value))
+            elif col == 1:
+                raise ValidationError("""Connectivity second atom should be int [0, nat): {}""".format(value))
+            else:
+                raise ValidationError("""Connectivity bond order should be float [0, 5]: {}""".format(value))
+
+        atoms = np.sort(bonds[:, :2], axis=1).astype(np.int64)
+        order = np.argsort(atoms[:, 0], kind='stable')
+        molinit['connectivity'] = list(
+            zip(atoms[order, 0].tolist(), atoms[order, 1].tolist(), bonds[order, 2].tolist()))
+
     if units.capitalize() in ['Angstrom', 'Bohr']:
         molinit['units'] = units.capitalize()
     else:
@@ -0,0 +1,340 @@
+import collections
+import math
+import re
+
+import numpy as np
+
+from ..exceptions import ValidationError
+
+# Tetrahedral angle, the value of the special psi4 variable value ``tda``
+TDA = 360. * math.atan(math.sqrt(2)) / math.pi
+
+_NUMBER = re.compile(r'\A[-+]?(\d+\.?\d*|\.\d+)([ed][-+]?\d+)?\Z', re.IGNORECASE)
+
+# Number of entries of a `geom_unsettled` line for each placement rule
+_KINDS = {0: 'origin', 2: 'bond', 3: 'cartesian', 4: 'angle', 6: 'dihedral'}
+
+
+class ZMatrix:
+    """Compiled Z-matrix converting variable values into Cartesian coordinates.
+
+    Anchors, constants, and variable references of a `geom_unsettled` specification are
+    resolved once into index arrays. Atoms are then placed level by level, where a level
+    holds every atom whose anchors are already placed, so each level is a single
+    vectorized operation over its atoms and over all variable sets being evaluated.
+
+    Placement follows the psi4 conventions: the first atom at the origin, the second
+    along the z axis, the third in the xz plane, and all further atoms by bond,
+    angle [deg], and dihedral [deg] with respect to earlier atoms. Cartesian lines
+    may be mixed in as described by :py:func:`validate_and_fill_unsettled_geometry`.
+
+    Parameters
+    ----------
+    geom_unsettled : list of lists of str
+        (nat, ) Each atom's Cartesian values or Z-matrix anchors and values, as
+        produced by :py:func:`qcelemental.molparse.from_string` with ``dtype='psi4+'``.
+    labels : list of str, optional
+        (nat, ) Atom labels to which anchors may refer instead of 1-indexed positions.
+
+    Examples
+    --------
+
+    >>> zmat = ZMatrix([[], ['1', 'R'], ['1', 'R', '2', 'A']])
+    >>> zmat.cartesian({'R': [0.95, 1.00], 'A': 104.5}).shape
+    (2, 3, 3)
+
+    """
+
+    def __init__(self, geom_unsettled, labels=None):
+        self.nat = len(geom_unsettled)
+        self.variables = []  # names of the variables in order of first appearance
+
+        variable_column = collections.OrderedDict()
+        constants = []
+        anchors = np.full((self.nat, 3), -1, dtype=np.intp)
+        columns = np.zeros((self.nat, 3), dtype=np.intp)
+        signs = np.ones((self.nat, 3))
+        kinds = []
+
+        def column(token):
+            token = str(token)
+            if _NUMBER.match(token):
+                constants.append(float(token.replace('d', 'e').replace('D', 'e')))
+                return ('const', len(constants) - 1), 1.0
+            sign = 1.0
+            if token.startswith('-'):
+                sign, token = -1.0, token[1:]
+            return ('var', variable_column.setdefault(token, len(variable_column))), sign
+
+        lookup = {}
+        for iat, line in enumerate(geom_unsettled):
+            if len(line) not in _KINDS:
+                raise ValidationError("""Z-matrix line should have 0, 2, 3, 4, or 6 entries: {}""".format(line))
+            kind = _KINDS[len(line)]
+            kinds.append(kind)
+
+            if kind == 'cartesian':
+                refs, values = [], list(line)
+            else:
+                refs, values = list(line[0::2]), list(line[1::2])
+
+            for slot, ref in enumerate(refs):
+                anchors[iat, slot] = self._resolve_anchor(ref, iat, labels)
+            if len(set(anchors[iat, :len(refs)])) != len(refs):
+                raise ValidationError("""Z-matrix anchors of atom {} must be distinct atoms: {}""".format(
+                    iat + 1, line))
+
+            for slot, value in enumerate(values):
+                lookup[iat, slot], signs[iat, slot] = column(value)
+
+        self.variables = list(variable_column)
+        nvar = len(self.variables)
+        for (iat, slot), (source, index) in lookup.items():
+            columns[iat, slot] = index if source == 'var' else nvar + index
+
+        self._constants = np.array(constants, dtype=np.double)
+        self._anchors = anchors
+        self._columns = columns
+        self._signs = signs
+        self._kinds = np.array(kinds)
+
+        # Placement level of each atom, one more than the latest placed of its anchors
+        level = np.zeros(self.nat, dtype=np.intp)
+        for iat in range(self.nat):
+            placed = anchors[iat][anchors[iat] >= 0]
+            if placed.shape[0]:
+                level[iat] = level[placed].max() + 1
+
+        self._schedule = []
+        for lvl in range(level.max() + 1 if self.nat else 0):
+            for kind in _KINDS.values():
+                atoms = np.flatnonzero((level == lvl) & (self._kinds == kind))
+                if atoms.shape[0]:
+                    self._schedule.append((kind, atoms))
+
+    @staticmethod
+    def _resolve_anchor(ref, iat, labels):
+        """
+        Returns the 0-indexed atom to which `ref` (a 1-indexed position or an atom label) refers.
+        """
+        ref = str(ref)
+        if ref.isdigit():
+            anchor = int(ref) - 1
+        else:
+            matches = [] if labels is None else [
+                jat for jat, label in enumerate(labels[:iat]) if str(label).lower() == ref.lower()
+            ]
+            if len(matches) != 1:
+                raise ValidationError("""Z-matrix anchor '{}' of atom {} must name exactly one earlier atom""".format(
+                    ref, iat + 1))
+            anchor = matches[0]
+
+        if not 0 <= anchor < iat:
+            raise ValidationError("""Z-matrix anchor '{}' of atom {} must refer to an earlier atom""".format(
+                ref, iat + 1))
+        return anchor
+
+    def _variable_table(self, variables):
+        """
+        Returns the (nset, nvar) variable values and whether a batch was requested.
+        """
+        if variables is None:
+            variables = {}
+        elif not isinstance(variables, dict):
+            variables = dict((str(k), v) for k, v in variables)
+
+        missing = [name for name in self.variables if name not in variables]
+        if missing:
+            raise ValidationError("""Z-matrix variables missing values: {}""".format(missing))
+
+        values = []
+        for name in self.variables:
+            value = variables[name]
+            if isinstance(value, str):
+                value = TDA if value.lower() == 'tda' else float(value)
+            values.append(np.asarray(value, dtype=np.double))
+
+        batched = any(v.ndim > 0 for v in values)
+        if not values:
+            return np.zeros((1, 0)), False
+        try:
+            table = np.stack(np.broadcast_arrays(*[np.atleast_1d(v) for v in values]), axis=-1)
+        except ValueError:
+            raise ValidationError("""Z-matrix variable sets must all have the same length""")
+        if table.ndim != 2:
+            raise ValidationError("""Z-matrix variables must be scalars or 1-D arrays of values""")
+        return table, batched
+
+    def cartesian(self, variables=None):
+        """
+        Evaluates the Cartesian geometry for one or many sets of variable values.
+
+        Parameters
+        ----------
+        variables : Union[dict, list of pairs], optional
+            Values of each variable, in the units of the Z-matrix (lengths) and degrees
+            (angles). Values that are 1-D arrays of length ``nset`` request a batch.
+
+        Returns
+        -------
+        np.ndarray
+            (nat, 3) Geometry, or (nset, nat, 3) geometries for a batch.
+        """
+        table, batched = self._variable_table(variables)
+        nset = table.shape[0]
+
+        table = np.concatenate((table, np.broadcast_to(self._constants, (nset, self._constants.shape[0]))), axis=1)
+        values = table[:, self._columns] * self._signs  # (nset, nat, 3)
+        geom = np.zeros((nset, self.nat, 3))
+
+        for kind, atoms in self._schedule:
+            if kind == 'origin':
+                continue
+            elif kind == 'cartesian':
+                geom[:, atoms] = values[:, atoms]
+                continue
+
+            bond = values[:, atoms, 0, None]
+            B = geom[:, self._anchors[atoms, 0]]
+            if kind == 'bond':
+                geom[:, atoms] = B + bond * np.array([0., 0., 1.])
+                continue
+
+            C = geom[:, self._anchors[atoms, 1]]
+            eCB = _normalize(B - C)
+            angle = np.radians(values[:, atoms, 1, None])
+            if kind == 'angle':
+                # In-plane direction from the x axis, or from the y axis if CB lies along x
+                x_axis = np.broadcast_to(np.array([1., 0., 0.]), eCB.shape)
+                y_axis = np.broadcast_to(np.array([0., 1., 0.]), eCB.shape)
+                along_x = np.abs(1.0 - np.abs(eCB[..., 0:1])) < 1.e-5
+                eX = np.where(along_x, _perp_unit(y_axis, eCB), _perp_unit(_perp_unit(x_axis, eCB), eCB))
+                geom[:, atoms] = B + bond * (eX * np.sin(angle) - eCB * np.cos(angle))
+                continue
+
+            D = geom[:, self._anchors[atoms, 2]]
+            eDC = _normalize(C - D)
+            dihedral = np.radians(values[:, atoms, 2, None])
+            eY = _perp_unit(eDC, eCB)
+            eX = _perp_unit(eY, eCB)
+            sin_angle = np.sin(angle)
+            geom[:, atoms] = B + bond * (eX * sin_angle * np.cos(dihedral) + eY * sin_angle * np.sin(dihedral) -
+                                         eCB * np.cos(angle))
+
+        return geom if batched else geom[0]
+
+
+def _normalize(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def _perp_unit(a, b):
+    """
+    Unit vectors perpendicular to both `a` and `b`, any perpendicular to `b` where they are collinear.
+    """
+    cross = np.cross(a, b)
+    norm = np.linalg.norm(cross, axis=-1, keepdims=True)
+    collinear = norm < 1.e-8
+    if collinear.any():
+        reference = np.where(np.abs(b[..., 0:1]) < 0.9, np.array([1., 0., 0.]), np.array([0., 1., 0.]))
+        fallback = np.cross(reference, b)
+        cross = np.where(collinear, fallback, cross)
+        norm = np.linalg.norm(cross, axis=-1, keepdims=True)
+    return cross / norm
+
+
+def zmat_to_cartesian(geom_unsettled, variables=None, labels=None):
+    """Converts a Z-matrix or mixed Z-matrix/Cartesian specification into Cartesian coordinates.
+
+    Parameters
+    ----------
+    geom_unsettled : list of lists of str
+        (nat, ) Each atom's Cartesian values or Z-matrix anchors and values.
+    variables : Union[dict, list of pairs], optional
+        Values of the variables, as the ``variables`` of a ``qmvz`` molrec or a dictionary
+        whose values may be 1-D arrays to evaluate many variable sets at once.
+    labels : list of str, optional
+        (nat, ) Atom labels to which anchors may refer.
+
+    Returns
+    -------
+    np.ndarray
+        (nat, 3) Geometry, or (nset, nat, 3) geometries for a batch, in the length units of the input.
+
+    """
+    return ZMatrix(geom_unsettled, labels=labels).cartesian(variables)
+
+
+def _nucleus_labels(molrec):
+    """
+    Returns the atom labels of a molrec as written in a psi4 string, element plus user label (e.g., ``O1``).
+    """
+    if 'elem' not in molrec:
+        return None
+    elbl = molrec.get('elbl', [''] * len(molrec['elem']))
+    return [str(e) + str(l) for e, l in zip(molrec['elem'], elbl)]
+
+
+def settle_geometry(molrec, variables=None, drop_dummies=True):
+    """Converts a ``qmvz`` molrec with `geom_unsettled` into a ``qm`` molrec with Cartesian `geom`.
+
+    Parameters
+    ----------
+    molrec : dict
+        Molecule dictionary with `geom_unsettled`, such as from :py:func:`qcelemental.molparse.from_string`
+        with ``dtype='psi4+'``.
+    variables : Union[dict, list of pairs], optional
+        Values of the variables, overriding those of `molrec`.
+    drop_dummies : bool, optional
+        Remove dummy atoms (atomic number zero), which only serve as Z-matrix anchors.
+
+    Returns
+    -------
+    dict
+        A copy of `molrec` with `geom` [in `molrec` units] in place of `geom_unsettled` and `variables`.
+
+    """
+    values = dict((str(k), v) for k, v in molrec.get('variables', []))
+    if variables is not None:
+        values.update(variables if isinstance(variables, dict) else dict((str(k), v) for k, v in variables))
+
+    zmat = ZMatrix(molrec['geom_unsettled'], labels=_nucleus_labels(molrec))
+    geom = zmat.cartesian(values)
+    if geom.ndim != 2:
+        raise ValidationError("""settle_geometry evaluates a single set of variables, use ZMatrix for batches""")
+
+    keep = _non_dummy_atoms(molrec) if drop_dummies else np.ones(zmat.nat, dtype=bool)
+    settled = _settled_fields(molrec, keep)
+    settled['geom'] = geom[keep].ravel()
+    return settled
+
+
+_PER_ATOM_DTYPES = {'elea': int, 'elez': int, 'elem': str, 'mass': float, 'real': bool, 'elbl': str}
+
+
+def _non_dummy_atoms(molrec):
+    """
+    Returns the (nat, ) mask of the atoms of a molrec which are not dummy atoms.
+    """
+    if 'elez' not in molrec:
+        return np.ones(len(molrec['geom_unsettled']), dtype=bool)
+    return np.asarray(molrec['elez']) != 0
+
+
+def _settled_fields(molrec, keep):
+    """
+    Returns a copy of `molrec` without its unsettled geometry, restricted to the atoms in `keep`.
+
+    Fields have the types :py:func:`qcelemental.molparse.from_arrays` produces, arrays per atom and
+    a list of separators, whether or not any atoms are dropped.
+    """
+    settled = {k: v for k, v in molrec.items() if k not in ['geom_unsettled', 'variables']}
+    for key, dtype in _PER_ATOM_DTYPES.items():
+        if key in settled:
+            settled[key] = np.asarray(settled[key], dtype=dtype)[keep]
+
+    if 'fragment_separators' in settled:
+        kept_before = np.concatenate(([0], np.cumsum(keep)))
+        settled['fragment_separators'] = [int(kept_before[sep]) for sep in settled['fragment_separators']]
+
+    return settled
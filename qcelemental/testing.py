@@ -364,28 +364,28 @@ def compare_molrecs(expected,
     if relative_geoms == 'exact':
         pass
     elif relative_geoms == 'align':
-        raise FeatureNotImplemented(
-            """compare_molrecs(..., relative_geoms='align') not available without B787 from qcdb.""")
-        ## can't just expect geometries to match, so we'll align them, check that
-        ##   they overlap and that the translation/rotation arrays jibe with
-        ##   fix_com/orientation, then attach the oriented geom to computed before the
-        ##   recursive dict comparison.
-        #from .align import B787
-        #cgeom = np.array(cptd['geom']).reshape((-1, 3))
-        #rgeom = np.array(xptd['geom']).reshape((-1, 3))
-        #rmsd, mill = B787(rgeom=rgeom,
-        #                  cgeom=cgeom,
-        #                  runiq=None,
-        #                  cuniq=None,
-        #                  atoms_map=True,
-        #                  mols_align=True,
-        #                  run_mirror=False,
-        #                  verbose=0)
-        #if cptd['fix_com']:
-        #    compare_integers(1, np.allclose(np.zeros((3)), mill.shift, atol=atol), 'null shift', verbose=verbose)
-        #if cptd['fix_orientation']:
-        #    compare_integers(1, np.allclose(np.identity(3), mill.rotation, atol=atol), 'null rotation', verbose=verbose)
-        #ageom = mill.align_coordinates(cgeom)
-        #cptd['geom'] = ageom.reshape((-1))
+        # can't just expect geometries to match, so we'll align them, check that
+        #   they overlap and that the translation/rotation arrays jibe with
+        #   fix_com/orientation, then attach the oriented geom to computed before the
+        #   recursive dict comparison.
+        from .util import align
+
+        cgeom = np.array(cptd['geom']).reshape((-1, 3))
+        rgeom = np.array(xptd['geom']).reshape((-1, 3))
+        mill = align(rgeom, cgeom, rlabels=xptd['elem'], clabels=cptd['elem'], atoms_map=True, mirror=False)
+
+        message = []
+        if cptd.get('fix_com') and not np.allclose(np.zeros((3)), mill.shift, atol=atol):
+            message.append("Shift {} is not null but fix_com is set.".format(mill.shift))
+        if cptd.get('fix_orientation') and not np.allclose(np.identity(3), mill.rotation, atol=atol):
+            message.append("Rotation {} is not identity but fix_orientation is set.".format(mill.rotation))
+        if message:
+            return _handle_return(False, label or sys._getframe().f_back.f_code.co_name, "\n".join(message), False)
+
+        cptd['geom'] = mill.align_coordinates(cgeom).reshape((-1))
+        for field in ['elem', 'elez', 'elea', 'mass', 'real', 'elbl']:
+            if field in cptd:
+                mapped = np.asarray(cptd[field])[mill.atommap]
+                cptd[field] = mapped if isinstance(cptd[field], np.ndarray) else mapped.tolist()
 
     return compare_recursive(xptd, cptd, atol=atol, rtol=rtol, label=label, forgive=forgive)
@@ -0,0 +1,76 @@
+"""
+Tests the GeometryTemplate scans.
+"""
+
+import numpy as np
+import pytest
+
+import qcelemental as qcel
+from qcelemental.models import GeometryTemplate, Molecule
+
+water_zmat = """
+0 1
+X
+O 1 1.0
+H 2 R 1 90.0
+H 2 R 1 A 3 180.0
+R = 0.96
+A = 100.0
+"""
+
+
+def _reference(molstr, variables, orient=False):
+    molrec = qcel.molparse.settle_geometry(qcel.molparse.from_string(molstr, dtype="psi4+")["qm"], variables)
+    return Molecule(orient=orient, **qcel.molparse.to_schema(molrec, dtype=1)["molecule"])
+
+
+def test_template_molecules():
+    template = GeometryTemplate(water_zmat)
+    assert template.variables == ["R", "A"]
+    assert template.defaults == {"R": 0.96, "A": 100.0}
+
+    angles = [90.0, 104.5, 120.0]
+    for angle, mol in zip(angles, template.molecules({"A": angle} for angle in angles)):
+        assert mol.symbols == ["O", "H", "H"]
+        assert mol.get_hash() == _reference(water_zmat, {"A": angle}).get_hash()
+
+    # Dictionary of arrays, and orientation of the whole chunk at once
+    mols = list(template.molecules({"R": [0.9, 1.0], "A": 110.0}, orient=True))
+    assert len(mols) == 2
+    assert mols[1].get_hash() == _reference(water_zmat, {"R": 1.0, "A": 110.0}, orient=True).get_hash()
+
+
+def test_template_lazy():
+    template = GeometryTemplate(water_zmat)
+    consumed = []
+
+    def assignments():
+        for angle in np.linspace(90, 180, 50):
+            consumed.append(angle)
+            yield {"A": angle}
+
+    # Only the first chunk is evaluated to produce the first molrec
+    molrecs = template.molrecs(assignments(), chunksize=10)
+    first = next(molrecs)
+    assert len(consumed) == 10
+    assert first["geom"].shape == (9, )
+    assert "geom_unsettled" not in first
+
+    # Both hydrogens at 90 degrees from the dummy, on opposite sides
+    angle = qcel.util.measure_coordinates(first["geom"].reshape(-1, 3), [[1, 0, 2]], degrees=True)[0]
+    assert angle == pytest.approx(180.0)
+    assert len(list(molrecs)) == 49
+
+
+def test_template_geometries():
+    template = GeometryTemplate("""
+    He
+    He 1 R
+    """)
+
+    geometries = template.geometries({"R": np.linspace(2.0, 4.0, 5)})
+    assert geometries.shape == (5, 2, 3)
+    assert np.allclose(geometries[:, 1, 2], np.linspace(2.0, 4.0, 5))
+
+    with pytest.raises(qcel.ValidationError):
+        template.geometries([{}])
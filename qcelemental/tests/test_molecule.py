@@ -4,6 +4,7 @@ Tests the imports and exports of the Molecule object.
 
 import numpy as np
 import pytest
+import qcelemental as qcel
 from pydantic import ValidationError
 from qcelemental.models import Molecule
 
@@ -304,3 +305,654 @@ def test_measurements(measure, result):
     }) # yapf: disable
 
     assert pytest.approx(water_dimer_minima.measure(measure)) == result
+
+
+def _nre_loop(geom, Z):
+    nre = 0.0
+    for i in range(len(Z)):
+        for j in range(i):
+            nre += Z[i] * Z[j] / np.linalg.norm(geom[i] - geom[j])
+    return nre
+
+
+def test_nuclear_repulsion_energy():
+    mol = Molecule(symbols=["He", "He"], geometry=[0, 0, 0, 0, 0, 2])
+    assert pytest.approx(mol.nuclear_repulsion_energy()) == 2.0
+
+    Z = np.array([8, 1, 1, 8, 1, 1])
+    ref = _nre_loop(water_dimer_minima.geometry, Z)
+    assert pytest.approx(water_dimer_minima.nuclear_repulsion_energy(), 1.e-12) == ref
+
+    frag_1 = water_dimer_minima.get_fragment(1)
+    nre_ifr = water_dimer_minima.nuclear_repulsion_energy(ifr=1)
+    nre_frag = frag_1.nuclear_repulsion_energy()
+    assert pytest.approx(nre_ifr, 1.e-12) == nre_frag
+
+    # Ghost atoms do not contribute
+    ghosted = water_dimer_minima.get_fragment(0, 1)
+    assert pytest.approx(ghosted.nuclear_repulsion_energy(), 1.e-12) == _nre_loop(ghosted.geometry[:3], Z[:3])
+
+
+def test_nuclear_repulsion_blocked(monkeypatch):
+    geom = np.random.RandomState(3).rand(40, 3) * 20
+    mol = Molecule(symbols=["Ne"] * 40, geometry=geom)
+    ref_energy = mol.nuclear_repulsion_energy()
+    ref_gradient = mol.nuclear_repulsion_gradient()
+
+    monkeypatch.setattr("qcelemental.models.molecule.PAIR_BLOCK_ELEMENTS", 70)
+    assert pytest.approx(mol.nuclear_repulsion_energy(), 1.e-12) == ref_energy
+    assert np.allclose(mol.nuclear_repulsion_gradient(), ref_gradient)
+    assert pytest.approx(ref_energy, 1.e-12) == _nre_loop(mol.geometry, [10] * 40)
+
+
+def test_nuclear_repulsion_gradient():
+    mol = water_dimer_minima
+    grad = mol.nuclear_repulsion_gradient()
+    assert grad.shape == (6, 3)
+    assert np.allclose(grad.sum(axis=0), 0.0)
+
+    # Finite difference check
+    step = 1.e-5
+    fd = np.zeros_like(grad)
+    for at in range(6):
+        for x in range(3):
+            geom = mol.geometry.copy()
+            geom[at, x] += step
+            plus = Molecule(**{**mol.dict(), "geometry": geom}).nuclear_repulsion_energy()
+            geom[at, x] -= 2 * step
+            minus = Molecule(**{**mol.dict(), "geometry": geom}).nuclear_repulsion_energy()
+            fd[at, x] = (plus - minus) / (2 * step)
+    assert np.allclose(grad, fd, atol=1.e-6)
+
+    frag_grad = mol.nuclear_repulsion_gradient(ifr=0)
+    assert np.allclose(frag_grad[3:], 0.0)
+    assert np.allclose(frag_grad[:3], mol.get_fragment(0).nuclear_repulsion_gradient())
+
+    ghosted = mol.get_fragment(1, 0)
+    assert np.allclose(ghosted.nuclear_repulsion_gradient()[3:], 0.0)
+
+
+def test_orient_molecule():
+    mol = Molecule(orient=False, **water_dimer_minima.dict())
+    oriented = mol.orient_molecule()
+
+    assert oriented.compare(Molecule(orient=True, **mol.dict()))
+    assert oriented.get_hash() == water_dimer_minima.get_hash()
+
+
+def test_orient_many():
+    rng = np.random.RandomState(7)
+    molecules = []
+    for nat in [3, 5, 3, 8, 1]:
+        molecules.append(
+            Molecule(symbols=rng.choice(["H", "C", "O"], size=nat).tolist(), geometry=rng.rand(nat, 3) * 5))
+    molecules.append(water_dimer_minima)
+
+    oriented = Molecule.orient_many(molecules)
+    assert len(oriented) == len(molecules)
+    for mol, omol in zip(molecules, oriented):
+        assert omol.compare(mol.orient_molecule())
+        assert omol.get_hash() == mol.orient_molecule().get_hash()
+
+    assert Molecule.orient_many([]) == []
+
+
+def test_frame_transform():
+    rng = np.random.RandomState(11)
+    geometry = rng.rand(6, 3) * 4
+    mol = Molecule(symbols=["O", "H", "H", "C", "N", "H"], geometry=geometry)
+    transform = mol.get_frame_transform()
+
+    assert np.allclose(transform.apply_geometry(geometry), mol.geometry, atol=1.e-8)
+    assert np.allclose(transform.apply_geometry(mol.geometry, inverse=True), geometry, atol=1.e-8)
+
+    # Gradients rotate with the frame
+    unoriented = Molecule(orient=False, symbols=mol.symbols, geometry=geometry)
+    assert unoriented.get_frame_transform().rotation.tolist() == np.identity(3).tolist()
+    gradient = transform.apply_gradient(unoriented.nuclear_repulsion_gradient())
+    assert np.allclose(gradient, mol.nuclear_repulsion_gradient())
+
+    # Orienting again composes with the stored transform
+    rotated = Molecule(orient=False, symbols=mol.symbols, geometry=geometry[:, [2, 0, 1]] + 1.0).orient_molecule()
+    reoriented = Molecule.orient_many([rotated])[0]
+    assert np.allclose(reoriented.get_frame_transform().apply_geometry(geometry[:, [2, 0, 1]] + 1.0),
+                       reoriented.geometry,
+                       atol=1.e-8)
+
+    # Copies keep the transform
+    for copy in [rotated.copy(), rotated.copy(update={"name": "copy"}), rotated.copy(deep=True)]:
+        assert copy.get_frame_transform() is rotated.get_frame_transform()
+
+
+def test_frame_transform_fragments():
+    parent = Molecule(orient=False, **water_dimer_minima.dict())
+    atoms = parent.fragments[1]
+
+    frag = parent.get_fragment(1, orient=True)
+    assert np.allclose(frag.get_frame_transform().apply_geometry(parent.geometry[atoms]), frag.geometry, atol=1.e-8)
+
+    dimer = parent.get_fragment([0, 1], orient=True)
+    assert np.allclose(dimer.get_frame_transform().apply_geometry(parent.geometry), dimer.geometry, atol=1.e-8)
+    for real, ghost, mol in parent.iter_nbody(1, orient=True):
+        nbody_atoms = sum((parent.fragments[x] for x in list(real) + list(ghost)), [])
+        transform = mol.get_frame_transform()
+        assert np.allclose(transform.apply_geometry(parent.geometry[nbody_atoms]), mol.geometry, atol=1.e-8)
+
+    # Fragments of an oriented molecule map back to its input geometry
+    rotated = Molecule(orient=True, **parent.dict())
+    frag = rotated.get_fragment(1, orient=True)
+    assert np.allclose(frag.get_frame_transform().apply_geometry(parent.geometry[atoms]), frag.geometry, atol=1.e-8)
+    assert rotated.get_fragment(1).get_frame_transform() is rotated.get_frame_transform()
+
+    both = Molecule.concatenate([parent.get_fragment(0), parent.get_fragment(1)], orient=True)
+    assert np.allclose(both.get_frame_transform().apply_geometry(parent.geometry), both.geometry, atol=1.e-8)
+
+
+def test_get_fragment_charged():
+    mol = Molecule(
+        symbols=["Na", "Cl", "He"],
+        geometry=[0, 0, 0, 0, 0, 4, 0, 0, 10],
+        fragments=[[0], [1], [2]],
+        fragment_charges=[1, -1, 0],
+        fragment_multiplicities=[1, 1, 1])
+
+    frag = mol.get_fragment(0, [1, 2])
+    assert frag.molecular_charge == 1
+    assert frag.fragment_charges == [1, 0, 0]
+    assert frag.real == [True, False, False]
+    assert Molecule(**frag.dict()).get_hash() == frag.get_hash()
+
+    # Real fragments keep their charges even when the subset is neutral overall
+    frag = mol.get_fragment([0, 1], [2])
+    assert frag.molecular_charge == 0
+    assert frag.fragment_charges == [1, -1, 0]
+    assert frag.get_hash() == "86c82e4ab1bedca8137acc07ff9556f28a60e29f"
+
+    # Atomic data is carried over from the parent
+    frag = water_dimer_minima.get_fragment(1)
+    assert frag.atomic_numbers == [8, 1, 1]
+
+
+def test_get_fragment_open_shell():
+    mol = Molecule.from_data("""
+    1 2
+    O 0 0 0
+    H 0 0 1
+    H 0 1 0
+    --
+    0 1
+    Ne 3 0 0
+    --
+    0 2
+    O 6 0 0
+    H 6 0 1
+    """)
+
+    # Ghost fragments are neutral singlets, whatever their charge and multiplicity as real fragments
+    frag = mol.get_fragment(1, [0, 2])
+    assert frag.fragment_charges == [0, 0, 0]
+    assert frag.fragment_multiplicities == [1, 1, 1]
+    assert frag.get_hash() == "c21090973e85cb29a0913e6f58bbccf77046b8cc"
+
+    # Open-shell and charged real fragments are built from the fragment data of the parent
+    frag = mol.get_fragment([2], [0])
+    assert frag.molecular_multiplicity == 2
+    assert frag.fragment_multiplicities == [2, 1]
+    assert frag.get_hash() == "fc4f84370929d4d8bc57bcab7965e9c225edf6bd"
+
+    frag = mol.get_fragment(0)
+    assert (frag.molecular_charge, frag.molecular_multiplicity) == (1, 2)
+    assert frag.get_hash() == Molecule(**frag.dict()).get_hash()
+
+
+def test_canonical_hash_permutation():
+    mol = water_dimer_minima
+    perm = [4, 3, 5, 1, 2, 0]
+    inverse = np.argsort(perm)
+    pmol = Molecule(
+        symbols=[mol.symbols[i] for i in perm],
+        geometry=mol.geometry[perm],
+        masses=[mol.masses[i] for i in perm],
+        fragments=[sorted(inverse[frag].tolist()) for frag in mol.fragments],
+        fragment_charges=mol.fragment_charges,
+        fragment_multiplicities=mol.fragment_multiplicities,
+        orient=False)
+
+    assert pmol.get_hash() != mol.get_hash()
+    assert pmol.get_hash(canonical=True) == mol.get_hash(canonical=True)
+    assert mol.get_hash(canonical=True) != mol.get_hash()
+
+    # Reordering fragments is only absorbed by canonical_fragments
+    smol = Molecule(
+        symbols=pmol.symbols,
+        geometry=pmol.geometry,
+        masses=pmol.masses,
+        fragments=pmol.fragments[::-1],
+        fragment_charges=pmol.fragment_charges[::-1],
+        fragment_multiplicities=pmol.fragment_multiplicities[::-1],
+        orient=False)
+    assert smol.get_hash(canonical=True) != mol.get_hash(canonical=True)
+    assert smol.get_hash(canonical=True, canonical_fragments=True) == mol.get_hash(
+        canonical=True, canonical_fragments=True)
+
+    with pytest.raises(ValueError):
+        mol.get_hash(canonical_fragments=True)
+
+
+def test_canonical_hash_distinguishes():
+    mol = water_molecule
+    moved = Molecule(symbols=mol.symbols, geometry=mol.geometry + np.array([[1.e-2, 0, 0], [0, 0, 0], [0, 0, 0]]))
+    ghost = Molecule(symbols=mol.symbols, geometry=mol.geometry, real=[True, False, True], orient=False)
+
+    assert moved.get_hash(canonical=True) != mol.get_hash(canonical=True)
+    assert ghost.get_hash(canonical=True) != mol.get_hash(canonical=True)
+
+    # Mirror images are distinct
+    chiral = Molecule(symbols=["C", "H", "F", "Cl", "Br"],
+                      geometry=[[0, 0, 0], [0, 0, 2], [1.9, 0, -0.7], [-1, 1.6, -0.7], [-1, -1.6, -0.7]])
+    mirror = Molecule(symbols=chiral.symbols, geometry=chiral.geometry * [1, 1, -1])
+    assert mirror.get_hash(canonical=True) != chiral.get_hash(canonical=True)
+
+
+_ring = np.column_stack((np.cos(np.arange(6) * np.pi / 3), np.sin(np.arange(6) * np.pi / 3), np.zeros(6)))
+benzene = Molecule(symbols=["C"] * 6 + ["H"] * 6, geometry=np.vstack((2.64 * _ring, 4.69 * _ring)))
+methane = Molecule(
+    symbols=["C", "H", "H", "H", "H"],
+    geometry=[[0, 0, 0], [1.2, 1.2, 1.2], [-1.2, -1.2, 1.2], [-1.2, 1.2, -1.2], [1.2, -1.2, -1.2]])
+
+
+@pytest.mark.parametrize("mol", [water_molecule, water_dimer_minima, benzene, methane])
+def test_canonical_hash_rigid_motion(mol):
+    perm = np.random.RandomState(4).permutation(len(mol.symbols))
+    inverse = np.argsort(perm)
+
+    # Rotation about (1, 2, 3) by 1 radian, then a shift
+    axis = np.array([1.0, 2.0, 3.0]) / np.sqrt(14.0)
+    cross = np.cross(np.eye(3), axis)
+    rotation = np.cos(1.0) * np.eye(3) + np.sin(1.0) * cross + (1 - np.cos(1.0)) * np.outer(axis, axis)
+    geometry = (mol.geometry @ rotation + [0.5, -2.0, 3.0])[perm]
+
+    moved = Molecule(
+        symbols=[mol.symbols[i] for i in perm],
+        geometry=geometry,
+        masses=[mol.masses[i] for i in perm],
+        fragments=[sorted(inverse[frag].tolist()) for frag in mol.fragments],
+        fragment_charges=mol.fragment_charges,
+        fragment_multiplicities=mol.fragment_multiplicities,
+        orient=False)
+
+    assert moved.get_hash() != mol.get_hash()
+    assert moved.get_hash(canonical=True) == mol.get_hash(canonical=True)
+
+
+def _heavy_chain(symbols, connectivity, shift=0.0):
+    geometry = [[1.5 * i + shift, 0.3 * (i % 2), 0.0] for i in range(len(symbols))]
+    return Molecule(symbols=symbols, geometry=geometry, connectivity=connectivity, orient=False)
+
+
+def test_topology_hash():
+    # Ethanol and dimethyl ether heavy-atom skeletons share a formula
+    ethanol = _heavy_chain(["C", "C", "O"], [(0, 1, 1), (1, 2, 1)])
+    ether = _heavy_chain(["C", "O", "C"], [(0, 1, 1), (1, 2, 1)])
+    assert ethanol.get_molecular_formula() == ether.get_molecular_formula()
+    assert ethanol.get_topology_hash() != ether.get_topology_hash()
+    assert ethanol.get_topology_hash(iterations=0) == ether.get_topology_hash(iterations=0)
+
+    # Geometry and atom ordering do not matter, bond orders do
+    moved = _heavy_chain(["O", "C", "C"], [(2, 1, 1), (0, 1, 1)], shift=2.0)
+    assert moved.get_topology_hash() == ethanol.get_topology_hash()
+
+    double = _heavy_chain(["C", "C", "O"], [(0, 1, 1), (1, 2, 2)])
+    assert double.get_topology_hash() != ethanol.get_topology_hash()
+
+    assert water_molecule.get_topology_hash() == water_molecule.get_topology_hash()
+    with pytest.raises(ValueError):
+        ethanol.get_topology_hash(iterations=-1)
+
+
+def test_fingerprint_invariance():
+    mol = water_dimer_minima
+    rotation = np.linalg.qr(np.random.RandomState(4).standard_normal((3, 3)))[0]
+    perm = [3, 5, 4, 0, 2, 1]
+    moved = Molecule(symbols=[mol.symbols[i] for i in perm], geometry=mol.geometry[perm] @ rotation + 1.0)
+
+    fp = mol.get_fingerprint()
+    assert fp.shape == (16 * 32, )
+    assert np.isclose(fp.sum(), 15)
+    assert np.allclose(fp, moved.get_fingerprint())
+
+    # Small displacements only move the fingerprint slightly
+    noisy = Molecule(symbols=mol.symbols, geometry=mol.geometry + 1.e-5)
+    assert np.abs(noisy.get_fingerprint() - fp).max() < 1.e-3
+    assert not np.allclose(water_molecule.get_fingerprint(), mol.get_fingerprint())
+
+    with pytest.raises(ValueError):
+        mol.get_fingerprint(nbins=1)
+
+
+_benzene = "\n".join(
+    "{} {:.6f} {:.6f} 0.0".format(el, r * np.cos(k * np.pi / 3 + 0.3), r * np.sin(k * np.pi / 3 + 0.3))
+    for el, r in [("C", 1.39), ("H", 2.47)] for k in range(6))
+
+
+@pytest.mark.parametrize("geom,point_group,unique_atoms", [
+    ("O 0 0 0.1173\nH 0 0.7572 -0.4692\nH 0 -0.7572 -0.4692", "c2v", [0, 1]),
+    ("N 0 0 0.1\nH 0 0.9377 -0.3816\nH 0.8121 -0.4689 -0.3816\nH -0.8121 -0.4689 -0.3816", "cs", [0, 1, 2]),
+    ("C 0 0 0\nH 0.63 0.63 0.63\nH 0.63 -0.63 -0.63\nH -0.63 0.63 -0.63\nH -0.63 -0.63 0.63", "d2", [0, 1]),
+    (_benzene, "d2h", [0, 1, 6, 7]),
+    ("O 0 0.7 0.1\nO 0 -0.7 0.1\nH 0.9 0.9 -0.3\nH -0.9 -0.9 -0.3", "c2", [0, 2]),
+    ("C 0 0 0\nO 0.2 0.3 1.2\nO -0.2 -0.3 -1.2\nN 1.1 -0.4 0.3\nN -1.1 0.4 -0.3\nF 0.5 1.3 -0.7\nF -0.5 -1.3 0.7",
+     "ci", [0, 1, 3, 5]),
+    ("C 0 0 0\nH 1 0 0\nF 0 1.2 0\nCl 0 0 1.7\nBr -1 -1 -1", "c1", [0, 1, 2, 3, 4]),
+])
+def test_get_symmetry(geom, point_group, unique_atoms):
+    mol = Molecule.from_data(geom)
+    rotation = np.linalg.qr(np.random.RandomState(1).standard_normal((3, 3)))[0]
+    moved = Molecule(symbols=mol.symbols, geometry=mol.geometry @ rotation + 1.0)
+
+    symmetry = moved.get_symmetry()
+    assert symmetry["point_group"] == point_group
+    assert symmetry["unique_atoms"] == unique_atoms
+    assert symmetry["geometry"].shape == (len(mol.symbols), 3)
+    assert "E" in symmetry["operations"]
+
+
+def test_get_symmetry_labels():
+    water = Molecule.from_data("O 0 0 0.1173\nH 0 0.7572 -0.4692\nH 0 -0.7572 -0.4692")
+    assert water.get_symmetry()["point_group"] == "c2v"
+
+    # Ghost atoms and isotopes are not interchangeable with regular atoms
+    ghost = Molecule(symbols=water.symbols, geometry=water.geometry, real=[True, True, False])
+    assert ghost.get_symmetry()["point_group"] == "cs"
+
+    hdo = Molecule(symbols=water.symbols, geometry=water.geometry, masses=[15.995, 1.008, 2.014])
+    assert hdo.get_symmetry()["point_group"] == "cs"
+
+    # A loose tolerance absorbs distortions
+    distorted = Molecule(symbols=water.symbols, geometry=water.geometry + [[0, 0, 0], [0, 0, 0], [0, 0.02, 0]])
+    assert distorted.get_symmetry(tolerance=1.e-3)["point_group"] == "cs"
+    assert distorted.get_symmetry(tolerance=0.1)["point_group"] == "c2v"
+
+
+def test_guess_connectivity():
+    connectivity, fragments = water_dimer_minima.guess_connectivity(return_fragments=True)
+    assert connectivity == [(0, 1, 1.0), (0, 2, 1.0), (3, 4, 1.0), (3, 5, 1.0)]
+    assert fragments == water_dimer_minima.fragments
+
+    # A generous scale bonds the hydrogen bond as well
+    connectivity, fragments = water_dimer_minima.guess_connectivity(scale=2.2, return_fragments=True)
+    assert (2, 3, 1.0) in connectivity
+    assert fragments == [[0, 1, 2, 3, 4, 5]]
+
+    mol = Molecule(symbols=water_molecule.symbols, geometry=water_molecule.geometry,
+                   connectivity=water_molecule.guess_connectivity())
+    assert mol.connectivity == [(0, 1, 1.0), (0, 2, 1.0)]
+
+
+def test_guess_connectivity_cells():
+    # Chains crossing many cells, listed out of order, against the all-pairs definition
+    rng = np.random.RandomState(3)
+    geometry = np.concatenate([np.cumsum(rng.normal(0, 1.6, (40, 3)), axis=0) + 30 * k for k in range(3)])
+    perm = rng.permutation(120)
+    mol = Molecule(symbols=["C"] * 120, geometry=geometry[perm])
+
+    radius = qcel.covalentradii.get("C", units="bohr")
+    distances = np.linalg.norm(mol.geometry[:, None] - mol.geometry[None, :], axis=2)
+    expected = [(i, j, 1.0) for i, j in zip(*np.nonzero(np.triu(distances <= 1.2 * 2 * radius, 1)))]
+
+    connectivity, fragments = mol.guess_connectivity(return_fragments=True)
+    assert connectivity == expected
+    assert sorted(sum(fragments, [])) == list(range(120))
+    assert all(frag == sorted(frag) for frag in fragments)
+
+    assert Molecule(symbols=["He"], geometry=[0, 0, 0]).guess_connectivity(return_fragments=True) == ([], [[0]])
+
+
+@pytest.mark.parametrize("n,ghost,nsubsets", [
+    (1, True, 4),
+    (2, True, 6),
+    (2, False, 6),
+    (3, False, 4),
+    (4, True, 1),
+])
+def test_iter_nbody(n, ghost, nsubsets):
+    mol = Molecule.from_data(
+        """
+        Ne 0.000000 0.000000 0.000000
+        --
+        Ne 3.100000 0.000000 0.000000
+        --
+        Ne 0.000000 3.200000 0.000000
+        --
+        Ne 0.000000 0.000000 3.300000
+        units bohr""",
+        dtype="psi4")
+
+    subsets = list(mol.iter_nbody(n, ghost=ghost))
+    assert len(subsets) == nsubsets
+
+    for real, ghosts, frag in subsets:
+        assert len(real) == n
+        assert len(ghosts) == ((4 - n) if ghost else 0)
+        assert frag.get_hash() == mol.get_fragment(list(real), list(ghosts)).get_hash()
+        assert sum(frag.real) == n
+
+
+def test_iter_nbody_error():
+    with pytest.raises(ValueError):
+        next(water_dimer_minima.iter_nbody(3))
+
+
+def test_compact_storage():
+    mol = Molecule(
+        symbols=["he", "He", "NE"], geometry=np.arange(9), fragments=[[0, 2], [1]], atomic_numbers=[2, 2, 10])
+    values = mol.__values__
+
+    assert values["symbols"].table == ("He", "Ne")
+    assert values["symbols"].codes.tolist() == [0, 0, 1]
+    assert values["masses"].dtype == np.double
+    assert values["real"].dtype == bool
+    assert values["fragments"].ptr.tolist() == [0, 2, 3]
+    assert values["mass_numbers"] is None
+
+    # Public API is unchanged
+    assert mol.symbols == ["He", "He", "Ne"]
+    assert mol.real == [True, True, True]
+    assert mol.fragments == [[0, 2], [1]]
+    assert mol.atomic_numbers == [2, 2, 10]
+    assert mol.mass_numbers is None
+    assert isinstance(mol.masses, list)
+
+    data = mol.dict()
+    assert data["symbols"] == ["He", "He", "Ne"]
+    assert data["fragments"] == [[0, 2], [1]]
+    assert mol.json_dict()["symbols"] == ["He", "He", "Ne"]
+    assert Molecule(**data).get_hash() == mol.get_hash()
+
+
+def test_connectivity_storage():
+    mol = Molecule(symbols=["O", "H", "H"], geometry=np.arange(9), connectivity=[(0, 1, 1), (2, 0, 1.5)])
+    bonds = mol.__values__["connectivity"]
+
+    assert bonds.atoms.tolist() == [[0, 1], [2, 0]]
+    assert bonds.orders.dtype == np.double
+    assert mol.connectivity == [(0, 1, 1.0), (2, 0, 1.5)]
+    assert mol.json_dict()["connectivity"] == [[0, 1, 1.0], [2, 0, 1.5]]
+    assert Molecule(**mol.dict()).get_hash() == mol.get_hash()
+    assert water_dimer_minima.__values__["connectivity"].atoms.shape == (0, 2)
+
+
+@pytest.mark.parametrize("field,value", [
+    ("symbols", ["O", "H", "He"]),
+    ("masses", [15.99491462, 1.00782503, 4.00260325]),
+    ("real", [True, False, True]),
+    ("atomic_numbers", [8, 1, 2]),
+    ("mass_numbers", [16, 1, 4]),
+    ("fragments", [[0, 1], [2]]),
+    ("connectivity", [(0, 1, 1.0), (1, 2, 2.0)]),
+])
+def test_compact_storage_copy_update(field, value):
+    mol = Molecule(
+        symbols=["O", "H", "H"],
+        geometry=np.arange(9),
+        masses=[15.99491462, 1.00782503, 1.00782503],
+        real=[True, True, True],
+        atomic_numbers=[8, 1, 1],
+        mass_numbers=[16, 1, 1],
+        fragments=[[0, 1, 2]],
+        connectivity=[(0, 1, 1)])
+
+    new_mol = mol.copy(update={field: value})
+    assert getattr(new_mol, field) == value
+    assert new_mol.dict()[field] == value
+    assert new_mol.json_dict()
+    assert new_mol.get_hash()
+    assert getattr(mol, field) != value
+
+
+def test_compact_storage_fresh_lists():
+    mol = water_molecule.copy()
+    formula = mol.get_molecular_formula()
+    mol_hash = mol.get_hash()
+
+    symbols = mol.symbols
+    symbols[0] = "N"
+    mol.fragments[0].append(5)
+    mol.masses[0] = 1.0
+
+    assert mol.symbols is not symbols
+    assert mol.symbols[0] == "O"
+    assert mol.get_molecular_formula() == formula
+    assert mol.get_hash() == mol_hash
+    assert "symbols" not in mol.__dict__
+
+
+@pytest.mark.parametrize("connectivity,error", [
+    ([(0, 0, 1)], "to itself"),
+    ([(0, 1, 1), (1, 0, 2)], "more than once"),
+    ([(0, 3, 1)], "less than the number of atoms"),
+    ([(0, 1.5, 1)], "non-negative integers"),
+    ([(0, 1, 6)], "within [0, 5]"),
+    ([(0, 1)], "shape (nbond, 3)"),
+])
+def test_connectivity_errors(connectivity, error):
+    with pytest.raises(ValueError) as e:
+        Molecule(symbols=["O", "H", "H"], geometry=np.arange(9), connectivity=connectivity)
+
+    assert error in str(e.value)
+
+
+def test_concatenate():
+    hydroxide = Molecule(
+        symbols=["o", "H"], geometry=[0, 0, 5, 0, 0, 6.8], molecular_charge=-1, connectivity=[(0, 1, 1)])
+    oxygen = Molecule(symbols=["O", "O"], geometry=[5, 0, 0, 7.2, 0, 0], molecular_multiplicity=3)
+
+    mol = Molecule.concatenate([water_molecule, hydroxide, oxygen])
+    assert mol.symbols == ["O", "H", "H", "O", "H", "O", "O"]
+    assert mol.fragments == [[0, 1, 2], [3, 4], [5, 6]]
+    assert mol.fragment_charges == [0, -1, 0]
+    assert mol.fragment_multiplicities == [1, 1, 3]
+    assert mol.molecular_charge == -1
+    assert mol.molecular_multiplicity == 3
+    assert mol.connectivity == [(3, 4, 1.0)]
+
+    ref = Molecule(
+        symbols=mol.symbols,
+        geometry=mol.geometry,
+        fragments=mol.fragments,
+        fragment_charges=[0, -1, 0],
+        fragment_multiplicities=[1, 1, 3],
+        molecular_charge=-1,
+        molecular_multiplicity=3,
+        connectivity=[(3, 4, 1.0)])
+    assert mol.get_hash() == ref.get_hash()
+
+    # Keeping the fragments of the inputs
+    mol = Molecule.concatenate([water_dimer_minima, water_molecule], fragment_per_input=False)
+    assert mol.fragments == [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+    assert mol.get_fragment(2).compare(water_molecule)
+
+    with pytest.raises(ValueError):
+        Molecule.concatenate([])
+
+
+def test_extract_environment():
+    rng = np.random.RandomState(7)
+    shifts = rng.uniform(0, 40, (200, 3))
+    waters = [water_molecule.copy(update={"geometry": water_molecule.geometry + shift}) for shift in shifts]
+    box = Molecule.concatenate(waters)
+
+    # Against the all-pairs distances of each fragment to the solute
+    distances = np.linalg.norm(box.geometry[:, None] - box.geometry[None, :3], axis=2).min(axis=1)
+    closest = distances.reshape(-1, 3).min(axis=1)
+
+    env = box.extract_environment([0, 1, 2], 8.0, ghost_shell=3.0)
+    real = np.flatnonzero(closest <= 8.0).tolist()
+    ghost = np.flatnonzero((closest > 8.0) & (closest <= 11.0)).tolist()
+    assert env.compare(box.get_fragment(real, ghost))
+    assert len(env.fragments) == len(real) + len(ghost)
+
+    # Only the atoms near the oxygen, truncated waters become neutral with the lowest multiplicity
+    env = box.extract_environment(0, 6.0, whole_fragments=False)
+    near = np.linalg.norm(box.geometry - box.geometry[0], axis=1) <= 6.0
+    assert np.allclose(np.sort(env.geometry, axis=0), np.sort(box.geometry[near], axis=0))
+    for frag, mult in zip(env.fragments, env.fragment_multiplicities):
+        nelectron = sum(8 if env.symbols[at] == "O" else 1 for at in frag)
+        assert mult == 1 + nelectron % 2
+
+    with pytest.raises(ValueError):
+        box.extract_environment([600], 5.0)
+
+
+def test_geometry_copies():
+    mol = water_dimer_minima
+    assert not mol.geometry.flags.writeable
+
+    # Validated geometries are adopted without a copy
+    assert np.shares_memory(Molecule(**mol.dict()).geometry, mol.geometry)
+    assert np.shares_memory(mol.copy().geometry, mol.geometry)
+
+    # Writable input is never aliased
+    geom = mol.geometry.copy()
+    new_mol = Molecule(**{**mol.dict(), "geometry": geom})
+    assert not np.shares_memory(new_mol.geometry, geom)
+    assert geom.flags.writeable
+    geom[0, 0] += 1.0
+    assert new_mol.compare(mol)
+
+    # Nor is a read-only view of a writable array
+    geom = mol.geometry.copy()
+    view = geom[:]
+    view.flags.writeable = False
+    new_mol = Molecule(**{**mol.dict(), "geometry": view})
+    assert not np.shares_memory(new_mol.geometry, geom)
+    mol_hash = new_mol.get_hash()
+    geom[0, 0] += 1.0
+    assert new_mol.get_hash() == mol_hash
+    assert new_mol.compare(mol)
+
+    # Read-only views of read-only arrays are still adopted
+    view = mol.geometry[:]
+    assert np.shares_memory(Molecule(**{**mol.dict(), "geometry": view}).geometry, mol.geometry)
+
+    # Read-only input that is not canonical is rounded into a copy
+    geom = np.array([[0.0, -0.0, 1.123456789]])
+    geom.flags.writeable = False
+    new_mol = Molecule(symbols=["He"], geometry=geom)
+    assert not np.shares_memory(new_mol.geometry, geom)
+    assert new_mol.geometry.tolist() == [[0.0, 0.0, 1.12345679]]
+    assert not np.signbit(new_mol.geometry).any()
+
+
+def test_float_prep_inplace():
+    from qcelemental.models.molecule import float_prep
+
+    data = np.array([1.123456789, -1.e-12, 2.0])
+    ret = float_prep(data, 8, inplace=True)
+    assert ret is data
+    assert data.tolist() == [1.12345679, 0.0, 2.0]
+
+    data = np.array([1.123456789, -1.e-12, 2.0])
+    ret = float_prep(data, 8)
+    assert ret is not data
+    assert data[0] == 1.123456789
@@ -0,0 +1,175 @@
+"""
+Tests the columnar MoleculeBatch container.
+"""
+
+import numpy as np
+import pytest
+from qcelemental.models import Molecule, MoleculeBatch
+
+water_molecule = Molecule.from_data("""
+    0 1
+    O  -1.551007  -0.114520   0.000000
+    H  -1.934259   0.762503   0.000000
+    H  -0.599677   0.040712   0.000000
+    """)
+
+water_dimer_minima = Molecule.from_data(
+    """
+    0 1
+    O  -1.551007  -0.114520   0.000000
+    H  -1.934259   0.762503   0.000000
+    H  -0.599677   0.040712   0.000000
+    --
+    O   1.350625   0.111469   0.000000
+    H   1.680398  -0.373741  -0.758561
+    H   1.680398  -0.373741   0.758561
+    """,
+    dtype="psi4",
+    orient=True)
+
+
+@pytest.fixture
+def molecules():
+    ions = Molecule(
+        symbols=["Na", "Cl"],
+        geometry=[0, 0, 0, 0, 0, 4],
+        fragments=[[1], [0]],
+        fragment_charges=[-1, 1],
+        fragment_multiplicities=[1, 1])
+    return [water_dimer_minima, water_molecule, ions, water_dimer_minima.get_fragment(1, 0)]
+
+
+def test_batch_roundtrip(molecules):
+    batch = MoleculeBatch.from_molecules(molecules)
+
+    assert len(batch) == 4
+    assert batch.natoms.tolist() == [6, 3, 2, 6]
+    assert batch.geometry.shape == (17, 3)
+
+    for mol, bmol in zip(molecules, batch):
+        assert mol.compare(bmol)
+        assert mol.name == bmol.name
+        assert mol.fragments == bmol.fragments
+
+    assert batch[-2].fragment_charges == [-1, 1]
+
+
+def test_batch_view(molecules):
+    batch = MoleculeBatch.from_molecules(molecules)
+    view = batch.view(1)
+
+    assert np.shares_memory(view["geometry"], batch.geometry)
+    assert np.allclose(view["geometry"], water_molecule.geometry)
+    assert view["atomic_numbers"].tolist() == [8, 1, 1]
+    assert view["real"].all()
+
+
+def test_batch_hash(molecules):
+    batch = MoleculeBatch.from_molecules(molecules)
+    hashes = batch.get_hash()
+
+    assert hashes == [mol.get_hash() for mol in batch]
+    assert hashes[:3] == [mol.get_hash() for mol in molecules[:3]]
+
+
+def test_batch_formula(molecules):
+    batch = MoleculeBatch.from_molecules(molecules)
+    assert batch.get_molecular_formula() == [mol.get_molecular_formula() for mol in molecules]
+
+
+def test_batch_center_of_mass(molecules):
+    batch = MoleculeBatch.from_molecules(molecules)
+    com = batch.center_of_mass()
+
+    for mol, c in zip(molecules, com):
+        assert np.allclose(np.average(mol.geometry, axis=0, weights=mol.masses), c)
+
+
+def test_batch_orient(molecules):
+    batch = MoleculeBatch.from_molecules(molecules)
+    oriented = batch.orient()
+
+    assert not np.shares_memory(oriented.geometry, batch.geometry)
+    for mol, omol in zip(molecules, oriented):
+        assert omol.compare(mol.orient_molecule())
+
+    oriented, transform = batch.orient(return_transform=True)
+    assert len(transform) == len(molecules)
+    for index, mol in enumerate(molecules):
+        geom = transform[index].apply_geometry(mol.geometry)
+        assert np.allclose(geom, oriented[index].geometry, atol=1.e-8)
+
+
+def test_batch_descriptors(molecules):
+    batch = MoleculeBatch.from_molecules(molecules)
+    desc = batch.descriptors(units="MHz")
+
+    assert desc["formula"] == batch.get_molecular_formula()
+    assert desc["nelectrons"].tolist() == [20, 10, 28, 10]
+    assert np.allclose(desc["center_of_mass"], batch.center_of_mass())
+    assert np.allclose(desc["radius_of_gyration"], batch.radius_of_gyration())
+    assert np.allclose(desc["rotational_constants"], batch.rotational_constants("MHz"))
+
+    for mol, moments, rg in zip(molecules, desc["principal_moments"], desc["radius_of_gyration"]):
+        geom = mol.geometry - np.average(mol.geometry, axis=0, weights=mol.masses)
+        assert np.allclose(np.linalg.eigvalsh(Molecule._inertial_tensor(geom, np.array(mol.masses))), moments)
+        assert np.isclose(np.sqrt(np.average(np.sum(geom**2, axis=1), weights=mol.masses)), rg)
+
+
+def test_batch_rotational_constants():
+    co = Molecule(symbols=["C", "O"], geometry=[0, 0, 0, 0, 0, 2.132])
+    batch = MoleculeBatch.from_arrays(
+        np.concatenate([co.geometry, [[0, 0, 0]]]), atomic_numbers=[6, 8, 2], atom_offsets=[0, 2, 3])
+
+    assert np.allclose(batch.masses[:2], co.masses)
+    constants = batch.rotational_constants()
+    assert np.isinf(constants[0, 0]) and np.allclose(constants[0, 1:], 1.93, atol=0.01)
+    assert np.isinf(constants[1]).all()
+
+
+def test_batch_defaults():
+    batch = MoleculeBatch(
+        geometry=np.arange(15).reshape(5, 3),
+        atomic_numbers=[2, 2, 10, 1, 1],
+        masses=[4.0, 4.0, 20.0, 1.0, 1.0],
+        real=[True, False, True, True, True],
+        atom_offsets=[0, 2, 3, 5])
+
+    assert batch.molecular_charges.tolist() == [0, 0, 0]
+    assert batch.molecular_multiplicities.tolist() == [1, 1, 1]
+    assert batch.get_molecular_formula() == ["He2", "Ne", "H2"]
+    assert batch[0].real == [True, False]
+    assert batch[2].fragments == [[0, 1]]
+
+
+def test_batch_errors():
+    with pytest.raises(ValueError):
+        MoleculeBatch(geometry=np.zeros((3, 3)),
+                      atomic_numbers=[1, 1],
+                      masses=[1, 1],
+                      real=[1, 1],
+                      atom_offsets=[0, 2])
+
+    with pytest.raises(ValueError):
+        MoleculeBatch(geometry=np.zeros((2, 3)),
+                      atomic_numbers=[1, 1],
+                      masses=[1, 1],
+                      real=[1, 1],
+                      atom_offsets=[0, 0, 2])
+
+    batch = MoleculeBatch.from_molecules([water_molecule])
+    with pytest.raises(IndexError):
+        batch[1]
+
+
+def test_batch_float32(molecules):
+    batch = MoleculeBatch.from_molecules(molecules, geometry_dtype=np.float32)
+    assert batch.geometry.dtype == np.float32
+    assert batch.orient().geometry.dtype == np.float32
+
+    for mol, bmol in zip(molecules, batch):
+        assert np.allclose(mol.geometry, bmol.geometry, atol=1.e-5)
+        assert bmol.geometry.dtype == np.double
+
+    with pytest.raises(ValueError):
+        MoleculeBatch.from_molecules(molecules, geometry_dtype=np.float16)
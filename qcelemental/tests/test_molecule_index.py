@@ -0,0 +1,115 @@
+"""
+Tests the MoleculeIndex deduplication collection.
+"""
+
+import numpy as np
+import pytest
+import qcelemental as qcel
+from qcelemental.models import FingerprintIndex, Molecule, MoleculeIndex
+
+water_molecule = Molecule.from_data("""
+    0 1
+    O  -1.551007  -0.114520   0.000000
+    H  -1.934259   0.762503   0.000000
+    H  -0.599677   0.040712   0.000000
+    """)
+
+water_dimer_minima = Molecule.from_data(
+    """
+    0 1
+    O  -1.551007  -0.114520   0.000000
+    H  -1.934259   0.762503   0.000000
+    H  -0.599677   0.040712   0.000000
+    --
+    O   1.350625   0.111469   0.000000
+    H   1.680398  -0.373741  -0.758561
+    H   1.680398  -0.373741   0.758561
+    """,
+    dtype="psi4",
+    orient=True)
+
+
+@pytest.fixture
+def index():
+    shifted = Molecule(symbols=water_molecule.symbols, geometry=water_molecule.geometry + 0.5)
+    return MoleculeIndex([
+        water_molecule,
+        water_dimer_minima,
+        Molecule(**water_molecule.dict()),
+        shifted,
+        water_dimer_minima.json_dict(),
+    ])
+
+
+def test_molecule_index_groups(index):
+    assert len(index) == 5
+    assert index.groups == [[0, 2], [1, 4], [3]]
+    assert index.duplicate_groups() == [[0, 2], [1, 4]]
+    assert index.group_of(4) == [1, 4]
+    assert [mol.get_hash() for mol in index.unique()] == [index[i].get_hash() for i in [0, 1, 3]]
+
+
+def test_molecule_index_incremental(index):
+    assert water_molecule in index
+    assert index.find(water_dimer_minima.get_fragment(0)) is None
+
+    # Raw molrecs are accepted as well
+    molrec = qcel.molparse.from_string("""
+        O  -1.551007  -0.114520   0.000000
+        H  -1.934259   0.762503   0.000000
+        H  -0.599677   0.040712   0.000000
+        """)["qm"]
+    assert index.add(molrec) == 5
+    assert index.group_of(5) == [0, 2, 5]
+
+    with pytest.raises(TypeError):
+        index.add("not a molecule")
+
+
+def test_molecule_index_file(index, tmp_path):
+    filename = str(tmp_path / "index.json")
+    index.to_file(filename)
+
+    loaded = MoleculeIndex.from_file(filename)
+    assert loaded.groups == index.groups
+    assert all(a.get_hash() == b.get_hash() for a, b in zip(loaded, index))
+    assert np.allclose(loaded[3].geometry, index[3].geometry)
+
+    assert loaded.add(water_molecule) == 5
+    assert loaded.group_of(5) == [0, 2, 5]
+
+
+def _conformers():
+    rng = np.random.RandomState(11)
+    rotation = np.linalg.qr(rng.standard_normal((3, 3)))[0]
+    mol = water_dimer_minima
+
+    bent = mol.geometry.copy()
+    bent[5] += [0.0, 0.3, 0.2]
+    return [
+        mol,
+        Molecule(symbols=mol.symbols, geometry=mol.geometry @ rotation + 2.0e-6 * rng.standard_normal((6, 3))),
+        Molecule(symbols=mol.symbols, geometry=bent),
+        Molecule(symbols=[mol.symbols[i] for i in [3, 4, 5, 0, 1, 2]], geometry=mol.geometry[[3, 4, 5, 0, 1, 2]]),
+        water_molecule,
+    ]
+
+
+def test_fingerprint_index():
+    index = FingerprintIndex(tolerance=1.e-4)
+    assert index.extend(_conformers()) == [0, 1, 2, 3, 4]
+
+    assert index.near_duplicate_pairs() == [(0, 1), (0, 3), (1, 3)]
+    assert sorted(index.groups()) == [[0, 1, 3], [2], [4]]
+
+    assert index.query(water_dimer_minima.json_dict()) == [0, 1, 3]
+    assert index.query(water_molecule) == [4]
+    assert index.add(water_molecule) == 5
+    assert index.query(water_molecule) == [4, 5]
+
+
+def test_fingerprint_index_tolerance():
+    # A tolerance below the noise separates the perturbed conformer
+    index = FingerprintIndex(tolerance=1.e-9)
+    index.extend(_conformers())
+    assert index.near_duplicate_pairs() == [(0, 3)]
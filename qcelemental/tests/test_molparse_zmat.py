@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+import qcelemental
+from qcelemental.molparse import ZMatrix, settle_geometry, zmat_to_cartesian
+from qcelemental.testing import compare_values
+
+subject_hooh = """
+H
+O 1 0.95
+O 2 1.40 1 A
+H 3 0.95 2 A 1 D
+
+A = 105.0
+D = 120.0
+"""
+
+
+def _measure(geom, *atoms):
+    return qcelemental.util.measure_coordinates(geom, [list(atoms)], degrees=True)[0]
+
+
+def test_zmat_internals():
+    molrec = qcelemental.molparse.from_string(subject_hooh)['qm']
+    geom = zmat_to_cartesian(molrec['geom_unsettled'], molrec['variables'])
+
+    assert compare_values(0.95, _measure(geom, 0, 1), 'bond')
+    assert compare_values(1.40, _measure(geom, 1, 2), 'bond')
+    assert compare_values(105.0, _measure(geom, 1, 2, 3), 'angle')
+    assert compare_values(120.0, _measure(geom, 0, 1, 2, 3), 'dihedral')
+
+    # psi4 frame: first atom at origin, second along z, third in the xz plane
+    assert compare_values(np.zeros(3), geom[0], 'origin')
+    assert compare_values([0.0, 0.0], geom[1, :2], 'z axis')
+    assert compare_values(0.0, geom[2, 1], 'xz plane')
+
+
+def test_zmat_batch():
+    molrec = qcelemental.molparse.from_string(subject_hooh)['qm']
+    zmat = ZMatrix(molrec['geom_unsettled'])
+    assert zmat.variables == ['A', 'D']
+
+    dihedrals = np.linspace(-180, 180, 37)
+    geoms = zmat.cartesian({'A': 105.0, 'D': dihedrals})
+    assert geoms.shape == (37, 4, 3)
+
+    for dihedral, geom in zip(dihedrals[1:-1], geoms[1:-1]):
+        assert compare_values(dihedral, _measure(geom, 0, 1, 2, 3), 'dihedral', atol=1.e-6)
+    assert compare_values(zmat.cartesian({'A': 105.0, 'D': dihedrals[5]}), geoms[5], 'single set')
+
+
+def test_zmat_dummies():
+    molrec = qcelemental.molparse.from_string("""
+    0 1
+    X
+    O 1 1.0
+    H 2 0.95 1 90.0
+    H 2 0.95 1 90.0 3 -D
+    --
+    He 1 r 2 90.0 3 0.0
+    D = -180.0
+    r = 4.0
+    """)['qm']
+
+    settled = settle_geometry(molrec)
+    assert list(settled['elem']) == ['O', 'H', 'H', 'He']
+    assert settled['fragment_separators'] == [3]
+    assert 'geom_unsettled' not in settled
+
+    geom = settled['geom'].reshape(-1, 3)
+    assert compare_values(180.0, _measure(geom, 1, 0, 2), 'linear through dummy')
+
+    geom = settle_geometry(molrec, {'r': 5.0}, drop_dummies=False)['geom'].reshape(-1, 3)
+    assert geom.shape == (5, 3)
+    assert compare_values(5.0, _measure(geom, 0, 4), 'override')
+
+    # Field types follow from_arrays, also for records that went through JSON
+    listed = {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in molrec.items()}
+    for drop_dummies in [True, False]:
+        settled = settle_geometry(listed, drop_dummies=drop_dummies)
+        for key, dtype in [('elea', int), ('elez', int), ('elem', str), ('mass', float), ('real', bool)]:
+            assert isinstance(settled[key], np.ndarray)
+            assert settled[key].dtype.type == np.dtype(dtype).type
+        assert isinstance(settled['fragment_separators'], list)
+
+
+def test_zmat_mixed():
+    molrec = qcelemental.molparse.from_string("""
+    C 0.0 0.0 0.0
+    O 0.0 0.0 z
+    H w 0.0 -w
+    H 1 1.1 2 120.0 3 180.0
+    z = 1.2
+    w = 0.8
+    """)['qm']
+
+    geom = settle_geometry(molrec)['geom'].reshape(-1, 3)
+    assert compare_values([0.0, 0.0, 1.2], geom[1], 'cartesian variable')
+    assert compare_values([0.8, 0.0, -0.8], geom[2], 'negated variable')
+    assert compare_values(1.1, _measure(geom, 0, 3), 'bond to cartesian')
+    assert compare_values(120.0, _measure(geom, 1, 0, 3), 'angle to cartesian')
+    assert compare_values(180.0, abs(_measure(geom, 3, 0, 1, 2)), 'dihedral to cartesian')
+
+
+def test_zmat_labels():
+    geom = zmat_to_cartesian([[], ['O1', '1.0'], ['o1', '1.0', 'H2', 'tda']],
+                             labels=['O1', 'H2', 'H3'],
+                             variables={'tda': 109.4712206})
+    assert compare_values(109.4712206, _measure(geom, 1, 0, 2), 'angle')
+
+    molrec = qcelemental.molparse.from_string("""
+    O1
+    H2 O1 0.96
+    H3 O1 0.96 H2 104.5
+    """, dtype='psi4+')['qm']
+    geom = settle_geometry(molrec)['geom'].reshape(-1, 3)
+    assert compare_values(104.5, _measure(geom, 1, 0, 2), 'angle')
+
+
+@pytest.mark.parametrize("geom_unsettled,variables,error", [
+    ([[], ['2', '1.0']], {}, 'earlier atom'),
+    ([[], ['1', '1.0'], ['1', '1.0', '1', '90.']], {}, 'distinct'),
+    ([[], ['1', 'R']], {}, 'missing'),
+    ([[], ['1', 'R'], ['1', 'R', '2', 'A']], {'R': [1.0, 1.1], 'A': [90., 100., 110.]}, 'same length'),
+])
+def test_zmat_errors(geom_unsettled, variables, error):
+    with pytest.raises(qcelemental.ValidationError) as e:
+        zmat_to_cartesian(geom_unsettled, variables)
+
+    assert error in str(e.value)
@@ -133,3 +133,30 @@ def test_compare(ref, cpd, kw, boool, msg):
     res, mstr = qcel.testing.compare(ref, cpd, **kw, return_message=True)
     assert res is boool
     assert mstr.strip() == msg[1].strip()
+
+
+_water = """
+    O  -1.551007  -0.114520   0.000000
+    H  -1.934259   0.762503   0.000000
+    H  -0.599677   0.040712   0.000000
+    """
+
+_water_moved = """
+    H   0.599677   1.000000   0.040712
+    O   1.551007   1.000000  -0.114520
+    H   1.934259   1.000000   0.762503
+    """
+
+
+@pytest.mark.parametrize("fix_com,fix_orientation,boool", [
+    (False, False, True),
+    (True, False, False),
+    (False, True, False),
+])
+def test_compare_molrecs_align(fix_com, fix_orientation, boool):
+    ref = qcel.molparse.from_string(_water, fix_com=True, fix_orientation=True)['qm']
+    cpd = qcel.molparse.from_string(_water_moved, fix_com=fix_com, fix_orientation=fix_orientation)['qm']
+    ref.update(fix_com=fix_com, fix_orientation=fix_orientation)
+
+    assert not qcel.testing.compare_molrecs(ref, cpd, atol=1.e-6)
+    assert qcel.testing.compare_molrecs(ref, cpd, atol=1.e-6, relative_geoms='align') is boool
@@ -1,3 +1,7 @@
+import itertools
+import sys
+import time
+
 import numpy as np
 import pytest
 import qcelemental
@@ -151,3 +155,338 @@ def test_dihedral2():
     _test_dihedral(p0, p1, p4, p5, -171.94319947953642)
     _test_dihedral(p1, p4, p5, p6, 60.82226735264638)
     _test_dihedral(p1, p4, p5, p7, -177.63641151521261)
+
+
+def test_dihedral_rows():
+    points = np.random.RandomState(5).rand(4, 7, 3)
+    rows = qcelemental.util.compute_dihedral(*points)
+    for i in range(7):
+        assert compare_values(float(qcelemental.util.compute_dihedral(*points[:, i])), rows[i], atol=1.e-10)
+
+
+def test_measure_coordinates_arrays():
+    geom = np.random.RandomState(11).rand(30, 3) * 5
+    rng = np.random.RandomState(12)
+
+    for arity in [2, 3, 4]:
+        indices = np.array([rng.choice(30, size=arity, replace=False) for _ in range(50)])
+        values = qcelemental.util.measure_coordinates(geom, indices, degrees=True)
+
+        assert isinstance(values, np.ndarray)
+        assert values.shape == (50, )
+        for m, v in zip(indices, values):
+            assert compare_values(qcelemental.util.measure_coordinates(geom, m.tolist(), degrees=True), v)
+
+
+def test_measure_coordinates_mixed():
+    geom = np.random.RandomState(11).rand(10, 3) * 5
+    measurements = [[0, 1], [2, 3, 4], [1, 2, 3, 4], [5, 6], [7, 8, 9, 0], [1, 5, 9]]
+
+    values = qcelemental.util.measure_coordinates(geom, measurements)
+    assert isinstance(values, list)
+
+    expected = [
+        float(qcelemental.util.compute_distance(geom[0], geom[1])),
+        float(qcelemental.util.compute_angle(geom[2], geom[3], geom[4])),
+        float(qcelemental.util.compute_dihedral(geom[1], geom[2], geom[3], geom[4])),
+        float(qcelemental.util.compute_distance(geom[5], geom[6])),
+        float(qcelemental.util.compute_dihedral(geom[7], geom[8], geom[9], geom[0])),
+        float(qcelemental.util.compute_angle(geom[1], geom[5], geom[9])),
+    ]
+    assert compare_values(expected, values)
+
+
+@pytest.mark.parametrize("measurements,error", [
+    ([[0, 1], [0, 10]], ValueError),
+    (np.array([[0, 1, 12]]), ValueError),
+    ([[0, 1], [0, 1, 2, 3, 4]], KeyError),
+])
+def test_measure_coordinates_errors(measurements, error):
+    geom = np.random.RandomState(11).rand(10, 3)
+    with pytest.raises(error):
+        qcelemental.util.measure_coordinates(geom, measurements)
+
+
+def test_measure_coordinates_frames(monkeypatch):
+    rng = np.random.RandomState(13)
+    traj = rng.rand(25, 12, 3) * 5
+    measurements = [[0, 1], [2, 3, 4], [1, 2, 3, 4], [5, 6], [7, 8, 9, 10], [1, 5, 11]]
+
+    values = qcelemental.util.measure_coordinates(traj, measurements, degrees=True)
+    assert values.shape == (25, 6)
+    for frame, row in zip(traj, values):
+        assert compare_values(qcelemental.util.measure_coordinates(frame, measurements, degrees=True), row)
+
+    # Small chunks and a preallocated buffer give identical results
+    monkeypatch.setattr(qcelemental.util.misc, "MEASURE_CHUNK_ELEMENTS", 4)
+    out = np.zeros((25, 6))
+    ret = qcelemental.util.measure_coordinates(traj, measurements, degrees=True, out=out)
+    assert ret is out
+    assert compare_values(values, out)
+
+    single = qcelemental.util.measure_coordinates(traj, [1, 2, 3, 4])
+    assert compare_values(values[:, 2], np.degrees(single))
+
+    with pytest.raises(ValueError):
+        qcelemental.util.measure_coordinates(traj, measurements, out=np.zeros((6, 25)))
+
+
+def _random_rotation(rng):
+    rotation = np.linalg.qr(rng.standard_normal((3, 3)))[0]
+    return rotation * np.sign(np.linalg.det(rotation))
+
+
+def test_kabsch():
+    rng = np.random.RandomState(5)
+    rgeom = rng.standard_normal((20, 3)) * 3
+    cgeom = rgeom @ _random_rotation(rng) + [1.0, -2.0, 0.5]
+
+    mill = qcelemental.util.kabsch(rgeom, cgeom)
+    assert mill.rmsd < 1.e-10
+    assert compare_values(rgeom, mill.align_coordinates(cgeom), atol=1.e-10)
+    assert compare_values(cgeom, mill.align_coordinates(rgeom, reverse=True), atol=1.e-10)
+    assert compare_values(1.0, np.linalg.det(mill.rotation))
+
+    # Unmoved geometries have a null shift and identity rotation
+    mill = qcelemental.util.kabsch(rgeom, rgeom, weights=rng.rand(20))
+    assert compare_values(np.zeros(3), mill.shift, atol=1.e-10)
+    assert compare_values(np.identity(3), mill.rotation, atol=1.e-10)
+
+    # A mirror image only overlays with improper rotations
+    mirrored = rgeom * [1, 1, -1]
+    assert qcelemental.util.kabsch(rgeom, mirrored).rmsd > 0.1
+    mill = qcelemental.util.kabsch(rgeom, mirrored, mirror=True)
+    assert mill.mirror and mill.rmsd < 1.e-10
+
+
+@pytest.mark.parametrize("n", [1, 4, 7, 30])
+def test_linear_sum_assignment(n):
+    cost = np.random.RandomState(n).rand(n, n)
+    assignment = qcelemental.util.alignment._hungarian(cost)
+    assert sorted(assignment) == list(range(n))
+    assert compare_values(cost[np.arange(n), qcelemental.util.linear_sum_assignment(cost)].sum(),
+                          cost[np.arange(n), assignment].sum())
+
+    if n < 8:
+        best = min(cost[np.arange(n), perm].sum() for perm in itertools.permutations(range(n)))
+        assert compare_values(best, cost[np.arange(n), assignment].sum())
+
+        # Ties between rows and columns
+        cost = np.round(cost * 3)
+        best = min(cost[np.arange(n), perm].sum() for perm in itertools.permutations(range(n)))
+        assignment = qcelemental.util.alignment._hungarian(cost)
+        assert compare_values(best, cost[np.arange(n), assignment].sum())
+
+
+def test_align_atoms_map_noisy(monkeypatch):
+    # Force the fallback solver, noisy geometries defeat the greedy shortcut
+    monkeypatch.setitem(sys.modules, "scipy.optimize", None)
+
+    rng = np.random.RandomState(5)
+    labels = rng.choice(["C", "H", "N", "O"], 1000)
+    rgeom = rng.standard_normal((1000, 3)) * 8
+    perm = rng.permutation(1000)
+    cgeom = (rgeom + 0.3 * rng.standard_normal((1000, 3)))[perm] @ _random_rotation(rng)
+
+    start = time.time()
+    mill = qcelemental.util.align(rgeom, cgeom, labels, labels[perm], atoms_map=True)
+    assert time.time() - start < 5.0
+    assert np.mean(mill.atommap == np.argsort(perm)) > 0.99
+
+
+@pytest.mark.parametrize("mirror", [False, True])
+def test_align_atoms_map(mirror):
+    rng = np.random.RandomState(7)
+    labels = rng.choice(["C", "H", "O"], 40)
+    rgeom = rng.standard_normal((40, 3)) * 4
+
+    perm = rng.permutation(40)
+    cgeom = (rgeom @ _random_rotation(rng) + 3.0)[perm]
+    if mirror:
+        cgeom = cgeom * [-1, 1, 1]
+
+    mill = qcelemental.util.align(rgeom, cgeom, labels, labels[perm], atoms_map=True, mirror=mirror)
+    assert mill.rmsd < 1.e-8
+    assert mill.mirror == mirror
+    assert list(mill.atommap) == list(np.argsort(perm))
+    assert compare_values(rgeom, mill.align_coordinates(cgeom), atol=1.e-8)
+
+    with pytest.raises(ValueError):
+        qcelemental.util.map_atoms(rgeom, cgeom, labels, np.full(40, "C"))
+
+
+@pytest.mark.parametrize("mirror", [False, True])
+def test_batch_rmsd(monkeypatch, mirror):
+    rng = np.random.RandomState(9)
+    reference = rng.standard_normal((12, 3)) * 2
+    weights = rng.rand(12) + 1
+    frames = np.array([(reference + 0.05 * rng.standard_normal((12, 3))) @ _random_rotation(rng) + rng.rand(3)
+                       for _ in range(10)])
+    frames[3] *= [1, -1, 1]
+
+    expected = [qcelemental.util.kabsch(reference, frame, weights=weights, mirror=mirror).rmsd for frame in frames]
+    rmsd = qcelemental.util.batch_rmsd(reference, frames, weights=weights, mirror=mirror)
+    assert compare_values(expected, rmsd, atol=1.e-10)
+    assert bool(rmsd[3] < 0.1) == mirror
+
+    # Small chunks and a buffer for the aligned frames give identical results
+    monkeypatch.setattr(qcelemental.util.alignment, "RMSD_CHUNK_ELEMENTS", 40)
+    out = np.zeros_like(frames)
+    chunked = qcelemental.util.batch_rmsd(reference, frames, weights=weights, mirror=mirror, out=out)
+    assert compare_values(rmsd, chunked)
+    mill = qcelemental.util.kabsch(reference, frames[5], weights=weights, mirror=mirror)
+    assert compare_values(mill.align_coordinates(frames[5]), out[5], atol=1.e-10)
+
+    unaligned = qcelemental.util.batch_rmsd(reference, frames, align=False)
+    assert compare_values(np.sqrt(((frames - reference)**2).sum(axis=2).mean(axis=1)), unaligned)
+
+    with pytest.raises(ValueError):
+        qcelemental.util.batch_rmsd(reference, frames[:, :5])
+
+
+def _conformer_ensemble(rng, nframe=40, nat=8):
+    base = rng.standard_normal((nat, 3)) * 2
+    centers = [base, base * [1.3, 1, 1], base * [1, 0.7, 1]]
+    return np.array([(centers[i % 3] + 0.02 * rng.standard_normal((nat, 3))) @ _random_rotation(rng)
+                     for i in range(nframe)])
+
+
+@pytest.mark.parametrize("threshold,nprocs", [(None, 1), (0.2, 1), (None, 2)])
+def test_pairwise_rmsd(monkeypatch, threshold, nprocs):
+    rng = np.random.RandomState(17)
+    frames = _conformer_ensemble(rng)
+    weights = rng.rand(8) + 1
+
+    monkeypatch.setattr(qcelemental.util.conformers, "PAIR_BLOCK_MATRICES", 200)
+    rmsd = qcelemental.util.pairwise_rmsd(frames, weights, threshold=threshold, nprocs=nprocs)
+    expected = np.array([
+        qcelemental.util.kabsch(frames[i], frames[j], weights=weights).rmsd
+        for i, j in itertools.combinations(range(40), 2)
+    ])
+
+    computed = np.isfinite(rmsd)
+    assert compare_values(expected[computed], rmsd[computed], atol=1.e-6)
+    if threshold is None:
+        assert computed.all()
+    else:
+        assert (expected[~computed] > threshold).all()
+        assert not computed.all()
+
+
+def test_cluster_conformers():
+    rng = np.random.RandomState(19)
+    frames = _conformer_ensemble(rng, nframe=12)
+
+    leaders, assignments = qcelemental.util.cluster_conformers(frames, 0.1)
+    assert list(leaders) == [0, 1, 2]
+    assert list(assignments) == [0, 1, 2] * 4
+
+    # Molecules supply their geometry and masses
+    molecules = [qcelemental.models.Molecule(symbols=["C"] * 8, geometry=frame) for frame in frames]
+    leaders, assignments = qcelemental.util.cluster_conformers(molecules, 0.1)
+    assert list(assignments) == [0, 1, 2] * 4
+
+    leaders, assignments = qcelemental.util.cluster_conformers(frames, 10.0)
+    assert list(leaders) == [0] and not assignments.any()
+
+
+def test_frame_transform():
+    rng = np.random.RandomState(3)
+    rotation = np.linalg.qr(rng.rand(4, 3, 3))[0]
+    transform = qcelemental.util.FrameTransform(rng.rand(4, 3), rotation)
+
+    geoms = rng.rand(4, 5, 3)
+    gradients = rng.rand(4, 5, 3)
+    hessians = rng.rand(4, 15, 15)
+    hessians += np.swapaxes(hessians, 1, 2)
+
+    new_hessians = transform.apply_hessian(hessians)
+    for index in range(4):
+        block = np.kron(np.identity(5), rotation[index])
+        assert np.allclose(new_hessians[index], block.T @ hessians[index] @ block)
+        assert np.allclose(transform[index].apply_gradient(gradients[index]), gradients[index] @ rotation[index])
+
+    assert np.allclose(transform.apply_geometry(transform.apply_geometry(geoms), inverse=True), geoms)
+    assert np.allclose(transform.inverse().apply_geometry(transform.apply_geometry(geoms)), geoms)
+    assert np.allclose(transform.apply_gradient(transform.apply_gradient(gradients), inverse=True), gradients)
+    assert np.allclose(transform.apply_hessian(new_hessians, inverse=True), hessians)
+
+    double = transform.compose(transform[::-1])
+    assert np.allclose(double.apply_geometry(geoms), transform[::-1].apply_geometry(transform.apply_geometry(geoms)))
+
+    with pytest.raises(ValueError):
+        transform.apply_hessian(np.zeros((4, 14, 14)))
+
+
+def test_internal_coordinates():
+    mol = qcelemental.models.Molecule.from_data("""
+    C  0.0  0.0  0.0
+    C  1.5  0.0  0.1
+    O -0.7  1.1  0.2
+    H -0.5 -0.9  0.3
+    H  2.0  0.9 -0.4
+    H  2.0 -0.9  0.5
+    H -0.2  1.9 -0.1
+    """)
+    coords = mol.internal_coordinates()
+    assert (len(coords.stretches), len(coords.bends), len(coords.torsions)) == (6, 7, 6)
+    assert coords.indices[0] == [0, 1]
+    assert [2, 0, 1, 4] in coords.indices
+
+    geom = mol.geometry
+    values = coords.values(geom)
+    assert compare_values(mol.measure(coords.indices, degrees=False), values, 'values')
+
+    # B-matrix against central differences
+    bmat = coords.b_matrix(geom)
+    step = 1.e-5
+    numerical = np.zeros_like(bmat)
+    for x in range(geom.size):
+        displaced = np.tile(geom.ravel(), (2, 1))
+        displaced[:, x] += [step, -step]
+        plus, minus = coords.values(displaced.reshape(2, -1, 3))
+        numerical[:, x] = (plus - minus) / (2 * step)
+    assert np.allclose(bmat, numerical, atol=1.e-8)
+
+    rows, cols, data = coords.b_matrix_coo(geom)
+    assert data.shape == (3 * (2 * 6 + 3 * 7 + 4 * 6), )
+    assert np.allclose(bmat[rows, cols], data)
+
+    # Translation and rotation free gradients transform back and forth
+    gradient = mol.nuclear_repulsion_gradient()
+    internal = coords.gradient_to_internal(geom, gradient)
+    assert np.allclose(coords.gradient_to_cartesian(geom, internal), gradient)
+
+    frames = np.stack([geom, geom * 1.01])
+    assert np.allclose(coords.b_matrix(frames)[1], coords.b_matrix(frames[1]))
+    assert np.allclose(coords.gradient_to_internal(frames, np.stack([gradient, gradient]))[0], internal)
+
+
+def test_internal_coordinates_generation():
+    InternalCoordinates = qcelemental.util.InternalCoordinates
+
+    # H-O=C=O with a linear carbon, its bend and the torsion through it are dropped
+    geom = [[0.0, 0.0, 0.0], [0.0, 0.0, 2.2], [0.0, 0.0, -2.2], [0.0, 1.8, 3.0]]
+    bonds = [(0, 1, 2.0), (0, 2, 2.0), (1, 3, 1.0)]
+    assert InternalCoordinates.from_connectivity(bonds).indices[3:] == [[1, 0, 2], [0, 1, 3], [2, 0, 1, 3]]
+    assert InternalCoordinates.from_connectivity(bonds, geom).indices[3:] == [[0, 1, 3]]
+
+    # No torsions close three-membered rings
+    ring = InternalCoordinates.from_connectivity([(0, 1), (1, 2), (0, 2), (2, 3)])
+    assert all(len(set(x)) == len(x) for x in ring.indices)
+    assert len(ring.torsions) == 2
+
+    with pytest.raises(ValueError):
+        InternalCoordinates(bends=[[0, 1, 0]])
+    with pytest.raises(ValueError):
+        InternalCoordinates(stretches=[[0, 5]]).values(geom)
+
+
+def test_cell_lookup_shared_cell():
+    # Both atoms fall in the same tolerance cell, only the second is within tolerance of the query
+    geom = np.array([[0.1, 0.0, 0.0], [0.3, 0.0, 0.0], [5.0, 0.0, 0.0]])
+    lookup = qcelemental.util.symmetry._CellLookup(geom, np.array([0, 0, 1]), 0.5)
+
+    points = np.array([[0.75, 0.0, 0.0], [0.25, 0.0, 0.0], [0.05, 0.0, 0.0], [5.0, 0.0, 0.0], [0.3, 0.0, 0.0]])
+    image = lookup.match(points, np.array([0, 0, 0, 0, 1]))
+    assert image.tolist() == [1, 1, 0, -1, -1]
@@ -3,5 +3,10 @@
 #from .mpl import plot_coord
 from .misc import (distance_matrix, update_with_error, standardize_efp_angles_units, filter_comments, unnp,
                    compute_distance, compute_angle, compute_dihedral, measure_coordinates)
+from .alignment import Alignment, align, batch_rmsd, kabsch, linear_sum_assignment, map_atoms
+from .conformers import cluster_conformers, pairwise_rmsd
+from .frames import FrameTransform
+from .internal_coordinates import InternalCoordinates
+from .symmetry import detect_point_group
 from .internal import provenance_stamp
 from .itertools import unique_everseen
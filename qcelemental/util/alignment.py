@@ -0,0 +1,431 @@
+"""
+Superposition of Cartesian geometries with optional atom mapping
+"""
+
+import itertools
+
+import numpy as np
+
+# Maximum number of frame coordinates superimposed at once by batch_rmsd
+RMSD_CHUNK_ELEMENTS = 2**20
+
+
+class Alignment:
+    """Result of superimposing a computed geometry onto a reference geometry.
+
+    The aligned geometry is ``(cgeom[atommap] - shift) @ rotation`` so that an unmoved
+    geometry has a null `shift` and an identity `rotation`.
+
+    Attributes
+    ----------
+    rmsd : float
+        Root-mean-square deviation after alignment.
+    shift : np.ndarray
+        (3, ) Translation removed from the computed geometry before rotation.
+    rotation : np.ndarray
+        (3, 3) Rotation applied to row vectors, improper if `mirror`.
+    atommap : np.ndarray
+        (nat, ) Index of the computed atom matched to each reference atom.
+    mirror : bool
+        Whether the alignment includes a reflection.
+    """
+
+    __slots__ = ("rmsd", "shift", "rotation", "atommap", "mirror")
+
+    def __init__(self, rmsd, shift, rotation, atommap, mirror=False):
+        self.rmsd = rmsd
+        self.shift = shift
+        self.rotation = rotation
+        self.atommap = atommap
+        self.mirror = mirror
+
+    def __repr__(self):
+        return "Alignment(rmsd={:.6g}, mirror={})".format(self.rmsd, self.mirror)
+
+    def align_coordinates(self, geom, reverse=False):
+        """
+        Applies the alignment to a computed (nat, 3) geometry, or undoes it if `reverse`.
+        """
+        geom = np.asarray(geom, dtype=np.double).reshape(-1, 3)
+        if reverse:
+            aligned = np.empty_like(geom)
+            aligned[self.atommap] = geom @ self.rotation.T + self.shift
+            return aligned
+        return (geom[self.atommap] - self.shift) @ self.rotation
+
+
+def kabsch(rgeom, cgeom, weights=None, mirror=False):
+    """Optimal superposition of `cgeom` onto `rgeom` for a fixed atom ordering.
+
+    Parameters
+    ----------
+    rgeom : array_like
+        (nat, 3) Reference geometry.
+    cgeom : array_like
+        (nat, 3) Computed geometry to move onto the reference.
+    weights : array_like, optional
+        (nat, ) Weights of each atom, such as masses. Defaults to uniform.
+    mirror : bool, optional
+        Allow improper rotations (reflections).
+
+    Returns
+    -------
+    Alignment
+        The RMSD, shift and rotation with an identity atom map.
+    """
+    rgeom = np.asarray(rgeom, dtype=np.double).reshape(-1, 3)
+    cgeom = np.asarray(cgeom, dtype=np.double).reshape(-1, 3)
+    if rgeom.shape != cgeom.shape:
+        raise ValueError("Geometries of shape {} and {} cannot be aligned.".format(rgeom.shape, cgeom.shape))
+
+    nat = rgeom.shape[0]
+    weights = np.ones(nat) if weights is None else np.asarray(weights, dtype=np.double)
+    wnorm = weights / weights.sum()
+
+    rcom = wnorm @ rgeom
+    ccom = wnorm @ cgeom
+    rc = rgeom - rcom
+    cc = cgeom - ccom
+
+    # H = sum_i w_i c_i^T r_i, the rotation maximizing tr(R^T H) is U diag(1, 1, d) V^T
+    U, _, Vt = np.linalg.svd((cc * wnorm[:, None]).T @ rc)
+    if not mirror and np.linalg.det(U @ Vt) < 0.0:
+        U[:, -1] = -U[:, -1]
+    rotation = U @ Vt
+
+    diff = cc @ rotation - rc
+    rmsd = float(np.sqrt(wnorm @ np.einsum("ij,ij->i", diff, diff)))
+    shift = ccom - rcom @ rotation.T
+
+    return Alignment(rmsd, shift, rotation, np.arange(nat), mirror=bool(np.linalg.det(rotation) < 0.0))
+
+
+def batch_rmsd(reference, frames, align=True, weights=None, *, mirror=False, out=None):
+    """RMSD of every frame of a trajectory or conformer stack against a reference geometry.
+
+    The optimal rotations of all frames in a chunk are found with a single stacked SVD,
+    chunks are sized by `RMSD_CHUNK_ELEMENTS` to bound the temporary memory.
+
+    Parameters
+    ----------
+    reference : array_like
+        (nat, 3) Reference geometry.
+    frames : array_like
+        (nframe, nat, 3) Geometries to compare, atoms in the same order as `reference`.
+    align : bool, optional
+        Superimpose each frame onto the reference before measuring (Kabsch), otherwise
+        the frames are compared in place.
+    weights : array_like, optional
+        (nat, ) Weights of each atom, such as masses. Defaults to uniform.
+    mirror : bool, optional
+        Allow improper rotations (reflections) when aligning.
+    out : np.ndarray, optional
+        (nframe, nat, 3) Buffer that receives the aligned frames.
+
+    Returns
+    -------
+    np.ndarray
+        (nframe, ) RMSD of each frame.
+    """
+    reference = np.asarray(reference, dtype=np.double).reshape(-1, 3)
+    frames = np.asarray(frames, dtype=np.double)
+    if frames.ndim != 3 or frames.shape[1:] != reference.shape:
+        raise ValueError("Frames of shape {} do not match a reference of shape {}.".format(
+            frames.shape, reference.shape))
+    if out is not None and out.shape != frames.shape:
+        raise ValueError("Output buffer of shape {} does not match frames of shape {}.".format(
+            out.shape, frames.shape))
+
+    nframe, nat, _ = frames.shape
+    weights = np.ones(nat) if weights is None else np.asarray(weights, dtype=np.double)
+    wnorm = weights / weights.sum()
+
+    rcom = wnorm @ reference
+    rc = reference - rcom
+
+    rmsd = np.empty(nframe)
+    chunk = max(1, RMSD_CHUNK_ELEMENTS // max(1, 3 * nat))
+    for start in range(0, nframe, chunk):
+        block = frames[start:start + chunk]
+
+        if align:
+            cc = block - np.einsum("a,fax->fx", wnorm, block)[:, None, :]
+
+            # H_f = sum_a w_a c_fa^T r_a for every frame, decomposed in one call
+            U, _, Vt = np.linalg.svd(np.einsum("fax,a,ay->fxy", cc, wnorm, rc))
+            if not mirror:
+                flip = np.linalg.det(U @ Vt) < 0.0
+                U[flip, :, -1] *= -1.0
+            aligned = np.matmul(cc, U @ Vt)
+            aligned += rcom
+        else:
+            aligned = block.copy()
+
+        if out is not None:
+            out[start:start + chunk] = aligned
+
+        aligned -= reference
+        rmsd[start:start + chunk] = np.sqrt(np.einsum("fax,fax,a->f", aligned, aligned, wnorm))
+
+    return rmsd
+
+
+def linear_sum_assignment(cost):
+    """Minimum-cost perfect matching of a square cost matrix (Hungarian algorithm).
+
+    Uses `scipy.optimize.linear_sum_assignment` when SciPy is installed and an
+    O(n^3) shortest augmenting path solver with vectorized inner loops otherwise.
+    The fallback still runs a Python loop per scanned row, it assigns nearly matched
+    blocks of a thousand atoms in milliseconds but unrelated ones in about a second,
+    install SciPy to map large, distorted geometries quickly.
+
+    Parameters
+    ----------
+    cost : array_like
+        (n, n) Cost of assigning row i to column j.
+
+    Returns
+    -------
+    np.ndarray
+        (n, ) Column assigned to each row.
+    """
+    cost = np.asarray(cost, dtype=np.double)
+    n = cost.shape[0]
+    if n == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    # Rows that all prefer distinct columns are already optimal
+    greedy = np.argmin(cost, axis=1)
+    if np.unique(greedy).shape[0] == n:
+        return greedy
+
+    try:
+        from scipy.optimize import linear_sum_assignment as scipy_lsa
+    except ImportError:
+        return _hungarian(cost)
+
+    return scipy_lsa(cost)[1]
+
+
+def _hungarian(cost):
+    """
+    Shortest augmenting path assignment with row and column potentials.
+
+    Columns are first matched to their cheapest rows, leaving augmenting paths only for the
+    rows that lost a conflict. Each path is a Dijkstra search over the reduced costs, one
+    vectorized update over all columns per scanned row, and the potentials of the scanned
+    rows and columns are only updated once the path is found.
+    """
+    n = cost.shape[0]
+    row4col = np.full(n, -1, dtype=np.intp)
+    col4row = np.full(n, -1, dtype=np.intp)
+
+    # Column reduction, then row reduction keeps the potentials feasible and tight on the matches
+    best_row = np.argmin(cost, axis=0)
+    v = cost[best_row, np.arange(n)]
+    first = np.unique(best_row, return_index=True)[1]
+    row4col[first] = best_row[first]
+    col4row[best_row[first]] = first
+    u = np.min(cost - v, axis=1)
+
+    path = np.empty(n, dtype=np.intp)  # row preceding each column on the shortest path
+    dist = np.empty(n)
+    reduced = np.empty(n)
+    masked = np.empty(n)
+    better = np.empty(n, dtype=bool)
+    for start in np.flatnonzero(col4row < 0):
+        dist.fill(np.inf)
+        scanned = np.zeros(n, dtype=bool)
+        rows, cols = [], []
+
+        i = start
+        min_dist = 0.0
+        while True:
+            rows.append(i)
+            np.subtract(cost[i], v, out=reduced)
+            reduced += min_dist - u[i]
+            np.less(reduced, dist, out=better)
+            better &= ~scanned
+            np.copyto(dist, reduced, where=better)
+            path[better] = i
+
+            np.copyto(masked, dist)
+            masked[scanned] = np.inf
+            j = int(np.argmin(masked))
+            min_dist = dist[j]
+            scanned[j] = True
+            cols.append(j)
+            if row4col[j] < 0:
+                break
+            i = row4col[j]
+
+        # Shift the potentials of the scanned rows and columns by their distances
+        rows = np.array(rows[1:], dtype=np.intp)
+        cols = np.array(cols[:-1], dtype=np.intp)
+        u[start] += min_dist
+        u[rows] += min_dist - dist[col4row[rows]]
+        v[cols] -= min_dist - dist[cols]
+
+        # Augment back along the path
+        while True:
+            i = path[j]
+            row4col[j] = i
+            col4row[i], j = j, col4row[i]
+            if i == start:
+                break
+
+    return col4row
+
+
+def map_atoms(rgeom, cgeom, rlabels, clabels):
+    """Element-constrained atom mapping of `cgeom` onto `rgeom` in their current frames.
+
+    Atoms are only matched to atoms with the same label, each label block is assigned
+    independently by minimizing the total squared distance.
+
+    Parameters
+    ----------
+    rgeom, cgeom : array_like
+        (nat, 3) Reference and computed geometries.
+    rlabels, clabels : array_like
+        (nat, ) Element labels such as symbols or atomic numbers.
+
+    Returns
+    -------
+    np.ndarray
+        (nat, ) Index of the computed atom matched to each reference atom.
+    """
+    rgeom = np.asarray(rgeom, dtype=np.double).reshape(-1, 3)
+    cgeom = np.asarray(cgeom, dtype=np.double).reshape(-1, 3)
+    rlabels = np.asarray(rlabels)
+    clabels = np.asarray(clabels)
+
+    rkeys, rinv = np.unique(rlabels, return_inverse=True)
+    ckeys, cinv = np.unique(clabels, return_inverse=True)
+    if rkeys.shape != ckeys.shape or np.any(rkeys != ckeys) or np.any(
+            np.bincount(rinv, minlength=len(rkeys)) != np.bincount(cinv, minlength=len(ckeys))):
+        raise ValueError("Atom mapping requires both geometries to have the same composition.")
+
+    atommap = np.empty(rgeom.shape[0], dtype=np.intp)
+    for block in range(len(rkeys)):
+        ratoms = np.flatnonzero(rinv == block)
+        catoms = np.flatnonzero(cinv == block)
+
+        diff = rgeom[ratoms, None, :] - cgeom[None, catoms, :]
+        atommap[ratoms] = catoms[linear_sum_assignment(np.einsum("ijx,ijx->ij", diff, diff))]
+
+    return atommap
+
+
+def _nearest_neighbor_cost(rgeom, cgeom, rlabels, clabels):
+    """
+    Returns the sum over reference atoms of the squared distance to the nearest computed atom of the same label.
+    """
+    rlabels = np.asarray(rlabels)
+    clabels = np.asarray(clabels)
+
+    cost = 0.0
+    for label in np.unique(rlabels):
+        diff = rgeom[rlabels == label, None, :] - cgeom[None, clabels == label, :]
+        cost += np.einsum("ijx,ijx->ij", diff, diff).min(axis=1).sum()
+    return cost
+
+
+def _closest_separation(geom, labels):
+    """
+    Returns the smallest distance between two atoms sharing a label, or infinity.
+    """
+    labels = np.asarray(labels)
+
+    closest = np.inf
+    for label in np.unique(labels):
+        block = geom[labels == label]
+        if block.shape[0] > 1:
+            diff = block[:, None, :] - block[None, :, :]
+            d2 = np.einsum("ijx,ijx->ij", diff, diff)
+            np.fill_diagonal(d2, np.inf)
+            closest = min(closest, np.sqrt(d2.min()))
+    return closest
+
+
+def _inertial_frame(geom, weights):
+    """
+    Returns the weighted center and principal axes (as columns) of a geometry.
+    """
+    wnorm = weights / weights.sum()
+    com = wnorm @ geom
+    centered = geom - com
+    tensor = (centered * wnorm[:, None]).T @ centered
+    return com, np.linalg.eigh(tensor)[1]
+
+
+def align(rgeom, cgeom, rlabels=None, clabels=None, weights=None, atoms_map=False, mirror=False):
+    """Superimposes `cgeom` onto `rgeom`, optionally finding the atom correspondence.
+
+    Without `atoms_map` this is a single `kabsch` superposition. With `atoms_map`, the
+    atom mapping and superposition are solved together: the direct frame and every sign
+    choice of the principal axes of both geometries are tried as starting orientations,
+    atoms are mapped per element block with `map_atoms`, and the mapping is refined by
+    a final Kabsch superposition; the lowest RMSD wins. Orientations are visited in
+    order of their nearest-neighbor overlap and the search stops once every atom lands
+    within half the closest same-element separation of its partner. Without SciPy, large
+    distorted geometries are slower to map, see `linear_sum_assignment`.
+
+    Parameters
+    ----------
+    rgeom, cgeom : array_like
+        (nat, 3) Reference and computed geometries.
+    rlabels, clabels : array_like, optional
+        (nat, ) Element labels, required with `atoms_map`.
+    weights : array_like, optional
+        (nat, ) Weights of the reference atoms, such as masses. Defaults to uniform.
+    atoms_map : bool, optional
+        Find the element-constrained atom correspondence.
+    mirror : bool, optional
+        Allow improper rotations (reflections).
+
+    Returns
+    -------
+    Alignment
+        The RMSD, shift, rotation, atom map and mirror flag.
+    """
+    rgeom = np.asarray(rgeom, dtype=np.double).reshape(-1, 3)
+    cgeom = np.asarray(cgeom, dtype=np.double).reshape(-1, 3)
+
+    if not atoms_map:
+        return kabsch(rgeom, cgeom, weights=weights, mirror=mirror)
+
+    if rlabels is None or clabels is None:
+        raise ValueError("Atom mapping requires element labels for both geometries.")
+
+    nat = rgeom.shape[0]
+    weights = np.ones(nat) if weights is None else np.asarray(weights, dtype=np.double)
+
+    # Starting orientations: as given, then every axis sign of the computed inertial frame
+    rcom, raxes = _inertial_frame(rgeom, np.ones(nat))
+    ccom, caxes = _inertial_frame(cgeom, np.ones(nat))
+    starts = [cgeom]
+    for signs in itertools.product([1.0, -1.0], repeat=3):
+        rotation = (caxes * np.array(signs)) @ raxes.T
+        if mirror or np.linalg.det(rotation) > 0.0:
+            starts.append((cgeom - ccom) @ rotation + rcom)
+
+    # Visit the most promising orientations first, judged by the nearest-neighbor distances
+    bounds = [_nearest_neighbor_cost(rgeom, start, rlabels, clabels) for start in starts]
+
+    # Once every atom lands within this distance of its partner the mapping is unambiguous
+    resolution = 0.5 * _closest_separation(rgeom, rlabels)
+
+    best = None
+    for istart in np.argsort(bounds, kind="stable"):
+        atommap = map_atoms(rgeom, starts[istart], rlabels, clabels)
+        trial = kabsch(rgeom, cgeom[atommap], weights=weights, mirror=mirror)
+        if best is None or trial.rmsd < best.rmsd - 1.e-12:
+            trial.atommap = atommap
+            best = trial
+
+            deviation = np.linalg.norm(best.align_coordinates(cgeom) - rgeom, axis=1)
+            if deviation.max() < resolution:
+                break
+
+    return best
@@ -0,0 +1,222 @@
+"""
+All-pairs RMSD and clustering of conformer ensembles
+"""
+
+import numpy as np
+
+# Maximum number of 3x3 cross-covariance matrices built at once per row block
+PAIR_BLOCK_MATRICES = 2**16
+
+
+def _conformer_arrays(conformers, weights):
+    """
+    Returns the (nframe, nat, 3) geometries and (nat, ) weights of a stack or a list of Molecules.
+    """
+    if len(conformers) and hasattr(conformers[0], "geometry"):
+        symbols = conformers[0].symbols
+        if any(mol.symbols != symbols for mol in conformers):
+            raise ValueError("All conformers must have the same atoms in the same order.")
+        if weights is None:
+            weights = conformers[0].masses
+        frames = np.array([mol.geometry for mol in conformers], dtype=np.double)
+    else:
+        frames = np.asarray(conformers, dtype=np.double)
+
+    if frames.ndim != 3 or frames.shape[2] != 3:
+        raise ValueError("Conformers must be castable to shape (nframe, nat, 3), found {}.".format(frames.shape))
+
+    weights = np.ones(frames.shape[1]) if weights is None else np.asarray(weights, dtype=np.double)
+    return frames, weights
+
+
+def _rmsd_rows(scaled, gyration, start, stop, threshold, mirror):
+    """
+    Aligned RMSD of sorted rows [start, stop) against all later rows within `threshold` in gyration.
+    The frames are centered and scaled by the square root of the normalized weights.
+
+    Returns the row and column indices (in sorted order) and RMSDs of the evaluated pairs.
+    """
+    nframe = scaled.shape[0]
+    limit = nframe if threshold is None else np.searchsorted(gyration, gyration[stop - 1] + threshold, side="right")
+    if limit <= start + 1:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0)
+
+    # H_ij = sum_a w_a c_ia^T c_ja, with the weights already folded into the frames
+    H = np.einsum("iax,jay->ijxy", scaled[start:stop], scaled[start:limit])
+
+    # Optimal overlap is s1 + s2 + d s3 with d the sign of det(H) for proper rotations
+    sv = np.linalg.svd(H, compute_uv=False)
+    if not mirror:
+        sv[..., -1] *= np.sign(np.linalg.det(H))
+    msd = gyration[start:stop, None]**2 + gyration[None, start:limit]**2 - 2.0 * sv.sum(axis=-1)
+
+    ii, jj = np.indices(msd.shape)
+    ii += start
+    jj += start
+    keep = jj > ii
+    if threshold is not None:
+        keep &= (gyration[jj] - gyration[ii]) <= threshold
+
+    return ii[keep], jj[keep], np.sqrt(np.maximum(msd[keep], 0.0))
+
+
+def _prepare(frames, weights):
+    """
+    Centers and weight-scales the frames and sorts them by weighted radius of gyration.
+    """
+    wnorm = weights / weights.sum()
+    scaled = frames - np.einsum("a,fax->fx", wnorm, frames)[:, None, :]
+    scaled *= np.sqrt(wnorm)[:, None]
+    gyration = np.sqrt(np.einsum("fax,fax->f", scaled, scaled))
+
+    order = np.argsort(gyration, kind="stable")
+    return np.ascontiguousarray(scaled[order]), gyration[order], order
+
+
+def _row_blocks(nframe):
+    """
+    Splits the sorted rows into blocks whose cross-covariance matrices stay within `PAIR_BLOCK_MATRICES`.
+    """
+    block = max(1, PAIR_BLOCK_MATRICES // max(1, nframe))
+    return [(start, min(start + block, nframe)) for start in range(0, nframe, block)]
+
+
+def _condensed_index(nframe, i, j):
+    """
+    Position of pair (i, j), i < j, in a condensed distance matrix.
+    """
+    return nframe * i - i * (i + 1) // 2 + (j - i - 1)
+
+
+def _shared_worker(args):
+    """
+    Process pool task reading the frames from and writing the RMSDs into shared memory.
+    """
+    from multiprocessing import shared_memory
+
+    (frames_name, frames_shape, gyration, order, out_name, blocks, threshold, mirror) = args
+
+    nframe = frames_shape[0]
+    frames_shm = shared_memory.SharedMemory(name=frames_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    scaled = np.ndarray(frames_shape, dtype=np.double, buffer=frames_shm.buf)
+    out = np.ndarray((nframe * (nframe - 1) // 2, ), dtype=np.double, buffer=out_shm.buf)
+    try:
+        for start, stop in blocks:
+            ii, jj, rmsd = _rmsd_rows(scaled, gyration, start, stop, threshold, mirror)
+            oi, oj = order[ii], order[jj]
+            out[_condensed_index(nframe, np.minimum(oi, oj), np.maximum(oi, oj))] = rmsd
+    finally:
+        # Views must be released before the shared memory can be closed
+        del scaled, out
+        frames_shm.close()
+        out_shm.close()
+
+
+def pairwise_rmsd(conformers, weights=None, *, threshold=None, mirror=False, nprocs=1):
+    """Condensed matrix of the aligned RMSD between every pair of conformers.
+
+    Conformers are sorted by radius of gyration, which bounds the aligned RMSD from below
+    by ``|Rg_i - Rg_j|``, so with a `threshold` only pairs that can fall within it are
+    evaluated. Pairs are evaluated in row blocks from the singular values of their
+    cross-covariance matrices, without forming the rotations.
+
+    Parameters
+    ----------
+    conformers : Union[array_like, List[Molecule]]
+        (nframe, nat, 3) Geometries, or Molecules with identical atoms.
+    weights : array_like, optional
+        (nat, ) Weights of each atom. Defaults to the masses of Molecules, otherwise uniform.
+    threshold : float, optional
+        Skip pairs that provably exceed this RMSD, they are reported as infinity.
+    mirror : bool, optional
+        Allow improper rotations (reflections).
+    nprocs : int, optional
+        Number of processes, row blocks are then distributed over a process pool
+        which shares the frames and the output through shared memory.
+
+    Returns
+    -------
+    np.ndarray
+        (nframe * (nframe - 1) / 2, ) Condensed RMSD matrix ordered as ``scipy.spatial.distance.pdist``.
+    """
+    frames, weights = _conformer_arrays(conformers, weights)
+    nframe = frames.shape[0]
+    scaled, gyration, order = _prepare(frames, weights)
+    blocks = _row_blocks(nframe)
+    npairs = nframe * (nframe - 1) // 2
+
+    if nprocs == 1 or len(blocks) == 1:
+        out = np.full(npairs, np.inf)
+        for start, stop in blocks:
+            ii, jj, rmsd = _rmsd_rows(scaled, gyration, start, stop, threshold, mirror)
+            oi, oj = order[ii], order[jj]
+            out[_condensed_index(nframe, np.minimum(oi, oj), np.maximum(oi, oj))] = rmsd
+        return out
+
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    frames_shm = shared_memory.SharedMemory(create=True, size=scaled.nbytes)
+    out_shm = shared_memory.SharedMemory(create=True, size=max(1, npairs * 8))
+    try:
+        np.ndarray(scaled.shape, dtype=np.double, buffer=frames_shm.buf)[:] = scaled
+        np.ndarray((npairs, ), dtype=np.double, buffer=out_shm.buf)[:] = np.inf
+
+        tasks = [(frames_shm.name, scaled.shape, gyration, order, out_shm.name,
+                  blocks[iproc::nprocs], threshold, mirror) for iproc in range(nprocs)]
+        with ProcessPoolExecutor(max_workers=nprocs) as pool:
+            list(pool.map(_shared_worker, tasks))
+
+        return np.ndarray((npairs, ), dtype=np.double, buffer=out_shm.buf).copy()
+    finally:
+        frames_shm.close()
+        frames_shm.unlink()
+        out_shm.close()
+        out_shm.unlink()
+
+
+def cluster_conformers(conformers, threshold, weights=None, *, mirror=False, nprocs=1):
+    """Leader clustering of conformers by aligned RMSD.
+
+    Conformers are visited in the given order (for example sorted by energy); each joins
+    the first earlier leader within `threshold`, or otherwise becomes a new leader.
+
+    Parameters
+    ----------
+    conformers : Union[array_like, List[Molecule]]
+        (nframe, nat, 3) Geometries, or Molecules with identical atoms.
+    threshold : float
+        Largest RMSD between a conformer and its leader.
+    weights : array_like, optional
+        (nat, ) Weights of each atom. Defaults to the masses of Molecules, otherwise uniform.
+    mirror : bool, optional
+        Allow improper rotations (reflections).
+    nprocs : int, optional
+        Number of processes used by `pairwise_rmsd`.
+
+    Returns
+    -------
+    leaders : np.ndarray
+        Indices of the leader conformers in the order they were found.
+    assignments : np.ndarray
+        (nframe, ) Cluster of each conformer, an index into `leaders`.
+    """
+    rmsd = pairwise_rmsd(conformers, weights, threshold=threshold, mirror=mirror, nprocs=nprocs)
+    nframe = len(conformers)
+
+    leaders = []
+    assignments = np.empty(nframe, dtype=np.intp)
+    for i in range(nframe):
+        if leaders:
+            # Leaders always precede i, so their pairs are (leader, i)
+            candidates = np.array(leaders)
+            within = np.flatnonzero(rmsd[_condensed_index(nframe, candidates, i)] <= threshold)
+            if within.shape[0]:
+                assignments[i] = within[0]
+                continue
+
+        assignments[i] = len(leaders)
+        leaders.append(i)
+
+    return np.array(leaders, dtype=np.intp), assignments
@@ -0,0 +1,107 @@
+"""
+Rigid frame transforms of geometries and their derivative arrays
+"""
+
+import numpy as np
+
+
+class FrameTransform:
+    """Rigid change of frame ``x' = (x - shift) @ rotation`` applied to row vectors.
+
+    Either a single transform or a stack of transforms, one per frame, in which case the
+    leading dimensions of `shift` and `rotation` broadcast against those of the arrays
+    being transformed.
+
+    Attributes
+    ----------
+    shift : np.ndarray
+        (..., 3) Translation removed before rotating, such as the center of mass.
+    rotation : np.ndarray
+        (..., 3, 3) Orthogonal matrix whose columns are the new axes in the old frame.
+
+    Examples
+    --------
+
+    >>> mol = Molecule(orient=True, **data)
+    >>> transform = mol.get_frame_transform()
+    >>> gradient = transform.apply_gradient(input_frame_gradient)
+
+    """
+
+    __slots__ = ("shift", "rotation")
+
+    def __init__(self, shift, rotation):
+        self.shift = np.asarray(shift, dtype=np.double)
+        self.rotation = np.asarray(rotation, dtype=np.double)
+
+        if self.shift.shape[-1:] != (3, ) or self.rotation.shape[-2:] != (3, 3):
+            raise ValueError("Shift and rotation must have shapes (..., 3) and (..., 3, 3), found {} and {}.".format(
+                self.shift.shape, self.rotation.shape))
+
+    @classmethod
+    def identity(cls):
+        return cls(np.zeros(3), np.identity(3))
+
+    def __repr__(self):
+        return "FrameTransform(shift={}, rotation={})".format(self.shift.tolist(), self.rotation.tolist())
+
+    def __len__(self):
+        if self.shift.ndim == 1:
+            raise TypeError("A single FrameTransform has no length.")
+        return self.shift.shape[0]
+
+    def __getitem__(self, index):
+        return FrameTransform(self.shift[index], self.rotation[index])
+
+    def inverse(self):
+        """
+        Returns the transform back to the original frame.
+        """
+        rotation_t = np.swapaxes(self.rotation, -1, -2)
+        return FrameTransform(-np.einsum("...x,...xy->...y", self.shift, self.rotation), rotation_t)
+
+    def compose(self, other):
+        """
+        Returns the transform applying this transform followed by `other`.
+        """
+        return FrameTransform(self.shift + np.einsum("...x,...yx->...y", other.shift, self.rotation),
+                              self.rotation @ other.rotation)
+
+    def apply_geometry(self, geom, inverse=False):
+        """
+        Transforms (..., nat, 3) geometries into the new frame, or back if `inverse`.
+        """
+        geom = np.asarray(geom, dtype=np.double)
+        if inverse:
+            return geom @ np.swapaxes(self.rotation, -1, -2) + self.shift[..., None, :]
+        return (geom - self.shift[..., None, :]) @ self.rotation
+
+    def apply_gradient(self, gradient, inverse=False):
+        """
+        Transforms (..., nat, 3) gradients (or any Cartesian vectors) into the new frame, or back if `inverse`.
+        """
+        gradient = np.asarray(gradient, dtype=np.double)
+        if inverse:
+            return gradient @ np.swapaxes(self.rotation, -1, -2)
+        return gradient @ self.rotation
+
+    def apply_hessian(self, hessian, inverse=False):
+        """
+        Transforms (..., 3 nat, 3 nat) Hessians into the new frame, or back if `inverse`.
+
+        Each 3x3 atom-pair block ``H_IJ`` becomes ``R^T H_IJ R``, computed for all blocks
+        and all frames in a single contraction.
+        """
+        hessian = np.asarray(hessian, dtype=np.double)
+        n3 = hessian.shape[-1]
+        if hessian.shape[-2] != n3 or n3 % 3:
+            raise ValueError("Hessian must have shape (..., 3 nat, 3 nat), found {}.".format(hessian.shape))
+
+        rotation = self.rotation
+        if inverse:
+            rotation = np.swapaxes(rotation, -1, -2)
+
+        nat = n3 // 3
+        blocks = hessian.reshape(hessian.shape[:-2] + (nat, 3, nat, 3))
+        rotated = np.einsum("...ai,...IaJb,...bj->...IiJj", rotation, blocks, rotation, optimize=True)
+        return rotated.reshape(hessian.shape)
@@ -0,0 +1,378 @@
+"""
+Redundant internal coordinates and their Wilson B-matrix
+"""
+
+import numpy as np
+
+from .misc import compute_angle, compute_dihedral, compute_distance
+
+# Number of atoms of each kind of coordinate, in the order coordinates are listed
+_ARITY = (("stretches", 2), ("bends", 3), ("torsions", 4))
+
+
+def _bond_pairs(connectivity):
+    """
+    Returns the unique (nbond, 2) sorted atom pairs of a BondArray, (nbond, 2) or (nbond, 3) array_like.
+    """
+    if hasattr(connectivity, "atoms"):
+        pairs = np.asarray(connectivity.atoms)
+    else:
+        pairs = np.asarray(connectivity, dtype=np.double)
+        if pairs.size == 0:
+            pairs = pairs.reshape(0, 2)
+        if pairs.ndim != 2 or pairs.shape[1] not in (2, 3):
+            raise ValueError("Connectivity must be castable to shape (nbond, 2) or (nbond, 3), found {}.".format(
+                pairs.shape))
+        pairs = pairs[:, :2]
+
+    pairs = np.sort(pairs.astype(np.intp), axis=1)
+    if np.any(pairs[:, 0] == pairs[:, 1]) or np.any(pairs < 0):
+        raise ValueError("Connectivity may only bond distinct, non-negative atom indices.")
+    return np.unique(pairs, axis=0)
+
+
+def _neighbor_pairs(ptr):
+    """
+    For groups of consecutive entries delimited by `ptr`, returns the positions of all
+    pairs ``(i, j)`` with ``i < j`` within each group.
+    """
+    count = np.diff(ptr)
+    group = np.repeat(np.arange(count.shape[0]), count)
+
+    # Each entry pairs with the entries after it in its group
+    after = ptr[group + 1] - np.arange(ptr[-1]) - 1
+    first = np.repeat(np.arange(ptr[-1]), after)
+    second = first + 1 + np.arange(first.shape[0]) - np.repeat(np.cumsum(after) - after, after)
+    return first, second
+
+
+class InternalCoordinates:
+    """Redundant set of stretches, bends and torsions over the atoms of a molecule.
+
+    Coordinates are ordered stretches, then bends, then torsions. Stretches are in the
+    units of the geometry, bends and torsions in radians. Every evaluation is vectorized
+    over all coordinates of a kind, and over frames for (nframe, nat, 3) geometries.
+
+    Parameters
+    ----------
+    stretches : array_like, optional
+        (nstretch, 2) Atom indices of bond stretches.
+    bends : array_like, optional
+        (nbend, 3) Atom indices of angle bends, the vertex in the middle.
+    torsions : array_like, optional
+        (ntorsion, 4) Atom indices of dihedral torsions.
+
+    Examples
+    --------
+
+    >>> coords = InternalCoordinates.from_connectivity(mol.guess_connectivity(), mol.geometry)
+    >>> q = coords.values(mol.geometry)
+    >>> internal_gradient = coords.gradient_to_internal(mol.geometry, gradient)
+
+    """
+
+    def __init__(self, stretches=None, bends=None, torsions=None):
+        for (kind, arity), indices in zip(_ARITY, (stretches, bends, torsions)):
+            indices = np.zeros((0, arity), dtype=np.intp) if indices is None else np.asarray(indices, dtype=np.intp)
+            if indices.size == 0:
+                indices = indices.reshape(0, arity)
+            if indices.ndim != 2 or indices.shape[1] != arity:
+                raise ValueError("The {} must have shape (n, {}), found {}.".format(kind, arity, indices.shape))
+
+            if arity > 2:
+                distinct = np.sort(indices, axis=1)
+                if np.any(distinct[:, 1:] == distinct[:, :-1]):
+                    raise ValueError("The {} must each involve distinct atoms.".format(kind))
+            elif np.any(indices[:, 0] == indices[:, 1]):
+                raise ValueError("The stretches must each involve distinct atoms.")
+            setattr(self, kind, indices)
+
+    @classmethod
+    def from_connectivity(cls, connectivity, geometry=None, torsions=True, linear_threshold=175.0):
+        """
+        Generates all stretches, bends and torsions of a bond graph.
+
+        Every bond is a stretch, every pair of bonds sharing an atom a bend, and every
+        path of three bonds a torsion, excluding those closing a three-membered ring.
+
+        Parameters
+        ----------
+        connectivity : Union[BondArray, array_like]
+            Bonds as a Molecule's connectivity, or (nbond, 2) or (nbond, 3) rows.
+        geometry : array_like, optional
+            (nat, 3) Geometry used to drop near-linear bends and the torsions through them,
+            whose B-matrix rows are singular.
+        torsions : bool, optional
+            Generate torsions or not.
+        linear_threshold : float, optional
+            Bends at or above this angle [degrees] are near-linear.
+
+        Returns
+        -------
+        InternalCoordinates
+            The redundant coordinates of the graph.
+        """
+        pairs = _bond_pairs(connectivity)
+        nat = int(pairs.max()) + 1 if pairs.shape[0] else 0
+        if geometry is not None:
+            geometry = np.asarray(geometry, dtype=np.double).reshape(-1, 3)
+            if nat > geometry.shape[0]:
+                raise ValueError("Connectivity refers to atom {}, but the geometry has {} atoms.".format(
+                    nat - 1, geometry.shape[0]))
+            nat = geometry.shape[0]
+
+        # Directed edges grouped by their first atom
+        src = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        dst = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        order = np.lexsort((dst, src))
+        src, dst = src[order], dst[order]
+        ptr = np.searchsorted(src, np.arange(nat + 1))
+        degree = np.diff(ptr)
+
+        first, second = _neighbor_pairs(ptr)
+        bends = np.column_stack([dst[first], src[first], dst[second]])
+
+        linear = np.zeros((0, 3), dtype=np.intp)
+        if geometry is not None and bends.shape[0]:
+            angles = compute_angle(geometry[bends[:, 0]], geometry[bends[:, 1]], geometry[bends[:, 2]], degrees=True)
+            is_linear = angles >= linear_threshold
+            linear = np.column_stack([np.sort(bends[is_linear][:, [0, 2]], axis=1), bends[is_linear][:, 1]])
+            bends = bends[~is_linear]
+
+        if not torsions or pairs.shape[0] == 0:
+            return cls(pairs, bends, None)
+
+        # Each bond b-c extends to every a bonded to b and every d bonded to c
+        b, c = pairs[:, 0], pairs[:, 1]
+        count = degree[b] * degree[c]
+        bond = np.repeat(np.arange(pairs.shape[0]), count)
+        k = np.arange(bond.shape[0]) - np.repeat(np.cumsum(count) - count, count)
+        a = dst[ptr[b[bond]] + k // degree[c[bond]]]
+        d = dst[ptr[c[bond]] + k % degree[c[bond]]]
+        dihedrals = np.column_stack([a, b[bond], c[bond], d])
+
+        keep = (a != c[bond]) & (d != b[bond]) & (a != d)
+        if linear.shape[0]:
+            # Drop torsions whose a-b-c or b-c-d bend is near-linear
+            codes = (linear[:, 0] * nat + linear[:, 1]) * nat + linear[:, 2]
+            abc = (np.minimum(a, c[bond]) * nat + np.maximum(a, c[bond])) * nat + b[bond]
+            bcd = (np.minimum(b[bond], d) * nat + np.maximum(b[bond], d)) * nat + c[bond]
+            keep &= ~np.isin(abc, codes) & ~np.isin(bcd, codes)
+
+        return cls(pairs, bends, dihedrals[keep])
+
+    def __len__(self):
+        return self.stretches.shape[0] + self.bends.shape[0] + self.torsions.shape[0]
+
+    def __repr__(self):
+        return "InternalCoordinates(nstretch={}, nbend={}, ntorsion={})".format(
+            self.stretches.shape[0], self.bends.shape[0], self.torsions.shape[0])
+
+    @property
+    def indices(self):
+        """List of the atom indices of every coordinate, in order."""
+        return [list(x) for kind, _ in _ARITY for x in getattr(self, kind).tolist()]
+
+    @staticmethod
+    def _geometry(geometry):
+        geometry = np.asarray(geometry, dtype=np.double)
+        if geometry.ndim not in (2, 3) or geometry.shape[-1] != 3:
+            raise ValueError("Geometry must have shape (nat, 3) or (nframe, nat, 3), found {}.".format(
+                geometry.shape))
+        return geometry
+
+    def _check_atoms(self, nat):
+        for kind, _ in _ARITY:
+            indices = getattr(self, kind)
+            if indices.size and indices.max() >= nat:
+                raise ValueError("The {} refer to atom {}, but the geometry has {} atoms.".format(
+                    kind, indices.max(), nat))
+
+    def values(self, geometry):
+        """
+        Evaluates every coordinate.
+
+        Parameters
+        ----------
+        geometry : array_like
+            (nat, 3) Geometry or (nframe, nat, 3) stack of frames.
+
+        Returns
+        -------
+        np.ndarray
+            (ninternal, ) or (nframe, ninternal) Stretches, bends and torsions in order.
+        """
+        geometry = self._geometry(geometry)
+        self._check_atoms(geometry.shape[-2])
+
+        s, b, t = self.stretches, self.bends, self.torsions
+        ret = [
+            compute_distance(geometry[..., s[:, 0], :], geometry[..., s[:, 1], :]),
+            compute_angle(geometry[..., b[:, 0], :], geometry[..., b[:, 1], :], geometry[..., b[:, 2], :]),
+            compute_dihedral(*[geometry[..., t[:, x], :] for x in range(4)]),
+        ]
+        return np.concatenate([np.reshape(x, geometry.shape[:-2] + (-1, )) for x in ret], axis=-1)
+
+    def _derivatives(self, geometry):
+        """
+        Returns, per kind, the (..., n, arity, 3) derivatives of each coordinate with respect
+        to the Cartesian positions of its atoms.
+        """
+        geometry = self._geometry(geometry)
+        self._check_atoms(geometry.shape[-2])
+
+        def dot(x, y):
+            return np.einsum("...i,...i->...", x, y)[..., None]
+
+        # Stretch a-b, along the unit bond vector
+        s = self.stretches
+        u = geometry[..., s[:, 0], :] - geometry[..., s[:, 1], :]
+        u = u / np.sqrt(dot(u, u))
+        stretches = np.stack([u, -u], axis=-2)
+
+        # Bend a-b-c with vertex b
+        b = self.bends
+        u = geometry[..., b[:, 0], :] - geometry[..., b[:, 1], :]
+        v = geometry[..., b[:, 2], :] - geometry[..., b[:, 1], :]
+        lu, lv = np.sqrt(dot(u, u)), np.sqrt(dot(v, v))
+        u, v = u / lu, v / lv
+        cosine = np.clip(dot(u, v), -1.0, 1.0)
+        sine = np.sqrt(1.0 - cosine**2)
+        da = (cosine * u - v) / (lu * sine)
+        dc = (cosine * v - u) / (lv * sine)
+        bends = np.stack([da, -da - dc, dc], axis=-2)
+
+        # Torsion a-b-c-d about the b-c axis
+        t = self.torsions
+        f = geometry[..., t[:, 0], :] - geometry[..., t[:, 1], :]
+        g = geometry[..., t[:, 1], :] - geometry[..., t[:, 2], :]
+        h = geometry[..., t[:, 3], :] - geometry[..., t[:, 2], :]
+        a = np.cross(f, g)
+        c = np.cross(h, g)
+        lg = np.sqrt(dot(g, g))
+        a = a / dot(a, a)
+        c = c / dot(c, c)
+        da = -lg * a
+        dd = lg * c
+        shift = (dot(f, g) / lg) * a - (dot(h, g) / lg) * c
+        torsions = np.stack([da, -da + shift, -dd - shift, dd], axis=-2)
+
+        return stretches, bends, torsions
+
+    def b_matrix_coo(self, geometry):
+        """
+        Evaluates the nonzero entries of the Wilson B-matrix, 3 per atom of each coordinate.
+
+        Parameters
+        ----------
+        geometry : array_like
+            (nat, 3) Geometry or (nframe, nat, 3) stack of frames.
+
+        Returns
+        -------
+        rows : np.ndarray
+            (nnz, ) Coordinate index of each entry.
+        cols : np.ndarray
+            (nnz, ) Cartesian index ``3 * atom + xyz`` of each entry.
+        data : np.ndarray
+            (nnz, ) or (nframe, nnz) Derivatives of the coordinates.
+        """
+        derivatives = self._derivatives(geometry)
+
+        rows, cols, data = [], [], []
+        offset = 0
+        for (kind, arity), deriv in zip(_ARITY, derivatives):
+            indices = getattr(self, kind)
+            n = indices.shape[0]
+            rows.append(np.repeat(np.arange(offset, offset + n), 3 * arity))
+            cols.append((3 * indices[:, :, None] + np.arange(3)).ravel())
+            data.append(deriv.reshape(deriv.shape[:-3] + (-1, )))
+            offset += n
+
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(data, axis=-1)
+
+    def b_matrix(self, geometry, sparse=False):
+        """
+        Evaluates the Wilson B-matrix, the derivatives of the coordinates with respect to the Cartesians.
+
+        Parameters
+        ----------
+        geometry : array_like
+            (nat, 3) Geometry or (nframe, nat, 3) stack of frames.
+        sparse : bool, optional
+            Return a ``scipy.sparse.csr_matrix`` of a single geometry, requires SciPy. Each
+            row has at most 12 nonzero entries, see `b_matrix_coo` for the raw entries.
+
+        Returns
+        -------
+        np.ndarray
+            (ninternal, 3 nat) or (nframe, ninternal, 3 nat) B-matrix.
+        """
+        geometry = self._geometry(geometry)
+        rows, cols, data = self.b_matrix_coo(geometry)
+        shape = (len(self), 3 * geometry.shape[-2])
+
+        if sparse:
+            if geometry.ndim != 2:
+                raise ValueError("A sparse B-matrix is only available for a single geometry.")
+            from scipy.sparse import csr_matrix
+            return csr_matrix((data, (rows, cols)), shape=shape)
+
+        ret = np.zeros(geometry.shape[:-2] + shape)
+        ret[..., rows, cols] = data
+        return ret
+
+    def gradient_to_cartesian(self, geometry, gradient):
+        """
+        Transforms an internal coordinate gradient to the Cartesian one, ``g_x = B^T g_q``.
+
+        Parameters
+        ----------
+        geometry : array_like
+            (nat, 3) Geometry or (nframe, nat, 3) stack of frames.
+        gradient : array_like
+            (ninternal, ) or (nframe, ninternal) Gradient with respect to the coordinates.
+
+        Returns
+        -------
+        np.ndarray
+            (nat, 3) or (nframe, nat, 3) Cartesian gradient.
+        """
+        geometry = self._geometry(geometry)
+        gradient = np.asarray(gradient, dtype=np.double)
+        rows, cols, data = self.b_matrix_coo(geometry)
+
+        # Scatter each entry's contribution, never forming the dense B-matrix
+        contributions = data * gradient[..., rows]
+        ncart = 3 * geometry.shape[-2]
+        nframe = int(np.prod(geometry.shape[:-2]))
+        cols = (cols + ncart * np.arange(nframe)[:, None]).ravel()
+        ret = np.bincount(cols, weights=contributions.ravel(), minlength=nframe * ncart)
+        return ret.reshape(geometry.shape)
+
+    def gradient_to_internal(self, geometry, gradient, rcond=1.e-8):
+        """
+        Transforms a Cartesian gradient to the internal coordinates, ``g_q = G^- B g_x`` with
+        ``G = B B^T`` and ``G^-`` its generalized inverse, as the coordinates are redundant.
+
+        Parameters
+        ----------
+        geometry : array_like
+            (nat, 3) Geometry or (nframe, nat, 3) stack of frames.
+        gradient : array_like
+            (nat, 3) or (nframe, nat, 3) Cartesian gradient.
+        rcond : float, optional
+            Eigenvalues of G below `rcond` times the largest are treated as zero.
+
+        Returns
+        -------
+        np.ndarray
+            (ninternal, ) or (nframe, ninternal) Gradient with respect to the coordinates.
+        """
+        geometry = self._geometry(geometry)
+        gradient = np.asarray(gradient, dtype=np.double).reshape(geometry.shape[:-2] + (-1, ))
+
+        bmat = self.b_matrix(geometry)
+        gmat = bmat @ np.swapaxes(bmat, -1, -2)
+        projected = np.einsum("...qx,...x->...q", bmat, gradient)
+        return np.einsum("...pq,...q->...p", np.linalg.pinv(gmat, rcond=rcond, hermitian=True), projected)
@@ -1,3 +1,4 @@
+import collections
 import math
 import re
 
@@ -5,6 +6,9 @@ import numpy as np
 
 from ..physical_constants import constants
 
+# Maximum number of measurements evaluated at once over a stack of frames
+MEASURE_CHUNK_ELEMENTS = 2**18
+
 
 def distance_matrix(a, b):
     """Euclidean distance matrix between rows of arrays `a` and `b`. Equivalent to
@@ -138,48 +142,103 @@ def _norm(points):
     """
 
     tmp = np.atleast_2d(points)
-    return np.sqrt(np.einsum("ij,ij->i", tmp, tmp))
+    return np.sqrt(np.einsum("...i,...i->...", tmp, tmp))
 
 
-def measure_coordinates(coordinates, measurements, degrees=False):
+def measure_coordinates(coordinates, measurements, degrees=False, *, out=None):
     """
     Measures a geometry array based on 0-based indices provided, automatically detects distance, angle,
     and dihedral based on length of measurement input.
+
+    Parameters
+    ----------
+    coordinates : array_like
+        (nat, 3) The coordinates to measure or (nframe, nat, 3) a stack of frames to measure.
+    measurements : list or np.ndarray
+        A single measurement of 2-4 indices, a list of such measurements of mixed lengths,
+        or an (M, 2), (M, 3), or (M, 4) integer array of measurements.
+    degrees : bool, optional
+        Returns angles and dihedrals in degrees rather than radians if True
+    out : np.ndarray, optional
+        (M, ) or (nframe, M) buffer into which the measurements are written and returned.
+
+    Returns
+    -------
+    float, list, or np.ndarray
+        For a single geometry, a float for a single measurement, an (M, ) array for array input,
+        otherwise a list of floats in the order of `measurements`. For a stack of frames, an
+        (nframe, ) array for a single measurement, otherwise an (nframe, M) array.
+
+    Notes
+    -----
+    Measurements are grouped by length and each group is evaluated in a single vectorized call.
+    Stacks of frames are evaluated in chunks of frames to bound the size of intermediates.
     """
 
     coordinates = np.atleast_2d(coordinates)
-    num_coords = coordinates.shape[0]
+    frames = coordinates.ndim == 3
+    num_coords = coordinates.shape[-2]
 
     single = False
-    if isinstance(measurements[0], int):
-        measurements = [measurements]
-        single = True
-
-    ret = []
-    for num, m in enumerate(measurements):
-        if any(x >= num_coords for x in m):
-            raise ValueError("An index of measurement {} is out of bounds.".format(num))
-
-        kwargs = {}
-        if len(m) == 2:
-            func = compute_distance
-        elif len(m) == 3:
-            func = compute_angle
-            kwargs = {"degrees": degrees}
-        elif len(m) == 4:
-            func = compute_dihedral
-            kwargs = {"degrees": degrees}
-        else:
+    as_array = isinstance(measurements, np.ndarray)
+    if as_array:
+        if measurements.ndim == 1:
+            measurements = measurements.reshape(1, -1)
+            single = True
+        groups = {measurements.shape[1]: (np.arange(measurements.shape[0]), measurements)}
+        nmeasure = measurements.shape[0]
+    else:
+        if isinstance(measurements[0], (int, np.integer)):
+            measurements = [measurements]
+            single = True
+
+        by_arity = collections.defaultdict(list)
+        for num, m in enumerate(measurements):
+            by_arity[len(m)].append(num)
+        groups = {
+            arity: (np.array(nums), np.array([measurements[num] for num in nums], dtype=int))
+            for arity, nums in by_arity.items()
+        }
+        nmeasure = len(measurements)
+
+    shape = (coordinates.shape[0], nmeasure) if frames else (nmeasure, )
+    if out is None:
+        ret = np.empty(shape)
+    elif out.shape == shape:
+        ret = out
+    else:
+        raise ValueError("Output buffer has shape {}, expected {}.".format(out.shape, shape))
+
+    for arity, (nums, indices) in groups.items():
+        if arity not in _measure_kernels:
             raise KeyError("Unrecognized number of arguements for measurement {}, found {}, expected 2-4.".format(
-                num, len(m)))
+                nums[0], arity))
 
-        val = func(*[coordinates[x] for x in m], **kwargs)
-        ret.append(float(val))
+        bad = np.any(indices >= num_coords, axis=1)
+        if np.any(bad):
+            raise ValueError("An index of measurement {} is out of bounds.".format(nums[np.argmax(bad)]))
 
-    if single:
-        return ret[0]
-    else:
+        func, takes_degrees = _measure_kernels[arity]
+        kwargs = {"degrees": degrees} if takes_degrees else {}
+
+        if frames:
+            step = max(1, MEASURE_CHUNK_ELEMENTS // len(nums))
+            for start in range(0, coordinates.shape[0], step):
+                block = coordinates[start:start + step]
+                ret[start:start + step, nums] = func(*[block[:, indices[:, x]] for x in range(arity)], **kwargs)
+        else:
+            ret[nums] = func(*[coordinates[indices[:, x]] for x in range(arity)], **kwargs)
+
+    if out is not None:
+        return out
+    elif frames:
+        return ret[:, 0] if single else ret
+    elif single:
+        return float(ret[0])
+    elif as_array:
         return ret
+    else:
+        return ret.tolist()
 
 
 def compute_distance(points1, points2):
@@ -189,9 +248,9 @@ def compute_distance(points1, points2):
     Parameters
     ----------
     points1 : np.ndarray
-        The first list of points, can be 1D or 2D
+        The first list of points, can be 1D, 2D, or a stack of frames
     points2 : np.ndarray
-        The second list of points, can be 1D or 2D
+        The second list of points, can be 1D, 2D, or a stack of frames
 
     Returns
     -------
@@ -216,11 +275,11 @@ def compute_angle(points1, points2, points3, degrees=False):
     Parameters
     ----------
     points1 : np.ndarray
-        The first list of points, can be 1D or 2D
+        The first list of points, can be 1D, 2D, or a stack of frames
     points2 : np.ndarray
-        The second list of points, can be 1D or 2D
+        The second list of points, can be 1D, 2D, or a stack of frames
     points3 : np.ndarray
-        The third list of points, can be 1D or 2D
+        The third list of points, can be 1D, 2D, or a stack of frames
     degrees : bool, options
         Returns the angle in degrees rather than radians if True
 
@@ -242,7 +301,7 @@ def compute_angle(points1, points2, points3, degrees=False):
     v23 = points2 - points3
 
     denom = _norm(v12) * _norm(v23)
-    cosine_angle = np.einsum("ij,ij->i", v12, v23) / denom
+    cosine_angle = np.einsum("...i,...i->...", v12, v23) / denom
 
     angle = np.pi - np.arccos(cosine_angle)
 
@@ -259,13 +318,13 @@ def compute_dihedral(points1, points2, points3, points4, degrees=False):
     Parameters
     ----------
     points1 : np.ndarray
-        The first list of points, can be 1D or 2D
+        The first list of points, can be 1D, 2D, or a stack of frames
     points2 : np.ndarray
-        The second list of points, can be 1D or 2D
+        The second list of points, can be 1D, 2D, or a stack of frames
     points3 : np.ndarray
-        The third list of points, can be 1D or 2D
+        The third list of points, can be 1D, 2D, or a stack of frames
     points4 : np.ndarray
-        The third list of points, can be 1D or 2D
+        The third list of points, can be 1D, 2D, or a stack of frames
     degrees : bool, options
         Returns the dihedral angle in degrees rather than radians if True
 
@@ -292,22 +351,30 @@ def compute_dihedral(points1, points2, points3, points4, degrees=False):
     v3 = points4 - points3
 
     # Normalize the central vector
-    v2 = v2 / _norm(v2)
+    v2 = v2 / _norm(v2)[..., None]
 
     # v = projection of b0 onto plane perpendicular to b1
     #   = b0 minus component that aligns with b1
     # w = projection of b2 onto plane perpendicular to b1
     #   = b2 minus component that aligns with b1
-    v = v1 - np.einsum("ij,ij->i", v1, v1) * v2
-    w = v3 - np.einsum("ij,ij->i", v3, v2) * v2
+    v = v1 - np.einsum("...i,...i->...", v1, v2)[..., None] * v2
+    w = v3 - np.einsum("...i,...i->...", v3, v2)[..., None] * v2
 
     # angle between v and w in a plane is the torsion angle
     # v and w may not be normalized but that's fine since tan is y/x
-    x = np.einsum("ij,ij->i", v, w)
-    y = np.einsum("ij,ij->i", np.cross(v2, v), w)
+    x = np.einsum("...i,...i->...", v, w)
+    y = np.einsum("...i,...i->...", np.cross(v2, v), w)
     angle = np.arctan2(y, x)
 
     if degrees:
         return np.degrees(angle)
     else:
         return angle
+
+
+# Measurement kernels by number of indices, and whether they accept `degrees`
+_measure_kernels = {
+    2: (compute_distance, False),
+    3: (compute_angle, True),
+    4: (compute_dihedral, True),
+}
@@ -0,0 +1,237 @@
+"""
+Detection of the largest Abelian point group of a geometry
+"""
+
+import itertools
+
+import numpy as np
+
+# Axis sign patterns of the D2h operations, applied to row vectors in the symmetry frame
+_OPERATIONS = {
+    "E": (1, 1, 1),
+    "C2(z)": (-1, -1, 1),
+    "C2(y)": (-1, 1, -1),
+    "C2(x)": (1, -1, -1),
+    "i": (-1, -1, -1),
+    "sigma(xy)": (1, 1, -1),
+    "sigma(xz)": (1, -1, 1),
+    "sigma(yz)": (-1, 1, 1),
+}
+
+# Offsets of the 27 tolerance cells around a cell
+_NEIGHBORS = np.array(list(itertools.product([-1, 0, 1], repeat=3)))
+
+
+class _CellLookup:
+    """Hashed lookup of atoms by element label and tolerance-sized cell.
+
+    Cells and labels are packed into one integer key; a query checks the 27 cells
+    around a point with a single sorted search, O(N log N) for N queries.
+    """
+
+    def __init__(self, geom, labels, tolerance):
+        self.geom = geom
+        self.labels = labels
+        self.tolerance = tolerance
+
+        cells = np.floor(geom / tolerance).astype(np.int64)
+        extent = np.abs(cells).max(initial=0) + 2
+        self.base = np.int64(2 * extent + 1)
+        if int(labels.max(initial=0) + 1) * int(self.base)**3 >= 2**62:
+            raise ValueError("Geometry is too large to bucket with tolerance {}.".format(tolerance))
+        self.extent = extent
+
+        keys = self._keys(cells, labels)
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def _keys(self, cells, labels):
+        cells = cells + self.extent
+        return ((labels * self.base + cells[..., 0]) * self.base + cells[..., 1]) * self.base + cells[..., 2]
+
+    def match(self, points, labels):
+        """
+        Returns the index of the nearest atom with the given label within tolerance of each point, or -1.
+        """
+        cells = np.floor(points / self.tolerance).astype(np.int64)
+        cells = np.clip(cells[:, None, :] + _NEIGHBORS[None, :, :], -self.extent, self.extent)
+        keys = self._keys(cells, labels[:, None]).ravel()
+
+        # Every atom stored under a matching key is a candidate, several may share a cell
+        left = np.searchsorted(self.sorted_keys, keys, side="left")
+        counts = np.searchsorted(self.sorted_keys, keys, side="right") - left
+        query = np.repeat(np.arange(keys.shape[0]) // _NEIGHBORS.shape[0], counts)
+        pos = np.repeat(left - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        candidates = self.order[pos]
+
+        diff = self.geom[candidates] - points[query]
+        distance = np.einsum("ix,ix->i", diff, diff)
+        valid = distance <= self.tolerance**2
+        query, candidates, distance = query[valid], candidates[valid], distance[valid]
+
+        # lexsort uses the last key as the primary one
+        nearest = np.lexsort((distance, query))
+        query, candidates = query[nearest], candidates[nearest]
+        first = np.ones(query.shape[0], dtype=bool)
+        first[1:] = query[1:] != query[:-1]
+
+        ret = np.full(points.shape[0], -1, dtype=np.intp)
+        ret[query[first]] = candidates[first]
+        return ret
+
+
+def _point_group_name(operations):
+    """
+    Schoenflies symbol of the Abelian group formed by `operations`.
+    """
+    order = len(operations)
+    rotations = sum(1 for op in operations if op.startswith("C2"))
+    if order == 8:
+        return "d2h"
+    elif order == 4:
+        if rotations == 3:
+            return "d2"
+        return "c2h" if "i" in operations else "c2v"
+    elif order == 2:
+        if rotations:
+            return "c2"
+        return "ci" if "i" in operations else "cs"
+    return "c1"
+
+
+def _frame_symmetry(geom, lookup, atoms=None, names=_OPERATIONS):
+    """
+    Returns the operations of D2h among `names` which map `geom` (or its `atoms` subset)
+    onto itself and the atom permutation of each.
+    """
+    atoms = slice(None) if atoms is None else atoms
+    points = geom[atoms]
+    labels = lookup.labels[atoms]
+
+    operations = {}
+    for name in names:
+        image = lookup.match(points * np.array(_OPERATIONS[name]), labels)
+        if (image >= 0).all():
+            operations[name] = image
+    return operations
+
+
+def _shell_directions(geom, labels, tolerance):
+    """
+    Unit vectors toward the atoms, and the midpoints of atom pairs, of the smallest set of
+    several atoms sharing a label and distance from the origin; these contain the candidate axes.
+    """
+    radius = np.linalg.norm(geom, axis=1)
+    off_center = radius > tolerance
+    if not off_center.any():
+        return np.zeros((0, 3))
+
+    # Lone atoms lie on every symmetry element, so only shells of two or more atoms are useful
+    shell_keys = np.stack([labels[off_center], np.round(radius[off_center] / tolerance)], axis=1)
+    keys, inverse, counts = np.unique(shell_keys, axis=0, return_inverse=True, return_counts=True)
+    if counts.max() < 2:
+        return np.zeros((0, 3))
+    shell = geom[off_center][inverse.ravel() == np.argmin(np.where(counts > 1, counts, np.inf))]
+
+    iu, ju = np.triu_indices(shell.shape[0], 1)
+    directions = np.concatenate((shell, shell[iu] + shell[ju]))
+    norms = np.linalg.norm(directions, axis=1)
+    return directions[norms > tolerance] / norms[norms > tolerance, None]
+
+
+def _candidate_frames(geom, labels, moments, tolerance):
+    """
+    Yields rotations (as columns) of the inertial frame in which to test the D2h operations.
+
+    Principal axes with degenerate moments are arbitrary within their plane (or sphere),
+    so the degenerate axes are also tried along atom and atom-pair midpoint directions.
+    """
+    yield np.identity(3)
+
+    degenerate = np.isclose(moments[:, None], moments[None, :], rtol=1.e-2, atol=1.e-8)
+    ndegenerate = degenerate.sum(axis=1).max()
+    if ndegenerate == 1:
+        return
+
+    directions = _shell_directions(geom, labels, tolerance)
+    if ndegenerate == 2:
+        # Symmetric top, rotate about the unique axis
+        unique_axis = np.identity(3)[np.argmin(degenerate.sum(axis=1))]
+        in_plane = directions - np.outer(directions @ unique_axis, unique_axis)
+        norms = np.linalg.norm(in_plane, axis=1)
+        for first in in_plane[norms > 1.e-6] / norms[norms > 1.e-6, None]:
+            yield np.column_stack((first, np.cross(unique_axis, first), unique_axis))
+    else:
+        # Spherical top, any two orthogonal directions
+        overlap = np.abs(directions @ directions.T)
+        for a, b in zip(*np.nonzero(np.triu(overlap < 1.e-3, 1))):
+            yield np.column_stack((directions[a], directions[b], np.cross(directions[a], directions[b])))
+
+
+def detect_point_group(geom, labels, masses, tolerance=0.05):
+    """Finds the largest Abelian point group (a subgroup of D2h) of a geometry.
+
+    Operations are tested in the inertial frame and, for symmetric or spherical tops,
+    in frames rotated about the degenerate axes. Each operation is tested for all atoms
+    at once through a hashed, tolerance-bucketed atom lookup.
+
+    Parameters
+    ----------
+    geom : array_like
+        (nat, 3) Geometry [a0].
+    labels : array_like
+        (nat, ) Integer labels, only atoms with equal labels are interchangeable.
+    masses : array_like
+        (nat, ) Atomic masses defining the inertial frame.
+    tolerance : float, optional
+        Largest distance [a0] between an atom and the image of its symmetry partner.
+
+    Returns
+    -------
+    dict
+        ``point_group``: Schoenflies symbol such as ``"c2v"``;
+        ``operations``: names of the symmetry operations;
+        ``unique_atoms``: lowest index atom of each set of symmetry-equivalent atoms;
+        ``geometry``: (nat, 3) the geometry in the frame of the operations.
+    """
+    geom = np.asarray(geom, dtype=np.double).reshape(-1, 3)
+    labels = np.unique(np.asarray(labels), return_inverse=True)[1].ravel().astype(np.int64)
+    masses = np.asarray(masses, dtype=np.double)
+
+    # Inertial frame
+    geom = geom - masses @ geom / masses.sum()
+    tensor = -np.einsum("i,ij,ik->jk", masses, geom, geom)
+    tensor[np.diag_indices(3)] -= np.trace(tensor)
+    moments, axes = np.linalg.eigh(tensor)
+    geom = geom @ axes
+
+    # Screening a frame on the outermost atoms rejects most candidate frames cheaply
+    outer = np.argsort(-np.linalg.norm(geom, axis=1), kind="stable")[:16]
+
+    best = None
+    for rotation in _candidate_frames(geom, labels, moments, tolerance):
+        frame = geom @ rotation
+        lookup = _CellLookup(frame, labels, tolerance)
+        if best is not None:
+            screened = _frame_symmetry(frame, lookup, atoms=outer)
+            if len(screened) <= len(best[0]):
+                continue
+            operations = _frame_symmetry(frame, lookup, names=list(screened))
+        else:
+            operations = _frame_symmetry(frame, lookup)
+
+        if best is None or len(operations) > len(best[0]):
+            best = (operations, frame)
+        if len(operations) == len(_OPERATIONS):
+            break
+
+    operations, frame = best
+    images = np.array(list(operations.values()))
+    unique_atoms = np.flatnonzero(images.min(axis=0) == np.arange(frame.shape[0]))
+
+    return {
+        "point_group": _point_group_name(list(operations)),
+        "operations": list(operations),
+        "unique_atoms": unique_atoms.tolist(),
+        "geometry": frame,
+    }